@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from bill.models import Category
+from bill.reports import month_report
+from .prompt import generate_analysis_prompt
+
+# 支出超过收入的这个比例时给出警告并请AI提建议
+WARNING_RATIO = Decimal('0.7')
+
+
+def prepare_analysis(ledger_id, year, month):
+    """
+    从月度汇总表统计本月收支，返回 (是否警告, 提示词)；不需要调用AI时提示词为 None
+    """
+    report = month_report(ledger_id, year, month)
+    income = report.income
+    expense = report.expense
+
+    # 检查支出是否超过收入的70%
+    is_warning = expense > (income * WARNING_RATIO)
+    if not is_warning:
+        return is_warning, None
+
+    # 生成类别支出摘要
+    category_summary = "\n".join([
+        f"{Category.detail_type_name(Category.EXPENSE, detail_type)}：{total}元"
+        for detail_type, total in report.categories_of(Category.EXPENSE)
+    ])
+    return is_warning, generate_analysis_prompt(income, expense, category_summary)
+
+
+def finish_analysis(is_warning, ai_response=None):
+    """组装分析结果；需要AI回复却没有得到时抛出 ValueError"""
+    if is_warning:
+        if not ai_response:
+            raise ValueError("AI未返回任何响应")
+        ai_response = "本月支出较多，" + ai_response
+    else:
+        ai_response = "本月支出正常，继续保持！"
+    return {
+        'response': ai_response,
+        'is_warning': is_warning
+    }
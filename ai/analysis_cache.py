@@ -0,0 +1,57 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class AnalysisCache:
+    """
+    analyze_ledger 的结果缓存，键为 (账本, 年, 月, 账本数据版本)。
+    账单每次写入都会让账本的数据版本加一，所以账单没有变化时重复请求直接返回上次的结果，
+    不再重新统计，也不再调用AI；旧版本的条目不再被读取，过期后自然清除。
+    """
+
+    def __init__(self, timeout=24 * 3600):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(ledger_id, year, month, version):
+        return f'ai:analysis:{ledger_id}:{year}:{month}:{version}'
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, ledger_id, year, month, version):
+        result = cache.get(self._key(ledger_id, year, month, version))
+        self._count(result is not None)
+        return result
+
+    def set(self, ledger_id, year, month, version, result):
+        cache.set(self._key(ledger_id, year, month, version), result, self.timeout)
+
+    async def aget(self, ledger_id, year, month, version):
+        result = await cache.aget(self._key(ledger_id, year, month, version))
+        self._count(result is not None)
+        return result
+
+    async def aset(self, ledger_id, year, month, version, result):
+        await cache.aset(self._key(ledger_id, year, month, version), result, self.timeout)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+analysis_cache = AnalysisCache(timeout=getattr(settings, 'AI_ANALYSIS_CACHE_TIMEOUT', 24 * 3600))
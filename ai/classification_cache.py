@@ -0,0 +1,223 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import caches
+
+from bill.models import Category
+
+# 金额及其前后的货币符号/单位，例如 "8元"、"¥25"、"4块钱"
+AMOUNT_RE = re.compile(r'[¥￥]?\s*(\d+(?:\.\d+)?)\s*(?:块钱|块|元|rmb)?')
+# 归一化时去掉的空白和标点
+STRIP_RE = re.compile(r'[\s,.!?;:~，。！？；：、～…"\'“”‘’]+')
+
+AMOUNT_PLACEHOLDER = '#'
+# 缓存的字段：分类结果与回复，不含金额（金额从消息里取）
+CACHED_FIELDS = ('inOutType', 'detail_type', 'remark', 'response', 'emoji')
+# 提示词变化时修改版本号，旧的缓存条目自然失效
+KEY_PREFIX = 'ai:bill_chat:v1:'
+
+
+def normalize_message(message):
+    """
+    把消息归一化为缓存键，并取出其中的金额：
+    "午饭 25元" 和 "午饭25块" 都归一化为 "午饭#"，金额为 Decimal('25')。
+    消息中不是恰好一个金额时返回 (None, None)，表示不可缓存。
+    """
+    text = unicodedata.normalize('NFKC', message).lower()
+    amounts = AMOUNT_RE.findall(text)
+    if len(amounts) != 1:
+        return None, None
+    text = AMOUNT_RE.sub(AMOUNT_PLACEHOLDER, text)
+    text = STRIP_RE.sub('', text)
+    if text == AMOUNT_PLACEHOLDER:
+        return None, None
+    return text, Decimal(amounts[0])
+
+
+def _cache_key(normalized):
+    return KEY_PREFIX + hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+class LocalLRUBackend:
+    """进程内缓存：按最近使用淘汰，条目超过 ttl 秒后失效"""
+
+    name = 'local'
+
+    def __init__(self, max_entries=10000, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+
+class DjangoCacheBackend:
+    """使用 Django 缓存（settings.CACHES），多个进程可共享；淘汰策略由缓存后端决定"""
+
+    name = 'django'
+
+    def __init__(self, alias='default', ttl=7 * 24 * 3600):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, value):
+        await self.cache.aset(key, value, self.ttl)
+
+
+BACKENDS = {
+    LocalLRUBackend.name: LocalLRUBackend,
+    DjangoCacheBackend.name: DjangoCacheBackend,
+}
+
+
+class ClassificationCache:
+    """
+    bill_chat 的分类结果缓存。命中时直接用缓存的分类和消息里的金额建账单，不调用AI。
+    同时统计命中率，并按未命中时AI调用的平均耗时估算节省的时间。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        options = dict(getattr(settings, 'AI_CLASSIFICATION_CACHE', {}))
+        backend = options.pop('BACKEND', 'local')
+        kwargs = {'ttl': options.get('TTL', 7 * 24 * 3600)}
+        if backend == LocalLRUBackend.name:
+            kwargs['max_entries'] = options.get('MAX_ENTRIES', 10000)
+        else:
+            kwargs['alias'] = options.get('ALIAS', 'default')
+        return cls(BACKENDS[backend](**kwargs))
+
+    def _avg_llm_seconds(self):
+        return self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+
+    def _hit(self, entry, amount):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += self._avg_llm_seconds()
+        return {**entry, 'amount': str(amount)}
+
+    def _miss(self, normalized):
+        with self._lock:
+            if normalized is None:
+                self.uncacheable += 1
+            else:
+                self.misses += 1
+
+    def _entry(self, amount, data):
+        # 只缓存金额与消息一致、类别合法的结果，避免把AI的错误结果反复复用
+        try:
+            if Decimal(str(data['amount'])) != amount:
+                return None
+        except (KeyError, InvalidOperation):
+            return None
+        entry = {field: str(data[field]) for field in CACHED_FIELDS if field in data}
+        if len(entry) != len(CACHED_FIELDS):
+            return None
+        if entry['detail_type'] not in Category.DETAIL_TYPE_NAMES.get(entry['inOutType'], {}):
+            return None
+        return entry
+
+    def record_llm_call(self, seconds):
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def lookup(self, message):
+        normalized, amount = normalize_message(message)
+        entry = self.backend.get(_cache_key(normalized)) if normalized else None
+        if entry is None:
+            self._miss(normalized)
+            return None
+        return self._hit(entry, amount)
+
+    def store(self, message, data):
+        normalized, amount = normalize_message(message)
+        entry = normalized and self._entry(amount, data)
+        if entry:
+            self.backend.set(_cache_key(normalized), entry)
+
+    async def alookup(self, message):
+        normalized, amount = normalize_message(message)
+        entry = await self.backend.aget(_cache_key(normalized)) if normalized else None
+        if entry is None:
+            self._miss(normalized)
+            return None
+        return self._hit(entry, amount)
+
+    async def astore(self, message, data):
+        normalized, amount = normalize_message(message)
+        entry = normalized and self._entry(amount, data)
+        if entry:
+            await self.backend.aset(_cache_key(normalized), entry)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'backend': self.backend.name,
+                'hits': self.hits,
+                'misses': self.misses,
+                'uncacheable': self.uncacheable,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'llm_calls': self.llm_calls,
+                'avg_llm_seconds': round(self._avg_llm_seconds(), 3),
+                'saved_seconds': round(self.saved_seconds, 3),
+            }
+        if isinstance(self.backend, LocalLRUBackend):
+            stats['entries'] = len(self.backend)
+        return stats
+
+
+classification_cache = ClassificationCache.from_settings()
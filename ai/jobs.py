@@ -0,0 +1,182 @@
+"""
+基于数据库的轻量任务队列，用于在后台执行账本分析（不依赖外部消息队列）。
+
+- 任务即 AnalysisJob 表中的一行，工作线程用条件 UPDATE 领取任务，多个线程、多个进程同时领取也只有一个成功；
+- 执行失败按指数退避重试，超过 MAX_ATTEMPTS 次标记为失败；
+- 领取后超过 LEASE_SECONDS 仍未完成（例如进程退出）的任务会被重新领取；
+- 完成或失败超过 RETENTION_DAYS 天的任务由工作线程每隔 PRUNE_INTERVAL 秒清理一次（也可运行 prune_ai_jobs）。
+
+Web 进程启动时如果还有未完成的任务（包括上次退出时执行到一半的），立即启动 WORKERS 个工作线程，
+否则在第一次提交任务时启动；WORKERS 为 0 时不在 Web 进程中执行任务，需要另外运行 python manage.py run_ai_workers。
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from bill.versions import data_version
+from .analysis import finish_analysis, prepare_analysis
+from .analysis_cache import analysis_cache
+from .models import AnalysisJob
+from .openai_client import ai_client
+
+logger = logging.getLogger(__name__)
+
+
+def _option(name, default):
+    return getattr(settings, 'AI_JOBS', {}).get(name, default)
+
+
+_wakeup = threading.Event()
+_started = False
+_lock = threading.Lock()
+_next_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def ensure_workers():
+    global _started
+    count = _option('WORKERS', 2)
+    if _started or count <= 0:
+        return
+    with _lock:
+        if _started:
+            return
+        for i in range(count):
+            threading.Thread(target=work, name=f'ai-job-worker-{i}', daemon=True).start()
+        _started = True
+
+
+def reclaim_expired_leases():
+    """把租约已过期的执行中任务（例如进程退出时正在执行的）放回等待队列，返回任务数"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=_option('LEASE_SECONDS', 300))
+    return AnalysisJob.objects.filter(status=AnalysisJob.RUNNING, update_time__lt=stale).update(
+        status=AnalysisJob.PENDING, run_after=now, update_time=now
+    )
+
+
+def resume_jobs():
+    """
+    Web 进程启动时调用：回收过期的租约，还有未完成的任务时立即启动工作线程，
+    不必等到下一次提交任务。租约尚未过期的任务由工作线程在过期后重新领取。
+    """
+    try:
+        reclaim_expired_leases()
+        unfinished = AnalysisJob.objects.filter(status__in=[AnalysisJob.PENDING, AnalysisJob.RUNNING]).exists()
+    except DatabaseError:
+        # 数据库尚未迁移等情况下跳过
+        return
+    if unfinished:
+        ensure_workers()
+        _wakeup.set()
+
+
+def expired_jobs(days=None):
+    """完成或失败超过 days 天（默认 RETENTION_DAYS）的任务"""
+    days = _option('RETENTION_DAYS', 7) if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return AnalysisJob.objects.filter(status__in=[AnalysisJob.DONE, AnalysisJob.FAILED], update_time__lt=cutoff)
+
+
+def prune_jobs(days=None):
+    """删除过期的任务，返回删除的条数"""
+    return expired_jobs(days).delete()[0]
+
+
+def _prune_if_due():
+    # 同一进程中的多个工作线程只有一个执行清理
+    global _next_prune
+    now = time.monotonic()
+    with _prune_lock:
+        if now < _next_prune:
+            return
+        _next_prune = now + _option('PRUNE_INTERVAL', 3600)
+    pruned = prune_jobs()
+    if pruned:
+        logger.info("已清理 %s 个过期的账本分析任务", pruned)
+
+
+def enqueue_analysis(ledger_id, year, month):
+    """
+    提交账本当前数据版本的分析任务并返回。相同账本、月份、数据版本的任务只有一个：
+    已存在时直接返回（进行中的继续等待，已完成的带有结果），之前失败的重新排队。
+    """
+    version = data_version(ledger_id)
+    # 该版本已经在接口中同步分析过时，直接记为完成
+    cached = analysis_cache.get(ledger_id, year, month, version)
+    job, created = AnalysisJob.objects.get_or_create(
+        ledger_id=ledger_id, year=year, month=month, data_version=version,
+        defaults={'status': AnalysisJob.DONE, 'result': cached} if cached else {},
+    )
+    if job.status == AnalysisJob.FAILED:
+        AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.FAILED).update(
+            status=AnalysisJob.PENDING, attempts=0, error='', run_after=timezone.now(), update_time=timezone.now()
+        )
+        job.refresh_from_db()
+    if job.status == AnalysisJob.PENDING:
+        ensure_workers()
+        _wakeup.set()
+    return job
+
+
+def claim_job():
+    """领取一个可执行的任务，没有时返回 None"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=_option('LEASE_SECONDS', 300))
+    claimable = (
+        Q(status=AnalysisJob.PENDING, run_after__lte=now)
+        | Q(status=AnalysisJob.RUNNING, update_time__lt=stale)
+    )
+    candidates = AnalysisJob.objects.filter(claimable).order_by('run_after').values_list('pk', flat=True)[:5]
+    for pk in candidates:
+        # 条件更新：其他线程已经领取时影响行数为 0
+        claimed = AnalysisJob.objects.filter(claimable, pk=pk).update(
+            status=AnalysisJob.RUNNING, attempts=F('attempts') + 1, update_time=now
+        )
+        if claimed:
+            return AnalysisJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    try:
+        is_warning, prompt = prepare_analysis(job.ledger_id, job.year, job.month)
+        result = finish_analysis(is_warning, ai_client.get_chat_response(prompt, purpose='analysis') if prompt else None)
+    except Exception as e:
+        now = timezone.now()
+        if job.attempts < _option('MAX_ATTEMPTS', 3):
+            delay = _option('RETRY_DELAY', 5) * 2 ** (job.attempts - 1)
+            AnalysisJob.objects.filter(pk=job.pk).update(
+                status=AnalysisJob.PENDING, error=str(e), run_after=now + timedelta(seconds=delay), update_time=now
+            )
+        else:
+            AnalysisJob.objects.filter(pk=job.pk).update(status=AnalysisJob.FAILED, error=str(e), update_time=now)
+        logger.warning("账本分析任务 %s 第 %s 次执行失败：%s", job.pk, job.attempts, e)
+        return
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.DONE, result=result, error='', update_time=timezone.now()
+    )
+    analysis_cache.set(job.ledger_id, job.year, job.month, job.data_version, result)
+
+
+def work(stop=None):
+    """工作线程主循环：有任务就执行，没有任务时等待新任务提交或每隔 POLL_INTERVAL 秒检查一次"""
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        try:
+            _prune_if_due()
+            job = claim_job()
+            if job is not None:
+                run_job(job)
+                continue
+        except Exception:
+            logger.exception("账本分析任务执行出错")
+        if _wakeup.wait(_option('POLL_INTERVAL', 2)):
+            _wakeup.clear()
@@ -0,0 +1,281 @@
+import math
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+
+from django.conf import settings
+
+from bill.categories import category_key
+from bill.models import Bill, Category, Ledger
+from .classification_cache import AMOUNT_RE, STRIP_RE, normalize_message
+
+Prediction = namedtuple('Prediction', ['inOutType', 'detail_type', 'confidence', 'source'])
+
+# 类别名称以外的常用说法，键为 (inOutType, detail_type)
+KEYWORDS = {
+    (Category.INCOME, '1'): ['薪水', '薪资', '月薪', '发工资'],
+    (Category.INCOME, '3'): ['年终奖', '绩效', '奖学金'],
+    (Category.INCOME, '4'): ['利息', '分红', '收益'],
+    (Category.INCOME, '5'): ['收到红包', '抢红包'],
+    (Category.INCOME, '6'): ['兼职', '副业'],
+    (Category.INCOME, '7'): ['零用钱'],
+    (Category.EXPENSE, '1'): ['早餐', '早饭', '午餐', '午饭', '晚餐', '晚饭', '夜宵', '宵夜', '外卖', '食堂',
+                              '吃饭', '聚餐', '火锅', '烧烤', '麻辣烫', '快餐'],
+    (Category.EXPENSE, '2'): ['地铁', '公交', '打车', '滴滴', '出租车', '高铁', '火车', '机票', '车费', '单车'],
+    (Category.EXPENSE, '3'): ['纸巾', '洗衣液', '牙膏', '洗发水', '超市'],
+    (Category.EXPENSE, '4'): ['淘宝', '京东', '拼多多', '网购'],
+    (Category.EXPENSE, '5'): ['薯片', '饼干', '巧克力', '辣条'],
+    (Category.EXPENSE, '6'): ['奶茶', '咖啡', '饮料', '可乐', '果汁', '星巴克', '瑞幸', '喜茶'],
+    (Category.EXPENSE, '7'): ['买菜', '青菜'],
+    (Category.EXPENSE, '8'): ['苹果', '香蕉', '西瓜', '葡萄', '草莓', '橙子'],
+    (Category.EXPENSE, '9'): ['衣服', '裤子', '鞋子', '外套', '裙子'],
+    (Category.EXPENSE, '10'): ['电影', 'ktv', '唱歌', '演唱会', '门票'],
+    (Category.EXPENSE, '11'): ['理发', '剪头发', '化妆品', '护肤', '美甲'],
+    (Category.EXPENSE, '12'): ['话费', '流量', '宽带'],
+    (Category.EXPENSE, '13'): ['看病', '医院', '挂号', '买药', '药店'],
+    (Category.EXPENSE, '14'): ['学费', '培训', '课程', '网课', '考试'],
+    (Category.EXPENSE, '15'): ['点券', '游戏充值'],
+    (Category.EXPENSE, '16'): ['发红包'],
+    (Category.EXPENSE, '17'): ['奶粉', '尿不湿', '纸尿裤'],
+    (Category.EXPENSE, '18'): ['住宿', '宾馆', '民宿'],
+    (Category.EXPENSE, '19'): ['房租', '物业', '水电', '电费', '水费', '燃气'],
+    (Category.EXPENSE, '21'): ['请客', '聚会'],
+    (Category.EXPENSE, '22'): ['礼物', '送礼'],
+    (Category.EXPENSE, '23'): ['猫粮', '狗粮', '猫砂'],
+    (Category.EXPENSE, '24'): ['加油', '停车', '洗车', '保养', '过路费'],
+    (Category.EXPENSE, '25'): ['手机', '电脑', '耳机', '键盘'],
+    (Category.EXPENSE, '26'): ['买书', '图书'],
+    (Category.EXPENSE, '27'): ['周边', '应援'],
+    (Category.EXPENSE, '28'): ['打印', '文具'],
+    (Category.EXPENSE, '29'): ['健身', '游泳', '瑜伽'],
+    (Category.EXPENSE, '30'): ['捐款'],
+    (Category.EXPENSE, '31'): ['保险', '手续费', '还款', '信用卡'],
+}
+
+# 类别名称本身也是关键词；"其他" 太泛，不参与匹配
+LEXICON = sorted(
+    (
+        (keyword, key)
+        for key, keywords in (
+            [((in_out_type, detail_type), [name])
+             for in_out_type, names in Category.DETAIL_TYPE_NAMES.items()
+             for detail_type, name in names.items() if name != '其他']
+            + list(KEYWORDS.items())
+        )
+        for keyword in keywords
+    ),
+    key=lambda item: -len(item[0]),
+)
+
+# 只命中一个类别的关键词时的置信度；命中多个类别时取最长的关键词，置信度降低
+LEXICON_CONFIDENCE = 0.85
+LEXICON_AMBIGUOUS_CONFIDENCE = 0.5
+
+REPLIES = {
+    Category.INCOME: ('又进账啦，继续加油！', '1'),
+    Category.EXPENSE: ('记好啦，花钱也要开心哦~', '5'),
+}
+
+
+def clean_text(text):
+    """去掉金额、标点和空白，只保留用于分类的文字"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return STRIP_RE.sub('', AMOUNT_RE.sub('', text))
+
+
+def features(text):
+    # 单字 + 相邻二字组合
+    return list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+def lexicon_predict(text):
+    matched = []
+    for keyword, key in LEXICON:
+        if keyword in text:
+            # 从长到短匹配，匹配过的部分不再参与，"收红包" 不会再命中 "红包"
+            text = text.replace(keyword, '|')
+            if key not in matched:
+                matched.append(key)
+    if not matched:
+        return None
+    confidence = LEXICON_CONFIDENCE if len(matched) == 1 else LEXICON_AMBIGUOUS_CONFIDENCE
+    return Prediction(*matched[0], confidence, 'lexicon')
+
+
+class NaiveBayes:
+    """字符 n-gram 上的多项式朴素贝叶斯，标签为 (inOutType, detail_type)"""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+
+    def fit(self, texts, labels):
+        self.class_counts = Counter(labels)
+        self.feature_counts = defaultdict(Counter)
+        self.totals = Counter()
+        for text, label in zip(texts, labels):
+            feats = features(text)
+            self.feature_counts[label].update(feats)
+            self.totals[label] += len(feats)
+        self.vocab = set().union(*self.feature_counts.values()) if self.feature_counts else set()
+        size = sum(self.class_counts.values())
+        self.log_prior = {label: math.log(count / size) for label, count in self.class_counts.items()}
+        return self
+
+    def predict(self, text):
+        feats = features(text)
+        known = [feat for feat in feats if feat in self.vocab]
+        if not known:
+            return None
+        denominator = self.alpha * len(self.vocab)
+        scores = {}
+        for label, log_prior in self.log_prior.items():
+            counts = self.feature_counts[label]
+            log_total = math.log(self.totals[label] + denominator)
+            scores[label] = log_prior + sum(math.log(counts[feat] + self.alpha) - log_total for feat in known)
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        probability = 1 / sum(math.exp(score - top) for score in scores.values())
+        # 样本少的类别、大部分字没见过的输入，都不应该给出很高的置信度
+        support = self.class_counts[best] / (self.class_counts[best] + 2)
+        coverage = len(known) / len(feats)
+        return Prediction(*best, probability * support * coverage, 'history')
+
+
+def combine(first, second):
+    if first is None or second is None:
+        return first or second
+    if first[:2] == second[:2]:
+        confidence = 1 - (1 - first.confidence) * (1 - second.confidence)
+        return Prediction(first.inOutType, first.detail_type, confidence, f'{first.source}+{second.source}')
+    # 两者不一致时取更有把握的一方，并按另一方的置信度打折
+    best, other = (first, second) if first.confidence >= second.confidence else (second, first)
+    return best._replace(confidence=best.confidence - other.confidence / 2)
+
+
+class LocalClassifier:
+    """
+    bill_chat 的本地快速分类：关键词词典 + 用户自己历史账单备注训练的朴素贝叶斯。
+    置信度达到阈值、且消息中恰好有一个金额时直接建账单，否则交给AI。
+    每个用户的模型训练后缓存在进程内，超过 ttl、或账单数量比训练时变化超过 retrain_ratio（至少 min_retrain 笔）时重新训练；
+    bill_chat 每次建账单都会让账单数加一，按数量精确比较会导致几乎每次调用都重新训练。
+    """
+
+    def __init__(self, threshold=0.8, min_samples=20, max_history=2000, ttl=600, max_users=1000,
+                 retrain_ratio=0.1, min_retrain=5):
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.max_history = max_history
+        self.ttl = ttl
+        self.retrain_ratio = retrain_ratio
+        self.min_retrain = min_retrain
+        self.max_users = max_users
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.resolved = 0
+        self.trainings = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'AI_LOCAL_CLASSIFIER', {})
+        return cls(
+            threshold=options.get('THRESHOLD', 0.8),
+            min_samples=options.get('MIN_SAMPLES', 20),
+            max_history=options.get('MAX_HISTORY', 2000),
+            ttl=options.get('TTL', 600),
+            retrain_ratio=options.get('RETRAIN_RATIO', 0.1),
+            min_retrain=options.get('MIN_RETRAIN', 5),
+        )
+
+    def history(self, ledger_ids):
+        """用户最近的账单备注及其类别，用于训练"""
+        rows = (
+            Bill.objects.filter(ledger_id__in=ledger_ids)
+            .exclude(remark__isnull=True)
+            .exclude(remark='')
+            .order_by('-id')
+            .values_list('remark', 'category_id')[:self.max_history]
+        )
+        texts, labels = [], []
+        for remark, category_id in rows:
+            text = clean_text(remark)
+            if text:
+                texts.append(text)
+                labels.append(category_key(category_id))
+        return texts, labels
+
+    def train(self, texts, labels):
+        if len(texts) < self.min_samples:
+            return None
+        return NaiveBayes().fit(texts, labels)
+
+    def retrain_after(self, trained_count):
+        """账单数量变化达到这个数时重新训练"""
+        return max(self.min_retrain, int(trained_count * self.retrain_ratio))
+
+    def model_for(self, user):
+        # 子查询按 user_id 取账本，不依赖进程内的账本 id 缓存
+        ledger_ids = Ledger.objects.filter(user_id=user.pk).values('id')
+        count = Bill.objects.filter(ledger_id__in=ledger_ids).count()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._models.get(user.id)
+            if cached and cached[1] > now and abs(count - cached[0]) < self.retrain_after(cached[0]):
+                self._models.move_to_end(user.id)
+                return cached[2]
+
+        model = self.train(*self.history(ledger_ids))
+        with self._lock:
+            self.trainings += 1
+            self._models[user.id] = (count, now + self.ttl, model)
+            self._models.move_to_end(user.id)
+            while len(self._models) > self.max_users:
+                self._models.popitem(last=False)
+        return model
+
+    def predict(self, text, model=None):
+        return combine(lexicon_predict(text), model.predict(text) if model else None)
+
+    def classify(self, user, message):
+        """返回与AI响应相同结构的字段；没有把握时返回 None"""
+        started = time.perf_counter()
+        try:
+            normalized, amount = normalize_message(message)
+            text = clean_text(message)
+            if normalized is None or not text:
+                return None
+            prediction = self.predict(text, self.model_for(user))
+            if prediction is None or prediction.confidence < self.threshold:
+                return None
+            response, emoji = REPLIES[prediction.inOutType]
+            with self._lock:
+                self.resolved += 1
+            return {
+                'inOutType': prediction.inOutType,
+                'detail_type': prediction.detail_type,
+                'amount': str(amount),
+                'remark': text[:10],
+                'response': response,
+                'emoji': emoji,
+            }
+        finally:
+            with self._lock:
+                self.attempts += 1
+                self.seconds += time.perf_counter() - started
+
+    def stats(self):
+        with self._lock:
+            return {
+                'threshold': self.threshold,
+                'attempts': self.attempts,
+                'resolved': self.resolved,
+                'resolve_rate': round(self.resolved / self.attempts, 4) if self.attempts else 0.0,
+                'avg_ms': round(self.seconds / self.attempts * 1000, 3) if self.attempts else 0.0,
+                'trainings': self.trainings,
+                'cached_models': len(self._models),
+            }
+
+
+local_classifier = LocalClassifier.from_settings()
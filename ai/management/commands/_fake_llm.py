@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+
+# 固定返回的回复内容：同时满足 bill_chat 的 JSON 格式要求和普通聊天
+FAKE_CONTENT = json.dumps({
+    "inOutType": "2",
+    "detail_type": "1",
+    "amount": "12",
+    "remark": "压测",
+    "response": "收到啦",
+    "emoji": "1",
+}, ensure_ascii=False)
+
+
+def usage_body(payload, content=FAKE_CONTENT):
+    # 粗略地按一个字符一个 token 估算用量，便于比较不同提示词的长度
+    prompt_tokens = sum(len(message.get('content') or '') for message in payload.get('messages', []))
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content)}
+
+
+def completion_body(usage, content=FAKE_CONTENT):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o-mini",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": usage,
+    }
+
+
+def chunk_body(content=None, usage=None):
+    body = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+    if usage is not None:
+        # 请求 stream_options.include_usage 时，最后一段只有用量，没有 choices
+        body["choices"] = []
+        body["usage"] = usage
+    return body
+
+
+def _chunked(data):
+    return f'{len(data):x}\r\n'.encode() + data + b'\r\n'
+
+
+async def serve_fake_llm(host, port, delay, pieces=20):
+    """
+    极简的 OpenAI 兼容服务：每个请求等待 delay 秒后返回固定回复，用于在没有真实模型时压测。
+    请求 stream=true 时把回复分成 pieces 段，以 SSE 在 delay 秒内逐段发出。
+    返回的 token 用量按请求中消息的字符数估算。
+    支持 HTTP/1.1 keep-alive。
+    """
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.decode('latin-1').split('\r\n'):
+                    name, _, value = line.partition(':')
+                    if name.lower() == 'content-length':
+                        length = int(value.strip())
+                payload = json.loads(await reader.readexactly(length)) if length else {}
+                if payload.get('stream'):
+                    writer.write(
+                        b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                        b'Transfer-Encoding: chunked\r\n\r\n'
+                    )
+                    step = max(1, len(FAKE_CONTENT) // pieces)
+                    for i in range(0, len(FAKE_CONTENT), step):
+                        await asyncio.sleep(delay / pieces)
+                        event = f'data: {json.dumps(chunk_body(FAKE_CONTENT[i:i + step]))}\n\n'
+                        writer.write(_chunked(event.encode()))
+                        await writer.drain()
+                    if (payload.get('stream_options') or {}).get('include_usage'):
+                        event = f'data: {json.dumps(chunk_body(usage=usage_body(payload)))}\n\n'
+                        writer.write(_chunked(event.encode()))
+                    writer.write(_chunked(b'data: [DONE]\n\n') + b'0\r\n\r\n')
+                    await writer.drain()
+                    continue
+                await asyncio.sleep(delay)
+                body = json.dumps(completion_body(usage_body(payload))).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
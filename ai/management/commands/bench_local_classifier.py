@@ -0,0 +1,102 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai.local_classifier import LocalClassifier, lexicon_predict
+from bill.models import Ledger
+from user.models import User
+
+
+def _percentile_us(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q / 100 * len(values)))] * 1e6, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "离线评估 bill_chat 本地分类：按用户把历史账单备注随机分成训练集和测试集，"
+        "分别统计关键词、历史模型和两者结合时的准确率、阈值以上的覆盖率与准确率，以及训练和预测耗时"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', nargs='*', help="只评估这些用户，默认评估所有历史账单足够的用户")
+        parser.add_argument('--test-ratio', type=float, default=0.2)
+        parser.add_argument('--threshold', type=float, help="默认使用 settings.AI_LOCAL_CLASSIFIER 中的阈值")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        classifier = LocalClassifier.from_settings()
+        if options['threshold'] is not None:
+            classifier.threshold = options['threshold']
+
+        users = User.objects.all()
+        if options['username']:
+            users = users.filter(username__in=options['username'])
+
+        rng = random.Random(options['seed'])
+        results = {name: {'total': 0, 'correct': 0, 'covered': 0, 'covered_correct': 0}
+                   for name in ('lexicon', 'history', 'combined')}
+        train_seconds, predict_seconds = [], []
+        evaluated = 0
+
+        for user in users.iterator():
+            texts, labels = classifier.history(Ledger.objects.filter(user_id=user.pk).values('id'))
+            samples = list(zip(texts, labels))
+            rng.shuffle(samples)
+            split = int(len(samples) * (1 - options['test_ratio']))
+            train, test = samples[:split], samples[split:]
+            if len(train) < classifier.min_samples or not test:
+                continue
+            evaluated += 1
+
+            began = time.perf_counter()
+            model = classifier.train(*zip(*train))
+            train_seconds.append(time.perf_counter() - began)
+
+            for text, label in test:
+                began = time.perf_counter()
+                combined = classifier.predict(text, model)
+                predict_seconds.append(time.perf_counter() - began)
+                predictions = {
+                    'lexicon': lexicon_predict(text),
+                    'history': model.predict(text),
+                    'combined': combined,
+                }
+                for name, prediction in predictions.items():
+                    stats = results[name]
+                    stats['total'] += 1
+                    correct = prediction is not None and prediction[:2] == label
+                    stats['correct'] += correct
+                    if prediction is not None and prediction.confidence >= classifier.threshold:
+                        stats['covered'] += 1
+                        stats['covered_correct'] += correct
+
+        if not evaluated:
+            raise CommandError(f"没有历史账单（有备注）不少于 {classifier.min_samples} 条的用户可供评估")
+
+        report = {
+            'users': evaluated,
+            'threshold': classifier.threshold,
+            'train_ms': {
+                'mean': round(sum(train_seconds) / len(train_seconds) * 1000, 2),
+                'max': round(max(train_seconds) * 1000, 2),
+            },
+            'predict_us': {
+                'p50': _percentile_us(predict_seconds, 50),
+                'p95': _percentile_us(predict_seconds, 95),
+            },
+        }
+        for name, stats in results.items():
+            report[name] = {
+                'samples': stats['total'],
+                'accuracy': round(stats['correct'] / stats['total'], 4),
+                'coverage': round(stats['covered'] / stats['total'], 4),
+                'accuracy_above_threshold': (
+                    round(stats['covered_correct'] / stats['covered'], 4) if stats['covered'] else None
+                ),
+            }
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
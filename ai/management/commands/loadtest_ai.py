@@ -0,0 +1,142 @@
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from ._fake_llm import serve_fake_llm
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return round(values[index] * 1000, 1)
+
+
+def _summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "压测 AI 接口对其他接口的影响：先单独测量非 AI 接口的延迟作为基线，"
+        "再在大量 AI 请求进行中持续测量同一接口。服务需以 ASGI 方式运行；"
+        "没有真实模型时可用 --fake-llm-port 启动一个模拟的 OpenAI 服务，并把配置中的 base_url 指向它。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--ai-path', default='/api/normal-chat/')
+        parser.add_argument('--probe-path', default='/api/ledgers/')
+        parser.add_argument('--ai-requests', type=int, default=200)
+        parser.add_argument('--ai-concurrency', type=int, default=50)
+        parser.add_argument('--probe-interval', type=float, default=0.05)
+        parser.add_argument('--baseline-seconds', type=float, default=3)
+        parser.add_argument('--fake-llm-port', type=int, help="在本机该端口启动模拟的 OpenAI 服务")
+        parser.add_argument('--fake-llm-delay', type=float, default=2.0, help="模拟服务每次回复的耗时（秒）")
+        parser.add_argument('--stream', action='store_true', help="AI 请求使用流式模式，并统计首段内容的到达时间")
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options))
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+
+    async def run(self, options):
+        fake_server = None
+        if options['fake_llm_port']:
+            fake_server = await serve_fake_llm('127.0.0.1', options['fake_llm_port'], options['fake_llm_delay'])
+
+        limits = httpx.Limits(max_connections=options['ai_concurrency'] + 10)
+        async with httpx.AsyncClient(base_url=options['base_url'], timeout=120, limits=limits) as client:
+            response = await client.post('/api/login/', json={
+                'username': options['username'], 'password': options['password'],
+            })
+            if response.status_code != 200:
+                raise CommandError(f"登录失败：{response.text}")
+            client.headers['Authorization'] = f"Bearer {response.json()['data']['access']}"
+
+            # 基线：没有 AI 请求时的非 AI 接口延迟
+            stop = asyncio.Event()
+            baseline = asyncio.create_task(self.probe(client, options, stop))
+            await asyncio.sleep(options['baseline_seconds'])
+            stop.set()
+            baseline_latencies = await baseline
+
+            # 负载：AI 请求进行中的非 AI 接口延迟
+            stop = asyncio.Event()
+            loaded = asyncio.create_task(self.probe(client, options, stop))
+            began = time.perf_counter()
+            ai_latencies, ai_first_chunk, ai_statuses = await self.fire_ai(client, options)
+            ai_elapsed = time.perf_counter() - began
+            stop.set()
+            loaded_latencies = await loaded
+
+        if fake_server:
+            fake_server.close()
+            await fake_server.wait_closed()
+
+        result = {
+            'probe_path': options['probe_path'],
+            'baseline': _summary(baseline_latencies),
+            'under_ai_load': _summary(loaded_latencies),
+            'ai': {
+                'path': options['ai_path'],
+                'requests': options['ai_requests'],
+                'concurrency': options['ai_concurrency'],
+                'throughput_rps': round(options['ai_requests'] / ai_elapsed, 2),
+                'statuses': ai_statuses,
+                **_summary(ai_latencies),
+            },
+        }
+        if options['stream']:
+            result['ai']['first_chunk'] = _summary(ai_first_chunk)
+        return result
+
+    async def probe(self, client, options, stop):
+        latencies = []
+        while not stop.is_set():
+            began = time.perf_counter()
+            await client.get(options['probe_path'])
+            latencies.append(time.perf_counter() - began)
+            await asyncio.sleep(options['probe_interval'])
+        return latencies
+
+    async def fire_ai(self, client, options):
+        semaphore = asyncio.Semaphore(options['ai_concurrency'])
+        payload = {'message': '今天午饭 25'}
+        if options['stream']:
+            payload['stream'] = True
+        latencies = []
+        first_chunk = []
+        statuses = {}
+
+        async def one():
+            async with semaphore:
+                began = time.perf_counter()
+                first = None
+                try:
+                    async with client.stream('POST', options['ai_path'], json=payload) as response:
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - began
+                    code = str(response.status_code)
+                except httpx.HTTPError as e:
+                    code = type(e).__name__
+                latencies.append(time.perf_counter() - began)
+                if options['stream'] and first is not None:
+                    first_chunk.append(first)
+                statuses[code] = statuses.get(code, 0) + 1
+
+        await asyncio.gather(*(one() for _ in range(options['ai_requests'])))
+        return latencies, first_chunk, statuses
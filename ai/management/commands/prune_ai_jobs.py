@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ai.jobs import expired_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "清理完成或失败超过保留期限的账本分析任务（工作线程也会定期清理）。"
+        "每次账本数据变化后的分析请求都会新建任务，可以每天定时执行"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="保留最近几天完成或失败的任务，默认为 AI_JOBS['RETENTION_DAYS']")
+        parser.add_argument('--dry-run', action='store_true', help="只统计，不删除")
+
+    def handle(self, *args, **options):
+        jobs = expired_jobs(options['days'])
+        if options['dry_run']:
+            self.stdout.write(f"可清理 {jobs.count()} 个账本分析任务")
+            return
+        self.stdout.write(self.style.SUCCESS(f"已清理 {jobs.delete()[0]} 个账本分析任务"))
@@ -0,0 +1,34 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from ai.jobs import reclaim_expired_leases, work
+
+
+class Command(BaseCommand):
+    help = "在独立进程中执行账本分析后台任务（Web 进程中 AI_JOBS['WORKERS'] 设为 0 时使用），Ctrl+C 退出"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        reclaimed = reclaim_expired_leases()
+        if reclaimed:
+            self.stdout.write(f"已回收 {reclaimed} 个租约过期的任务")
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=work, args=(stop,), name=f'ai-job-worker-{i}')
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"已启动 {len(threads)} 个工作线程")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
+            self.stdout.write("等待正在执行的任务完成…")
+            for thread in threads:
+                thread.join()
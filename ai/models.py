@@ -0,0 +1,43 @@
+from django.db import models
+from django.utils import timezone
+
+from bill.models import Ledger
+
+
+class AnalysisJob(models.Model):
+    """
+    账本分析的后台任务，由 ai.jobs 中的工作线程执行。
+    同一账本、同一月份、同一数据版本只有一个任务，完成后的 result 即为该版本的分析结果。
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, '等待执行'),
+        (RUNNING, '执行中'),
+        (DONE, '已完成'),
+        (FAILED, '失败'),
+    ]
+
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
+    year = models.PositiveIntegerField(verbose_name='年份')
+    month = models.PositiveIntegerField(verbose_name='月份')
+    data_version = models.PositiveBigIntegerField(verbose_name='账本数据版本')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='状态')
+    result = models.JSONField(null=True, blank=True, verbose_name='分析结果')
+    error = models.TextField(blank=True, default='', verbose_name='错误信息')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='已执行次数')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='最早执行时间')
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        unique_together = ('ledger', 'year', 'month', 'data_version')
+        indexes = [
+            # 工作线程领取任务
+            models.Index(fields=['status', 'run_after'], name='ai_job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ledger} - {self.year}/{self.month} v{self.data_version}: {self.status}"
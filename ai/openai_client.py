@@ -1,17 +1,346 @@
-from openai import OpenAI
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import Counter, deque
+
+import httpx
+import openai
+from django.conf import settings
+from openai import OpenAI, AsyncOpenAI
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AIUnavailableError(Exception):
+    """AI 服务暂时不可用，接口返回 503"""
+
+
+class AIBusyError(AIUnavailableError):
+    """并发的 AI 请求已达上限，排队超时"""
+
+
+class CircuitOpenError(AIUnavailableError):
+    """上游近期失败率过高，熔断期间直接失败"""
+
+
+class DeadlineExceededError(AIUnavailableError):
+    """超过本次调用的期限（含重试）"""
+
+
+class UpstreamError(AIUnavailableError):
+    """上游持续出错，重试次数用尽"""
+
+
+# 可以重试的错误：超时、连接失败、限流、上游 5xx；APITimeoutError 是 APIConnectionError 的子类
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def _outcome(exc):
+    if isinstance(exc, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(exc, openai.APIConnectionError):
+        return 'connection_error'
+    if isinstance(exc, openai.RateLimitError):
+        return 'rate_limited'
+    if isinstance(exc, openai.InternalServerError):
+        return 'server_error'
+    if isinstance(exc, openai.APIStatusError):
+        return 'client_error'
+    return 'error'
+
+
+class CircuitBreaker:
+    """
+    熔断器：最近 window 秒内的调用不少于 min_calls 次且失败率达到 failure_rate 时断开，
+    断开后 cooldown 秒内的调用直接失败；之后放行一次试探调用，成功则恢复，失败则继续断开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate=0.5, min_calls=10, window=60, cooldown=30):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._calls = deque()
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+            # 半开状态同时只放行一次试探调用
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok):
+        """
+        记录一次调用的结果；ok 为 None 表示调用被取消或请求本身有误（不能说明上游是否健康），
+        不计入统计，半开状态下也不改变熔断状态，只释放试探名额
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state != self.CLOSED:
+                self._probing = False
+                if ok is None:
+                    return
+                if ok:
+                    self.state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self.state = self.OPEN
+                    self._opened_at = now
+                return
+            if ok is None:
+                return
+            self._calls.append((now, ok))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            failures = sum(1 for _, success in self._calls if not success)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self.state = self.OPEN
+                self._opened_at = now
+                logger.warning("AI服务最近 %s 次调用失败 %s 次，熔断 %s 秒", len(self._calls), failures, self.cooldown)
+
+
+class ClientStats:
+    """每次调用（含重试）的结果与耗时：累计的各类结果次数、重试次数，以及最近 window 次调用的耗时分位数"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.outcomes = Counter()
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, outcome, seconds, retries):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.retries += retries
+            self.latencies.append(seconds)
+        logger.log(
+            logging.DEBUG if outcome in ('ok', 'cancelled') else logging.WARNING,
+            "AI调用结果 %s，耗时 %.0fms，重试 %s 次", outcome, seconds * 1000, retries
+        )
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            outcomes = dict(self.outcomes)
+            retries = self.retries
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] * 1000, 1)
+
+        return {
+            'calls': sum(outcomes.values()),
+            'outcomes': outcomes,
+            'retries': retries,
+            'latency_ms': {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99)},
+        }
+
+
+class TokenUsage:
+    """按用途（bill_chat、analysis 等）累计的调用次数和 token 用量，cached_tokens 是命中上游前缀缓存的输入 token"""
+
+    FIELDS = ('prompt_tokens', 'completion_tokens', 'cached_tokens')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.purposes = {}
+
+    def record(self, purpose, usage):
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        values = (
+            usage.prompt_tokens or 0,
+            usage.completion_tokens or 0,
+            getattr(details, 'cached_tokens', None) or 0,
+        )
+        for kind, value in zip(('prompt', 'completion', 'cached'), values):
+            metrics.LLM_TOKENS.inc(value, purpose=purpose, type=kind)
+        with self._lock:
+            totals = self.purposes.setdefault(purpose, dict.fromkeys(('calls',) + self.FIELDS, 0))
+            totals['calls'] += 1
+            for field, value in zip(self.FIELDS, values):
+                totals[field] += value
+
+    def snapshot(self):
+        with self._lock:
+            purposes = {purpose: dict(totals) for purpose, totals in self.purposes.items()}
+        for totals in purposes.values():
+            calls = totals['calls']
+            totals['avg_prompt_tokens'] = round(totals['prompt_tokens'] / calls, 1)
+            totals['avg_completion_tokens'] = round(totals['completion_tokens'] / calls, 1)
+            totals['cached_ratio'] = (
+                round(totals['cached_tokens'] / totals['prompt_tokens'], 4) if totals['prompt_tokens'] else None
+            )
+        return purposes
+
+
+def _messages(message):
+    # 兼容直接传入一段文本：作为一条用户消息
+    if isinstance(message, str):
+        return [{"role": "user", "content": message}]
+    return message
+
+
+class _Call:
+    """一次AI调用（含重试）：期限、已尝试次数，以及向熔断器和统计上报结果"""
+
+    def __init__(self, client, deadline=None, purpose='chat'):
+        self.client = client
+        self.purpose = purpose
+        self.started = time.monotonic()
+        self.deadline_at = self.started + (deadline or client.deadline)
+        self.attempts = 0
+        self.finished = False
+
+    def before_attempt(self):
+        """开始一次尝试，返回这次尝试可用的超时时间"""
+        remaining = self.deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise self._finish(DeadlineExceededError("AI服务响应超时，请稍后再试"), 'deadline_exceeded')
+        if not self.client.breaker.allow():
+            raise self._finish(CircuitOpenError("AI服务暂时不可用，请稍后再试"), 'circuit_open')
+        self.attempts += 1
+        return min(self.client.timeout.read, remaining)
+
+    def succeeded(self):
+        self.client.breaker.record(True)
+        self._finish(None, 'ok')
+
+    def cancelled(self):
+        self.client.breaker.record(None)
+        self._finish(None, 'cancelled')
+
+    def close(self):
+        """
+        在调用方的 finally 中调用：还没有记录结果时（例如在重试前的等待中被取消、超时）按取消记录，
+        保证每次调用都计入统计和指标，半开状态的熔断器也不会一直等待探测结果。
+        """
+        if not self.finished:
+            self.cancelled()
+
+    def failed(self, exc, retry=True):
+        """
+        一次尝试失败：可以重试时返回需要等待的秒数，否则返回应当抛出的异常。
+        只有上游的健康问题（超时、连接失败、限流、5xx）计入熔断，请求本身有误不计。
+        """
+        outcome = _outcome(exc)
+        retryable = isinstance(exc, RETRYABLE_ERRORS)
+        if not retryable:
+            # 4xx 等请求错误只说明上游有响应，不能证明上游已经恢复，不作为成功计入熔断
+            self.client.breaker.record(None)
+            return self._finish(exc, outcome)
+        self.client.breaker.record(False)
+        if not retry or self.attempts > self.client.max_retries:
+            return self._finish(UpstreamError("AI服务暂时不可用，请稍后再试"), outcome)
+        delay = self.client.backoff(self.attempts, exc)
+        if time.monotonic() + delay >= self.deadline_at:
+            return self._finish(DeadlineExceededError("AI服务响应超时，请稍后再试"), 'deadline_exceeded')
+        return delay
+
+    def _finish(self, exc, outcome):
+        if self.finished:
+            return exc
+        self.finished = True
+        seconds, retries = time.monotonic() - self.started, max(self.attempts - 1, 0)
+        self.client.stats.record(outcome, seconds, retries)
+        metrics.LLM_CALL_SECONDS.observe(seconds, purpose=self.purpose, outcome=outcome)
+        if retries:
+            metrics.LLM_RETRIES.inc(retries, purpose=self.purpose)
+        return exc
+
+
+def _raise(result, exc):
+    if result is exc:
+        raise exc
+    raise result from exc
+
 
 class OpenAIClient:
-    def __init__(self, api_key, base_url):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    """
+    OpenAI 客户端：
+    - 同步、异步调用各自共享一个连接池，连接、读取分别有超时；
+    - 每次调用有总期限，可重试的错误按带随机抖动的指数退避重试；
+    - 上游失败率过高时熔断，直接失败而不是让请求挂起；
+    - 记录每次调用的耗时和结果（stats），以及按用途统计的 token 用量（usage）。
 
-    def get_chat_response(self, message):
-        # 调用OpenAI的API
-        response = self.client.chat.completions.create(
-            messages=[
-                {"role": "user", "content": message}
-            ],
-            model="gpt-4o-mini"
+    message 可以是一段文本，也可以是消息列表（固定的系统提示在前，便于上游缓存前缀）。
+    """
+
+    def __init__(self, api_key, base_url, max_concurrency=20, queue_timeout=10, max_connections=100,
+                 connect_timeout=5, read_timeout=30, deadline=60, max_retries=2, backoff_base=0.5,
+                 backoff_max=8, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.stats = ClientStats()
+        self.usage = TokenUsage()
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=30
         )
+        # 重试由本类控制，关闭 SDK 自带的重试
+        self.client = OpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0, timeout=self.timeout,
+            http_client=httpx.Client(limits=self.limits, timeout=self.timeout),
+        )
+        # 异步客户端的连接池和并发信号量都绑定在事件循环上，按事件循环各建一份：
+        # ASGI 下整个进程只有一个事件循环，所有请求共享同一个连接池
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._async_clients.get(loop)
+        if state is None:
+            http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            state = (
+                AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout,
+                            http_client=http_client),
+                asyncio.Semaphore(self.max_concurrency),
+            )
+            self._async_clients[loop] = state
+        return state
+
+    def backoff(self, attempt, exc):
+        # full jitter：在 [0, 指数退避上限] 内随机等待，避免大量请求同时重试
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        # 限流时至少等待上游要求的时间
+        response = getattr(exc, 'response', None)
+        try:
+            delay = max(delay, float(response.headers.get('retry-after')))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return delay
+
+    @staticmethod
+    def _content(response):
         # 检查返回的结果
         if response and hasattr(response, 'choices') and len(response.choices) > 0:
             # 返回AI的回复内容
@@ -19,3 +348,122 @@ class OpenAIClient:
         else:
             # 如果没有得到回复，则返回一个默认信息
             return "Unable to get a response from AI."
+
+    def get_chat_response(self, message, deadline=None, purpose='chat'):
+        # 调用OpenAI的API
+        call = _Call(self, deadline, purpose)
+        try:
+            while True:
+                timeout = call.before_attempt()
+                try:
+                    response = self.client.chat.completions.create(
+                        messages=_messages(message),
+                        model="gpt-4o-mini",
+                        timeout=timeout
+                    )
+                except Exception as e:
+                    result = call.failed(e)
+                    if isinstance(result, Exception):
+                        _raise(result, e)
+                    time.sleep(result)
+                else:
+                    call.succeeded()
+                    self.usage.record(purpose, response.usage)
+                    return self._content(response)
+        finally:
+            call.close()
+
+    async def _acquire(self, semaphore):
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise AIBusyError("AI服务繁忙，请稍后再试")
+
+    async def _acreate(self, client, call, message, **kwargs):
+        # 被取消（包括在重试前的等待中）时由调用方 finally 中的 call.close() 记录
+        while True:
+            timeout = call.before_attempt()
+            try:
+                return await client.chat.completions.create(
+                    messages=_messages(message),
+                    model="gpt-4o-mini",
+                    timeout=timeout,
+                    **kwargs
+                )
+            except Exception as e:
+                result = call.failed(e)
+                if isinstance(result, Exception):
+                    _raise(result, e)
+                await asyncio.sleep(result)
+
+    async def aget_chat_response(self, message, deadline=None, purpose='chat'):
+        """异步版本：等待上游时不占用工作线程，超过并发上限时排队，排队超时抛出 AIBusyError"""
+        client, semaphore = self._async_state()
+        await self._acquire(semaphore)
+        call = _Call(self, deadline, purpose)
+        try:
+            response = await self._acreate(client, call, message)
+            call.succeeded()
+        finally:
+            call.close()
+            semaphore.release()
+        self.usage.record(purpose, response.usage)
+        return self._content(response)
+
+    async def astream_chat_response(self, message, deadline=None, purpose='chat'):
+        """
+        流式版本：异步生成器，上游每返回一段内容就产出一段。
+        只在建立流之前重试；生成器被关闭或取消（例如客户端断开）时关闭上游连接并释放并发名额。
+        token 用量在流的最后一段（没有 choices）中返回。
+        """
+        client, semaphore = self._async_state()
+        await self._acquire(semaphore)
+        call = _Call(self, deadline, purpose)
+        stream = None
+        try:
+            stream = await self._acreate(
+                client, call, message, stream=True, stream_options={"include_usage": True}
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    if getattr(chunk, 'usage', None) is not None:
+                        self.usage.record(purpose, chunk.usage)
+            except Exception as e:
+                _raise(call.failed(e, retry=False), e)
+            call.succeeded()
+        finally:
+            # 生成器被关闭或取消（客户端断开）时按取消记录
+            call.close()
+            if stream is not None:
+                await stream.close()
+            semaphore.release()
+
+
+# 配置API密钥和地址
+API_KEY = settings.OPENAI_API_KEY  # 替换为你的OpenAI API密钥
+BASE_URL = settings.OPENAI_BASE_URL  # 替换为你的OpenAI API地址
+
+_options = getattr(settings, 'AI_CLIENT', {})
+
+# 初始化OpenAI客户端（异步调用共享连接池，并限制同时进行的AI请求数），视图和后台任务共用
+ai_client = OpenAIClient(
+    api_key=API_KEY,
+    base_url=BASE_URL,
+    max_concurrency=getattr(settings, 'AI_MAX_CONCURRENCY', 20),
+    queue_timeout=getattr(settings, 'AI_QUEUE_TIMEOUT', 10),
+    max_connections=_options.get('MAX_CONNECTIONS', 100),
+    connect_timeout=_options.get('CONNECT_TIMEOUT', 5),
+    read_timeout=_options.get('READ_TIMEOUT', 30),
+    deadline=_options.get('DEADLINE', 60),
+    max_retries=_options.get('MAX_RETRIES', 2),
+    backoff_base=_options.get('BACKOFF_BASE', 0.5),
+    backoff_max=_options.get('BACKOFF_MAX', 8),
+    breaker=CircuitBreaker(
+        failure_rate=_options.get('BREAKER_FAILURE_RATE', 0.5),
+        min_calls=_options.get('BREAKER_MIN_CALLS', 10),
+        window=_options.get('BREAKER_WINDOW', 60),
+        cooldown=_options.get('BREAKER_COOLDOWN', 30),
+    ),
+)
@@ -1,68 +1,70 @@
 from decimal import Decimal
 
+from bill.models import Category
+
+EMOJI_CHOICES = (
+    ('1', '开心'), ('2', '生气'), ('3', '担心'), ('4', '惊讶'),
+    ('5', '共鸣'), ('6', '无语'), ('7', '愤怒'), ('8', '鼓励'),
+)
+
+
+def _codes(choices):
+    # 紧凑的 "编号名称" 形式，例如 "1工资 2生活费"
+    return ' '.join(f'{code}{name}' for code, name in choices)
+
+
+# 系统提示在所有请求中完全相同，放在消息最前面，模型服务商可以缓存这段前缀；
+# 每次请求只在后面附上用户输入
+BILL_SYSTEM_PROMPT = (
+    "你是记账系统，从用户输入中找出每一笔账单并分类，输入可能包含多笔（如\"午饭35 打车18 奶茶15\"是三笔）。\n"
+    "inOutType：1收入 2支出\n"
+    f"收入detail_type：{_codes(Category.DETAIL_TYPE_INCOME)}\n"
+    f"支出detail_type：{_codes(Category.DETAIL_TYPE_EXPENSE)}\n"
+    f"emoji：{_codes(EMOJI_CHOICES)}\n"
+    "只输出一行JSON，bills中每笔账单一项，值都用字符串：\n"
+    '{"bills":[{"inOutType":"1或2","detail_type":"编号","amount":"金额，默认0","remark":"备注，10字以内"}],'
+    '"response":"作为我的朋友，20字以内的回复，可爱俏皮点","emoji":"编号"}'
+)
+
+CHAT_SYSTEM_PROMPT = "回复请不要超过100字。"
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "你是我的智能记账管家。根据我本月的收支和各类支出的详细情况，给出一些节省开支的建议，并发出一个警告。"
+    "回复时请使用50字以内，第二人称。"
+)
+
+
 def generate_bill_prompt(user_message):
-    prompt = f"""
-    你现在是一个记账系统，负责对账单支出或收入进行分类。类型有：
-    inOutType = (
-        ('1', '收入'), ('2', '支出'),
-    )
-    
-    收入详细类型有：
-    inDetailType = (
-        ('1', '工资'), ('2', '生活费'), ('3', '奖金'), ('4', '理财'),
-        ('5', '收红包'), ('6', '外快'), ('7', '零花钱'), ('8', '其他'),
-    )
-    
-    支出详细类型有：
-    outDetailType = (
-        ('1', '餐饮'), ('2', '交通'), ('3', '日用品'), ('4', '购物'),
-        ('5', '零食'), ('6', '饮品'), ('7', '蔬菜'), ('8', '水果'),
-        ('9', '服饰'), ('10', '娱乐'), ('11', '美容'), ('12', '通讯'),
-        ('13', '医疗'), ('14', '学习'), ('15', '游戏'), ('16', '红包'),
-        ('17', '婴儿用品'), ('18', '酒店'), ('19', '住房'), ('20', '转账'),
-        ('21', '社交'), ('22', '礼品'), ('23', '宠物'), ('24', '汽车'),
-        ('25', '数码'), ('26', '书籍'), ('27', '追星'), ('28', '办公'),
-        ('29', '运动'), ('30', '捐赠'), ('31', '金融'), ('32', '其他'),
-    )
-
-    表情有：
-    emoji = (
-        ('1', '开心'), ('2', '生气'), ('3', '担心'), ('4', '惊讶'),
-        ('5', '共鸣'), ('6', '无语'), ('7', '愤怒'), ('8', '鼓励'),
-    )
-
-    下面是一段用户的输入，你需要分析这段话的账单类别，并返回如下JSON格式：
-    {{
-        "inOutType": "1或2，收入或支出",
-        "detail_type": "详细类型对应的数字",
-        "amount": "金额, 默认是0",
-        "remark": "备注，10字以内",
-        "response": "作为我的朋友，20字以内的回复，可爱俏皮点",
-        "emoji": "表情的数字，emoji中对应"
-    }}
-
-    用户输入：{user_message}
-    """
-    return prompt
+    """bill_chat 的消息：固定的系统提示 + 用户输入"""
+    return [
+        {"role": "system", "content": BILL_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def generate_chat_prompt(user_message):
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
 
 
 def generate_analysis_prompt(income, expense, category_summary):
     """
-    根据收入、支出和支出分类信息生成用于 AI 分析的提示词。
+    根据收入、支出和支出分类信息生成用于 AI 分析的消息，固定的要求放在系统提示中。
 
     :param income: 本月总收入
     :param expense: 本月总支出
     :param category_summary: 各类别支出的详细情况
-    :return: 生成的提示词
+    :return: 生成的消息列表
     """
     # 计算支出占收入的百分比
     expense_percentage = (expense / income * Decimal('100')).quantize(Decimal('0.01')) if income != 0 else Decimal('0')
 
-    # 根据支出情况生成不同的提示词
-    prompt = (
-        f"你是我的智能记账管家。我的总收入为 {income} 元，总支出为 {expense} 元，"
-        f"支出已经占到收入的 {expense_percentage}%。以下是各类支出的详细情况：\n\n{category_summary}\n\n"
-        "请根据这些信息给出一些节省开支的建议，并发出一个警告。回复时请使用50字以内，第二人称"
-    )
-
-    return prompt
\ No newline at end of file
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"总收入 {income} 元，总支出 {expense} 元，支出占收入的 {expense_percentage}%。"
+            f"各类支出：\n{category_summary}"
+        )},
+    ]
@@ -1,10 +1,16 @@
 from django.urls import path
-from .views import normal_chat, bill_chat, analyze_ledger
+from .views import normal_chat, bill_chat, analyze_ledger, analyze_ledger_job, analyze_ledger_job_detail, ai_stats
 
 urlpatterns = [
     path('normal-chat/', normal_chat, name='normal_chat'),
 
     path('bill-chat/', bill_chat, name='bill_chat'),
 
-    path('analyze_ledger/', analyze_ledger, name='bill_chat'),
+    path('analyze_ledger/', analyze_ledger, name='analyze_ledger'),
+
+    path('analyze_ledger/jobs/', analyze_ledger_job, name='analyze_ledger_job'),  # 提交后台分析任务
+
+    path('analyze_ledger/jobs/<int:job_id>/', analyze_ledger_job_detail, name='analyze_ledger_job_detail'),  # 查询任务状态
+
+    path('ai-stats/', ai_stats, name='ai_stats'),  # 进程级的AI统计，仅管理员可访问
 ]
@@ -1,49 +1,182 @@
 from rest_framework import status
-from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from django.http import StreamingHttpResponse
 from django.utils.timezone import datetime
 
-from .openai_client import OpenAIClient
-from utils.utils import success_response, fail_response
-from rest_framework.decorators import api_view
-from .prompt import generate_bill_prompt, generate_analysis_prompt
+from asgiref.sync import sync_to_async
+
+from .openai_client import ai_client, AIUnavailableError
+from .classification_cache import classification_cache
+from .local_classifier import local_classifier
+from .analysis_cache import analysis_cache
+from utils.utils import success_response, fail_response, async_api_view
+from .prompt import generate_bill_prompt, generate_chat_prompt
+from .analysis import prepare_analysis, finish_analysis
+from .jobs import enqueue_analysis
+from .models import AnalysisJob
 import json
-from bill.models import Ledger, Category, Bill
-from django.db import models
-from decimal import Decimal
+import time
+from bill.models import Category, Bill
+from bill.categories import resolve_category_id
+from bill.permissions import get_owned, ledger_required, user_owns_ledger
+from bill.bulk import bulk_create_bills
+from bill.versions import data_version
+from django.core.exceptions import ValidationError
+
+# 一条消息最多拆出的账单数
+MAX_BILLS_PER_MESSAGE = 20
+BILL_FIELDS = ("inOutType", "detail_type", "amount", "remark")
+
+
+def _validate_bills(entries):
+    """校验AI返回的每一笔账单，全部合法时返回清洗后的列表，否则返回 None"""
+    if not isinstance(entries, list) or not 0 < len(entries) <= MAX_BILLS_PER_MESSAGE:
+        return None
+    amount_field = Bill._meta.get_field('amount')
+    cleaned = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not all(field in entry for field in BILL_FIELDS):
+            return None
+        in_out_type, detail_type = str(entry['inOutType']), str(entry['detail_type'])
+        if detail_type not in Category.DETAIL_TYPE_NAMES.get(in_out_type, {}):
+            return None
+        try:
+            amount = amount_field.clean(str(entry['amount']), None)
+        except ValidationError:
+            return None
+        cleaned.append({
+            'inOutType': in_out_type,
+            'detail_type': detail_type,
+            'amount': amount,
+            'remark': str(entry['remark'])[:255],
+        })
+    return cleaned
+
+
+def _create_bills(ledger_id, entries, date):
+    # 一条消息里的账单一次批量插入，账单与汇总数据的更新在同一事务中；事务不能跨 await，所以整体放到线程里执行
+    return bulk_create_bills([
+        Bill(
+            ledger_id=ledger_id,
+            category_id=resolve_category_id(entry['inOutType'], entry['detail_type']),
+            amount=entry['amount'],
+            remark=entry['remark'],
+            date=date
+        )
+        for entry in entries
+    ])
 
-# 配置API密钥和地址
-API_KEY = settings.OPENAI_API_KEY  # 替换为你的OpenAI API密钥
-BASE_URL = settings.OPENAI_BASE_URL  # 替换为你的OpenAI API地址
 
-# 初始化OpenAI客户端
-ai_client = OpenAIClient(api_key=API_KEY, base_url=BASE_URL)
+async def _classify(user_message):
+    """调用AI对消息分类，返回解析后的字段；失败时返回错误响应"""
+    # 生成prompt
+    prompt = generate_bill_prompt(user_message)
 
+    # 调用OpenAI API获取回复
+    started = time.perf_counter()
+    ai_response = await ai_client.aget_chat_response(prompt, purpose='bill_chat')
+    classification_cache.record_llm_call(time.perf_counter() - started)
 
-@api_view(['POST'])
-def normal_chat(request):
+    # 检查AI响应是否为空
+    if not ai_response:
+        return fail_response(message="AI未返回任何响应", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 解析AI的响应，期望返回JSON格式
+    response_data = None
+    try:
+        # 尝试解析为 JSON 格式
+        response_data = json.loads(ai_response)
+    except json.JSONDecodeError:
+        # 如果解析失败，检查是否是字符串格式的 JSON
+        if isinstance(ai_response, str):
+            # 如果包含代码块格式（例如 ```json ... ```），去掉这些字符
+            ai_response = ai_response.strip().strip("```").strip("json").strip()
+            try:
+                response_data = json.loads(ai_response)
+            except json.JSONDecodeError:
+                return fail_response(message="AI响应的格式不正确",
+                                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 兼容只返回一笔账单、字段平铺的格式
+    if isinstance(response_data, dict) and "bills" not in response_data \
+            and all(field in response_data for field in BILL_FIELDS):
+        response_data["bills"] = [{field: response_data.pop(field) for field in BILL_FIELDS}]
+
+    # 校验响应数据的字段
+    required_fields = {"bills", "response", "emoji"}
+    if not isinstance(response_data, dict) or not all(field in response_data for field in required_fields):
+        return fail_response(message="AI响应缺少必要的字段", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return response_data
+
+
+def _sse(data, event=None):
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+
+async def _stream_chat(prompt):
+    """
+    以 SSE 逐段转发AI回复：每段为一个 data 事件 {"delta": "..."}，结束时发送 done 事件，出错时发送 error 事件。
+    先等到第一段内容再返回响应，排队超时、上游出错等情况仍以普通的错误响应返回。
+    客户端断开时 Django 会取消响应的生成器，上游的流式请求随之关闭。
+    """
+    chunks = ai_client.astream_chat_response(prompt, purpose='normal_chat')
+    try:
+        first = await anext(chunks)
+    except StopAsyncIteration:
+        first = ""
+
+    async def events():
+        try:
+            if first:
+                yield _sse({"delta": first})
+            async for delta in chunks:
+                yield _sse({"delta": delta})
+            yield _sse({"ai_avatar": "0"}, event="done")
+        except Exception as e:
+            yield _sse({"message": str(e)}, event="error")
+        finally:
+            await chunks.aclose()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 关闭 nginx 等反向代理的缓冲，保证每段内容立即发出
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@async_api_view(['POST'])
+async def normal_chat(request):
     try:
         user_message = request.data.get('message')
 
         if not user_message:
             return fail_response(message="未提供消息内容", status_code=status.HTTP_400_BAD_REQUEST)
 
-        # prompt = generate_bill_prompt(user_message)
+        prompt = generate_chat_prompt(user_message)
 
-        prompt = user_message + "请不要超过100字"
+        # 流式模式：请求体中 stream 为真，或 Accept 为 text/event-stream
+        if request.data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+            return await _stream_chat(prompt)
 
-        ai_response = ai_client.get_chat_response(prompt)
+        ai_response = await ai_client.aget_chat_response(prompt, purpose='normal_chat')
 
         return success_response(data={
             "response": ai_response,
             "ai_avatar": "0"
         }, message="成功获取AI回复")
 
+    except AIUnavailableError as e:
+        return fail_response(message=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return fail_response(message=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
-def bill_chat(request):
+@async_api_view(['POST'])
+async def bill_chat(request):
     try:
         user_message = request.data.get('message')
         ledger_id = request.data.get('ledger_id')
@@ -53,85 +186,72 @@ def bill_chat(request):
         if not ledger_id:
             return fail_response(message="未提供账本ID", status_code=status.HTTP_400_BAD_REQUEST)
 
-        # 生成prompt
-        prompt = generate_bill_prompt(user_message)
-
-        # 调用OpenAI API获取回复
-        ai_response = ai_client.get_chat_response(prompt)
-
-        # 检查AI响应是否为空
-        if not ai_response:
-            return fail_response(message="AI未返回任何响应", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # 解析AI的响应，期望返回JSON格式
-        response_data = None
-        try:
-            # 尝试解析为 JSON 格式
-            response_data = json.loads(ai_response)
-        except json.JSONDecodeError:
-            # 如果解析失败，检查是否是字符串格式的 JSON
-            if isinstance(ai_response, str):
-                # 如果包含代码块格式（例如 ```json ... ```），去掉这些字符
-                ai_response = ai_response.strip().strip("```").strip("json").strip()
-                try:
-                    response_data = json.loads(ai_response)
-                except json.JSONDecodeError:
-                    return fail_response(message="AI响应的格式不正确",
-                                         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # 校验响应数据的字段
-        required_fields = {"inOutType", "detail_type", "amount", "remark", "response", "emoji"}
-        if not all(field in response_data for field in required_fields):
-            return fail_response(message="AI响应缺少必要的字段", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # 检查账本是否存在，并且用户有权限访问
-        try:
-            ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-        except Ledger.DoesNotExist:
+        # 检查账本是否存在，并且用户有权限访问（在调用AI之前检查）
+        if not await sync_to_async(user_owns_ledger)(request.user, ledger_id):
             return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
 
-        # 下面这些其实可以用序列化器，但我bill增删改查的接口和现在的数据形式有点不匹配，只能这样写了
-        category_data = {
-            'inOutType': response_data['inOutType'],
-            'detail_type': response_data['detail_type']
-        }
-        category, created = Category.objects.get_or_create(
-            inOutType=category_data['inOutType'],
-            detail_type=category_data['detail_type']
-        )
-
-        # 手动创建Bill对象
-        bill = Bill.objects.create(
-            ledger=ledger,
-            category=category,
-            amount=response_data['amount'],
-            remark=response_data['remark'],
+        # 单笔账单的消息：相同写法（只有金额不同）直接复用之前的分类结果，不调用AI
+        response_data = await classification_cache.alookup(user_message)
+        if response_data is None:
+            # 再尝试本地分类（关键词 + 用户历史账单），有把握时同样不调用AI
+            response_data = await sync_to_async(local_classifier.classify)(request.user, user_message)
+        if response_data is not None:
+            response_data = {
+                "bills": [{field: response_data[field] for field in BILL_FIELDS}],
+                "response": response_data["response"],
+                "emoji": response_data["emoji"],
+            }
+        else:
+            # 一次AI调用取出消息里的所有账单
+            response_data = await _classify(user_message)
+            if isinstance(response_data, Response):
+                return response_data
+            if isinstance(response_data["bills"], list) and len(response_data["bills"]) == 1:
+                await classification_cache.astore(user_message, {
+                    **response_data["bills"][0],
+                    "response": response_data["response"],
+                    "emoji": response_data["emoji"],
+                })
+
+        entries = _validate_bills(response_data["bills"])
+        if entries is None:
+            return fail_response(message="AI响应的格式不正确", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        bills = await sync_to_async(_create_bills)(
+            ledger_id=int(ledger_id),
+            entries=entries,
             date=request.data.get('date', datetime.now().strftime('%Y-%m-%d'))  # 如果未提供日期，使用当前日期
         )
 
-        # 准备返回的数据
-        return_data = {
-            'response': response_data.get('response'),
-            'ai_avatar': response_data.get('emoji'),
-            'bill': {
+        # 准备返回的数据；bill 为第一笔账单，兼容只处理单笔账单的客户端
+        bill_data = [
+            {
                 'id': bill.id,
-                'ledger': bill.ledger.id,
-                'amount': bill.amount,
+                'ledger': bill.ledger_id,
+                'amount': str(bill.amount),
                 'remark': bill.remark,
                 'date': bill.date,
                 'create_time': bill.create_time
             }
+            for bill in bills
+        ]
+        return_data = {
+            'response': response_data.get('response'),
+            'ai_avatar': response_data.get('emoji'),
+            'bill': bill_data[0],
+            'bills': bill_data,
         }
 
         return success_response(data=return_data, message="创建账单成功", status_code=status.HTTP_201_CREATED)
 
-
+    except AIUnavailableError as e:
+        return fail_response(message=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         # 捕获异常，返回自定义错误响应
         return fail_response(message=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-@api_view(['GET'])
-def analyze_ledger(request):
+@async_api_view(['GET'])
+async def analyze_ledger(request):
     try:
         ledger_id = request.query_params.get('ledger_id')
 
@@ -139,66 +259,85 @@ def analyze_ledger(request):
             return fail_response(message="未提供账本ID", status_code=status.HTTP_400_BAD_REQUEST)
 
         # 检查账本是否存在，并且用户有权限访问
-        try:
-            ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-        except Ledger.DoesNotExist:
+        if not await sync_to_async(user_owns_ledger)(request.user, ledger_id):
             return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
 
         # 获取当前日期
         current_date = datetime.now()
-
-        # 获取这个月的所有收入和支出
-        income = Bill.objects.filter(
-            ledger=ledger,
-            category__inOutType='1',  # 收入
-            date__year=current_date.year,
-            date__month=current_date.month
-        ).aggregate(total_income=models.Sum('amount'))['total_income'] or Decimal('0')
-
-        expense = Bill.objects.filter(
-            ledger=ledger,
-            category__inOutType='2',  # 支出
-            date__year=current_date.year,
-            date__month=current_date.month
-        ).aggregate(total_expense=models.Sum('amount'))['total_expense'] or Decimal('0')
-
-        # 获取各类别支出详情
-        category_expenses = Bill.objects.filter(
-            ledger=ledger,
-            category__inOutType='2',  # 支出
-            date__year=current_date.year,
-            date__month=current_date.month
-        ).values('category__detail_type').annotate(total=models.Sum('amount')).order_by('-total')
-
-        # 生成类别支出摘要
-        category_summary = "\n".join([
-            f"{Category.objects.filter(detail_type=cat['category__detail_type'], inOutType='2').first().get_detail_type_display()}：{cat['total']}元"
-            for cat in category_expenses
-        ])
-
-        # 检查支出是否超过收入的80%
-        is_warning = expense > (income * Decimal('0.7'))
-
-        if is_warning:
-            prompt = generate_analysis_prompt(income, expense, category_summary)
-            ai_response = ai_client.get_chat_response(prompt)
-            ai_response = "本月支出较多，" + ai_response
-        else:
-            ai_response = "本月支出正常，继续保持！"
-
-        # 检查AI响应是否为空
-        if not ai_response:
-            return fail_response(message="AI未返回任何响应", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # 准备返回的数据
-        return_data = {
-            'response': ai_response,
-            'is_warning': is_warning
-        }
+        ledger_id = int(ledger_id)
+
+        # 账本数据没有变化时直接返回上次的分析结果
+        version = await sync_to_async(data_version)(ledger_id)
+        cache_key = (ledger_id, current_date.year, current_date.month, version)
+        return_data = await analysis_cache.aget(*cache_key)
+        if return_data is not None:
+            return success_response(data=return_data, message="分析完成", status_code=status.HTTP_200_OK)
+
+        # 从月度汇总表统计本月收支，支出较多时请AI给出建议
+        is_warning, prompt = await sync_to_async(prepare_analysis)(ledger_id, current_date.year, current_date.month)
+        ai_response = await ai_client.aget_chat_response(prompt, purpose='analysis') if prompt else None
+        try:
+            return_data = finish_analysis(is_warning, ai_response)
+        except ValueError as e:
+            return fail_response(message=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        await analysis_cache.aset(*cache_key, return_data)
 
         return success_response(data=return_data, message="分析完成", status_code=status.HTTP_200_OK)
 
+    except AIUnavailableError as e:
+        return fail_response(message=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         # 捕获异常，返回自定义错误响应
         return fail_response(message=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ai_stats(request):
+    # 当前进程的AI缓存命中率与节省时间、本地分类和账本分析缓存的命中情况，以及上游调用的耗时、结果、熔断状态和 token 用量。
+    # 统计包含所有用户的调用，只对管理员（is_staff）开放
+    return success_response(data={
+        'bill_chat_cache': classification_cache.stats(),
+        'local_classifier': local_classifier.stats(),
+        'analysis_cache': analysis_cache.stats(),
+        'llm_client': {
+            'circuit': ai_client.breaker.state,
+            **ai_client.stats.snapshot(),
+            'tokens': ai_client.usage.snapshot(),
+        },
+    }, message="获取成功")
+
+
+def _job_data(job):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'result': job.result,
+        'error': job.error,
+    }
+
+
+@api_view(['POST'])
+@ledger_required(source='data')
+def analyze_ledger_job(request):
+    """
+    提交本月的账本分析任务，立即返回任务 id，之后轮询任务状态获取结果。
+    账本数据没有变化时返回同一个任务，已完成的直接带有结果。
+    """
+    if request.ledger_id is None:
+        return fail_response(message="未提供账本ID", status_code=status.HTTP_400_BAD_REQUEST)
+
+    current_date = datetime.now()
+    job = enqueue_analysis(request.ledger_id, current_date.year, current_date.month)
+    if job.status == AnalysisJob.DONE:
+        return success_response(data=_job_data(job), message="分析完成", status_code=status.HTTP_200_OK)
+    return success_response(data=_job_data(job), message="分析任务已提交", status_code=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+def analyze_ledger_job_detail(request, job_id):
+    try:
+        job = get_owned(AnalysisJob.objects, request.user, pk=job_id)
+    except AnalysisJob.DoesNotExist:
+        return fail_response(message="任务不存在或无权限访问", status_code=status.HTTP_404_NOT_FOUND)
+    return success_response(data=_job_data(job), message="获取成功")
@@ -14,3 +14,18 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# 预热类别缓存、恢复未完成的后台任务；ASGI 服务器在事件循环中导入本模块，ORM 调用需放到线程里执行
+import threading  # noqa: E402
+from ai.jobs import resume_jobs  # noqa: E402
+from bill.categories import warm_categories_quietly  # noqa: E402
+
+
+def _startup():
+    warm_categories_quietly()
+    resume_jobs()
+
+
+_warm = threading.Thread(target=_startup)
+_warm.start()
+_warm.join()
@@ -54,6 +54,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 放在最前面，统计完整的请求耗时（utils.metrics）
+    'utils.metrics.MetricsMiddleware',
+    # 压缩最终的响应内容，放在其他中间件之前（utils.compression）
+    'utils.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -160,8 +164,41 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # orjson 渲染 JSON；移动端可以通过 Accept: application/msgpack 获取 MessagePack
+    'DEFAULT_RENDERER_CLASSES': (
+        'utils.renderers.ORJSONRenderer',
+        'utils.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# 响应压缩：超过该字节数才压缩；brotli 质量等级与 gzip 压缩级别
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 4
+COMPRESSION_GZIP_LEVEL = 6
+
+# GET /metrics 的访问令牌（config.yaml 中的 metrics.token），为空时只在 DEBUG 下开放，否则返回 404
+METRICS_TOKEN = (config.get('metrics') or {}).get('token')
+
+# 账单列表游标分页的默认/最大每页条数
+BILL_PAGE_SIZE = 50
+BILL_MAX_PAGE_SIZE = 500
+
+# 用户账本 id 集合的缓存时间（秒），账本创建/删除时会主动失效
+LEDGER_IDS_CACHE_TIMEOUT = 300
+
+# 批量导入账单：每批插入的条数、错误报告中最多保留的行数
+BILL_IMPORT_BATCH_SIZE = 1000
+BILL_IMPORT_MAX_ERRORS = 100
+
+# 流式导出账单时每批读取的条数
+BILL_EXPORT_CHUNK_SIZE = 2000
+
+# 增量同步每页的默认/最大变更条数；删除记录保留的天数（由 compact_tombstones 清理）
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 1000
+SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -174,3 +211,60 @@ from openai import OpenAI
 
 OPENAI_API_KEY = config['openai']['api_key']
 OPENAI_BASE_URL = config['openai']['base_url']
+
+# AI 接口为异步视图，需通过 ASGI（backend/asgi.py，例如 uvicorn backend.asgi:application）部署
+# 每个进程同时进行的 AI 请求上限，以及超过上限时的最长排队时间（秒）
+AI_MAX_CONCURRENCY = 20
+AI_QUEUE_TIMEOUT = 10
+
+# 调用上游模型：连接池大小；连接/读取超时与单次调用（含重试）的总期限（秒）；
+# 可重试错误（超时、连接失败、限流、5xx）的最多重试次数与退避时间；
+# 熔断：BREAKER_WINDOW 秒内至少 BREAKER_MIN_CALLS 次调用且失败率达到 BREAKER_FAILURE_RATE 时，BREAKER_COOLDOWN 秒内直接失败
+AI_CLIENT = {
+    'MAX_CONNECTIONS': 100,
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 30,
+    'DEADLINE': 60,
+    'MAX_RETRIES': 2,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 8,
+    'BREAKER_FAILURE_RATE': 0.5,
+    'BREAKER_MIN_CALLS': 10,
+    'BREAKER_WINDOW': 60,
+    'BREAKER_COOLDOWN': 30,
+}
+
+# bill_chat 分类结果缓存：BACKEND 为 local（进程内 LRU，MAX_ENTRIES 条）或 django（使用 CACHES 中 ALIAS 对应的缓存，多进程共享）
+AI_CLASSIFICATION_CACHE = {
+    'BACKEND': 'local',
+    'MAX_ENTRIES': 10000,
+    'TTL': 7 * 24 * 3600,
+}
+
+# bill_chat 本地分类（关键词 + 用户历史账单训练的朴素贝叶斯）：置信度达到 THRESHOLD 时不调用AI；
+# 历史账单少于 MIN_SAMPLES 条时只用关键词；模型最多使用最近 MAX_HISTORY 条账单，TTL 秒后重新训练
+AI_LOCAL_CLASSIFIER = {
+    'THRESHOLD': 0.8,
+    'MIN_SAMPLES': 20,
+    'MAX_HISTORY': 2000,
+    'TTL': 600,
+    # 账单数量比训练时变化超过该比例（至少 MIN_RETRAIN 笔）时重新训练
+    'RETRAIN_RATIO': 0.1,
+    'MIN_RETRAIN': 5,
+}
+
+# 账本分析结果的缓存时间（秒）；账单变化时账本数据版本号改变，缓存立即失效
+AI_ANALYSIS_CACHE_TIMEOUT = 24 * 3600
+
+# 账本分析后台任务：Web 进程中的工作线程数（0 表示另外运行 run_ai_workers）、最多执行次数、
+# 首次重试的等待秒数（之后按 2 的幂递增）、空闲时检查新任务的间隔、任务领取后的最长执行时间
+AI_JOBS = {
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 5,
+    'POLL_INTERVAL': 2,
+    'LEASE_SECONDS': 300,
+    # 完成或失败的任务保留天数，工作线程每隔 PRUNE_INTERVAL 秒清理一次
+    'RETENTION_DAYS': 7,
+    'PRUNE_INTERVAL': 3600,
+}
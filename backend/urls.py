@@ -18,8 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+
+from utils.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),  # 管理后台
+    path('metrics', metrics_view, name='metrics'),  # Prometheus 指标
     path('api/', include('user.urls')),  # 将所有用户相关的API放到/api/user/下
     path('api/', include('bill.urls')),  # 将所有账单相关的API放到/api/bill/下
     path('api/', include('ai.urls')),  # 将所有AI相关的API放到/api/ai/下
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# 预热类别缓存、恢复未完成的后台任务
+from ai.jobs import resume_jobs  # noqa: E402
+from bill.categories import warm_categories_quietly  # noqa: E402
+warm_categories_quietly()
+resume_jobs()
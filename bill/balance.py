@@ -0,0 +1,142 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Category, DailyBalance, Ledger, MonthlyBalance
+
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+
+
+def apply_facts(facts, sign=1):
+    """
+    把一组账单（rollup.BillFact）按 sign 累加到每日余额表和月末累计检查点。
+
+    每日余额只更新受影响日期的行；累计值只保存在每月一行的检查点上，
+    写入某日的账单只需更新该月及之后各月的检查点（每年 12 行），与之后有多少天的数据无关。
+    """
+    deltas = defaultdict(lambda: defaultdict(lambda: [ZERO, ZERO]))
+    for fact in facts:
+        delta = deltas[fact.ledger_id][fact.date]
+        if fact.inOutType == Category.INCOME:
+            delta[0] += fact.amount * sign
+        elif fact.inOutType == Category.EXPENSE:
+            delta[1] += fact.amount * sign
+
+    with transaction.atomic():
+        for ledger_id in sorted(deltas):
+            _apply_ledger(ledger_id, deltas[ledger_id])
+
+
+def _apply_ledger(ledger_id, days):
+    days = {day: delta for day, delta in days.items() if delta[0] or delta[1]}
+    if not days:
+        return
+    # 新建检查点时要读前一个检查点的累计值，同一账本的余额更新串行执行。
+    # 账单写入前 bump_data_version 已经锁住了账本行，这里不会增加新的等待
+    if not list(Ledger.objects.select_for_update().filter(pk=ledger_id).values_list('pk', flat=True)):
+        return
+
+    months = defaultdict(lambda: [ZERO, ZERO])
+    for day, (income, expense) in sorted(days.items()):
+        key = dict(ledger_id=ledger_id, date=day)
+        if not DailyBalance.objects.filter(**key).update(income=F('income') + income, expense=F('expense') + expense):
+            DailyBalance.objects.create(income=income, expense=expense, **key)
+        month = months[day.replace(day=1)]
+        month[0] += income
+        month[1] += expense
+    _apply_checkpoints(ledger_id, months)
+
+
+def _apply_checkpoints(ledger_id, months):
+    rows = MonthlyBalance.objects.filter(ledger_id=ledger_id)
+    touched = sorted(month for month, (income, expense) in months.items() if income or expense)
+    if not touched:
+        return
+
+    # 先按变动前的累计值补齐缺少的检查点，再统一累加
+    existing = set(rows.filter(month__in=touched).values_list('month', flat=True))
+    for month in touched:
+        if month not in existing:
+            cum_income, cum_expense = _checkpoint_before(ledger_id, month)
+            MonthlyBalance.objects.create(
+                ledger_id=ledger_id, month=month, cum_income=cum_income, cum_expense=cum_expense,
+            )
+
+    # 相邻两个变动月份之间的检查点加上相同的累计变动量，每个区间一条 UPDATE，每行只更新一次
+    running_income, running_expense = ZERO, ZERO
+    for index, month in enumerate(touched):
+        running_income += months[month][0]
+        running_expense += months[month][1]
+        span = rows.filter(month__gte=month)
+        if index + 1 < len(touched):
+            span = span.filter(month__lt=touched[index + 1])
+        span.update(cum_income=F('cum_income') + running_income, cum_expense=F('cum_expense') + running_expense)
+
+
+def _checkpoint_before(ledger_id, month):
+    """某月之前（上一个有变动的月份月末）的累计收入、支出"""
+    row = MonthlyBalance.objects.filter(
+        ledger_id=ledger_id, month__lt=month
+    ).order_by('-month').values_list('cum_income', 'cum_expense').first()
+    return row or (ZERO, ZERO)
+
+
+def _latest(ledger_id):
+    row = MonthlyBalance.objects.filter(ledger_id=ledger_id).order_by('-month').values_list(
+        'cum_income', 'cum_expense').first()
+    return row or (ZERO, ZERO)
+
+
+def _totals(rows):
+    # 统一保留两位小数，与逐日的收支字段一致（SQLite 的 SUM 不保留小数位数）
+    totals = rows.aggregate(income=Sum('income'), expense=Sum('expense'))
+    return (totals['income'] or ZERO).quantize(CENT), (totals['expense'] or ZERO).quantize(CENT)
+
+
+def balance_on(ledger_id, day):
+    """截至某日（含）的累计收入、支出：上个月末的检查点加上当月至该日的每日收支（至多 31 行），两次索引查询"""
+    month = day.replace(day=1)
+    base_income, base_expense = _checkpoint_before(ledger_id, month)
+    income, expense = _totals(DailyBalance.objects.filter(ledger_id=ledger_id, date__gte=month, date__lte=day))
+    return base_income + income, base_expense + expense
+
+
+def opening_balance(ledger_id, start):
+    """区间开始前（start 前一日）的累计收入、支出；start 为空时从零开始"""
+    return balance_on(ledger_id, start - timedelta(days=1)) if start else (ZERO, ZERO)
+
+
+def range_totals(ledger_id, start=None, end=None, opening=None):
+    """
+    任意闭区间 [start, end] 的收入、支出和结余，由两端的累计值相减得到，与区间长度无关。
+    opening 为 opening_balance() 的结果，调用方已经算过时传入，避免重复查询。
+    """
+    end_income, end_expense = balance_on(ledger_id, end) if end else _latest(ledger_id)
+    start_income, start_expense = opening if opening is not None else opening_balance(ledger_id, start)
+    income = end_income - start_income
+    expense = end_expense - start_expense
+    return {'income': income, 'expense': expense, 'net': income - expense}
+
+
+def history(ledger_id, start=None, end=None, opening=None):
+    """
+    区间内每个有账单的日期的当日收支和累计收支。
+    从区间开始前的累计值（opening，同 range_totals）逐日相加；查询的行数与返回的点数相同。
+    """
+    rows = DailyBalance.objects.filter(ledger_id=ledger_id)
+    cum_income, cum_expense = opening if opening is not None else opening_balance(ledger_id, start)
+    if start:
+        rows = rows.filter(date__gte=start)
+    if end:
+        rows = rows.filter(date__lte=end)
+
+    points = []
+    for day, income, expense in rows.order_by('date').values_list('date', 'income', 'expense'):
+        cum_income += income
+        cum_expense += expense
+        points.append((day, income, expense, cum_income, cum_expense))
+    return points
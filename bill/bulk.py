@@ -0,0 +1,37 @@
+from django.db import transaction
+
+from .models import Bill
+from .signals import bills_bulk_created
+from .sync import assign_seqs
+
+
+def _fill_pks(bills, batch_size):
+    """
+    MySQL 的 bulk_create 不回填主键。每个用户的变更序号唯一，
+    按 (账本, 序号) 走 (ledger, seq) 索引查回刚插入的账单 id，需要在插入的同一事务中调用。
+    """
+    missing = {(bill.ledger_id, bill.seq): bill for bill in bills if bill.pk is None}
+    keys = list(missing)
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        rows = Bill.objects.filter(
+            ledger_id__in={ledger_id for ledger_id, _ in batch}, seq__in=[seq for _, seq in batch],
+        ).values_list('ledger_id', 'seq', 'id')
+        for ledger_id, seq, pk in rows:
+            bill = missing.get((ledger_id, seq))
+            if bill is not None:
+                bill.pk = pk
+                bill._state.adding = False
+
+
+def bulk_create_bills(bills, batch_size=1000):
+    """
+    批量插入账单，并发送 bills_bulk_created 信号维护汇总数据。
+    汇总的更新、变更序号的分配与插入在同一事务中；返回的账单在所有数据库上都带有 id。
+    """
+    with transaction.atomic():
+        assign_seqs(bills)
+        created = Bill.objects.bulk_create(bills, batch_size=batch_size)
+        _fill_pks(created, batch_size)
+        bills_bulk_created.send(sender=Bill, bills=created)
+    return created
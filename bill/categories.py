@@ -0,0 +1,97 @@
+import threading
+from types import MappingProxyType
+
+from django.db import DatabaseError
+
+from .models import Category
+
+
+class CategoryRegistry:
+    """
+    类别表的不可变快照：(inOutType, detail_type) <-> id。
+    类别表只有固定的几十行，进程内缓存后创建/更新账单和预算时不再查询类别表。
+    """
+
+    def __init__(self, rows):
+        self.ids = MappingProxyType({(in_out_type, detail_type): pk for pk, in_out_type, detail_type in rows})
+        self.keys = MappingProxyType({pk: key for key, pk in self.ids.items()})
+
+    def with_rows(self, rows):
+        """返回加入新行后的新快照，原快照不变"""
+        merged = [(pk, in_out_type, detail_type) for (in_out_type, detail_type), pk in self.ids.items()]
+        return CategoryRegistry(merged + list(rows))
+
+
+_registry = None
+_lock = threading.Lock()
+
+
+def _load():
+    return CategoryRegistry(Category.objects.values_list('id', 'inOutType', 'detail_type'))
+
+
+def warm_categories():
+    """
+    确保所有预置类别都已存在并加载快照，在应用启动时调用。
+    ignore_conflicts 配合 (inOutType, detail_type) 唯一约束，多个进程同时启动也不会重复创建。
+    """
+    global _registry
+    Category.objects.bulk_create([
+        Category(inOutType=in_out_type, detail_type=detail_type)
+        for in_out_type, names in Category.DETAIL_TYPE_NAMES.items()
+        for detail_type in names
+    ], ignore_conflicts=True)
+    with _lock:
+        _registry = _load()
+    return _registry
+
+
+def warm_categories_quietly():
+    """启动时预热；数据库尚未迁移等情况下跳过，首次使用时再加载"""
+    try:
+        warm_categories()
+    except DatabaseError:
+        pass
+
+
+def get_registry():
+    registry = _registry
+    if registry is None:
+        registry = warm_categories()
+    return registry
+
+
+def _add(category):
+    global _registry
+    with _lock:
+        _registry = get_registry().with_rows([(category.pk, category.inOutType, category.detail_type)])
+
+
+def resolve_category_id(inOutType, detail_type):
+    """(inOutType, detail_type) -> 类别 id，命中快照时不访问数据库"""
+    key = (str(inOutType), str(detail_type))
+    pk = get_registry().ids.get(key)
+    if pk is None:
+        # 非预置的类别，保持原来 get_or_create 的行为；get_or_create 自身处理并发创建的唯一约束冲突
+        category, _ = Category.objects.get_or_create(inOutType=key[0], detail_type=key[1])
+        _add(category)
+        pk = category.pk
+    return pk
+
+
+def category_key(category_id):
+    """类别 id -> (inOutType, detail_type)"""
+    key = get_registry().keys.get(category_id)
+    if key is None:
+        category = Category.objects.get(pk=category_id)
+        _add(category)
+        key = (category.inOutType, category.detail_type)
+    return key
+
+
+def category_ids(inOutType=None, detail_type=None):
+    """满足条件的类别 id 列表，用于把类别过滤转换成 category_id IN (...)"""
+    return [
+        pk for (in_out_type, detail), pk in get_registry().ids.items()
+        if (not inOutType or in_out_type == inOutType) and (not detail_type or detail == detail_type)
+    ]
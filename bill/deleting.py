@@ -0,0 +1,48 @@
+"""
+正在被删除的账本、用户（按线程记录）。
+
+级联删除账本的账单、预算时不再逐笔维护汇总数据、也不再逐笔记录删除（bill.signals）。
+标记由 Ledger / User 的 delete()（包括 QuerySet.delete()）通过 deleting() 设置，
+删除结束后无论成功还是抛出异常都会清除，失败的删除不会让之后的账单写入跳过汇总维护。
+"""
+import threading
+from contextlib import contextmanager
+
+_state = threading.local()
+
+
+def deleting_ledgers():
+    if not hasattr(_state, 'ledgers'):
+        _state.ledgers = set()
+    return _state.ledgers
+
+
+def deleting_users():
+    if not hasattr(_state, 'users'):
+        _state.users = set()
+    return _state.users
+
+
+@contextmanager
+def deleting(ledger_ids=(), user_ids=()):
+    """在 with 块内把账本、用户标记为正在删除；嵌套调用时只清除本层新加的标记"""
+    ledgers, users = deleting_ledgers(), deleting_users()
+    added_ledgers = set(ledger_ids) - ledgers
+    added_users = set(user_ids) - users
+    ledgers |= added_ledgers
+    users |= added_users
+    try:
+        yield
+    finally:
+        ledgers -= added_ledgers
+        users -= added_users
+
+
+@contextmanager
+def deleting_owners(user_ids):
+    """删除用户时使用：用户及其全部账本都标记为正在删除"""
+    from .models import Ledger
+
+    user_ids = list(user_ids)
+    with deleting(Ledger.objects.filter(user_id__in=user_ids).values_list('pk', flat=True), user_ids):
+        yield
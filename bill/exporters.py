@@ -0,0 +1,112 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+
+from .categories import category_key
+from .models import Category
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = {
+    CSV: ('text/csv; charset=utf-8', 'csv'),
+    JSONL: ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+# 与导入接口的列保持一致，导出的文件可以直接再导入
+COLUMNS = ('id', 'date', 'amount', 'inOutType', 'detail_type', 'category', 'remark', 'create_time')
+
+
+def _chunk(queryset, last, chunk_size):
+    """按 (date, id) 游标读取 last 之后的一批账单，每批一条带 LIMIT 的查询"""
+    queryset = queryset.order_by('date', 'id').values('id', 'date', 'amount', 'category_id', 'remark', 'create_time')
+    if last is not None:
+        queryset = queryset.filter(Q(date__gt=last['date']) | Q(date=last['date'], id__gt=last['id']))
+    return list(queryset[:chunk_size])
+
+
+def iter_chunks(queryset, chunk_size=2000):
+    """
+    按 (date, id) 游标分批读取账单，
+    不依赖数据库驱动的服务端游标，内存占用只与 chunk_size 有关。
+    """
+    last = None
+    while True:
+        rows = _chunk(queryset, last, chunk_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+
+def _record(row):
+    in_out_type, detail_type = category_key(row['category_id'])
+    return {
+        'id': row['id'],
+        'date': row['date'].isoformat(),
+        'amount': format(row['amount'], 'f'),
+        'inOutType': in_out_type,
+        'detail_type': detail_type,
+        'category': Category.detail_type_name(in_out_type, detail_type),
+        'remark': row['remark'] or '',
+        'create_time': timezone.localtime(row['create_time']).isoformat(),
+    }
+
+
+class _Echo:
+    """csv.writer 需要一个带 write 的对象，这里直接把写入的行返回给生成器"""
+
+    def write(self, value):
+        return value
+
+
+def _encoder(fmt):
+    """返回 (文件头, 把一批账单编码为文本的函数)"""
+    if fmt == CSV:
+        writer = csv.writer(_Echo())
+
+        def encode(rows):
+            return ''.join(writer.writerow([record[column] for column in COLUMNS]) for record in map(_record, rows))
+        # 带 BOM，方便 Excel 正确识别中文
+        return '\ufeff' + writer.writerow(COLUMNS), encode
+
+    def encode(rows):
+        return ''.join(json.dumps(_record(row), ensure_ascii=False) + '\n' for row in rows)
+    return '', encode
+
+
+def stream_bills(queryset, fmt, chunk_size=2000):
+    """WSGI 下使用的同步生成器，每批账单输出一块"""
+    header, encode = _encoder(fmt)
+    if header:
+        yield header
+    for rows in iter_chunks(queryset, chunk_size):
+        yield encode(rows)
+
+
+async def astream_bills(queryset, fmt, chunk_size=2000):
+    """
+    ASGI 下使用的异步生成器。StreamingHttpResponse 在 ASGI 下会把同步迭代器整个读进内存后才开始发送，
+    这里每批的查询和编码放在 sync_to_async 中执行，发送完一批再读取下一批。
+    """
+    header, encode = _encoder(fmt)
+    if header:
+        yield header
+
+    def next_chunk(last):
+        rows = _chunk(queryset, last, chunk_size)
+        # 类别缓存未命中时会查询数据库，编码也放在同步线程中
+        return encode(rows), (rows[-1] if rows else None), len(rows)
+
+    last = None
+    while True:
+        text, last, count = await sync_to_async(next_chunk)(last)
+        if not count:
+            return
+        yield text
+        if count < chunk_size:
+            return
@@ -0,0 +1,148 @@
+import codecs
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .bulk import bulk_create_bills
+from .categories import resolve_category_id
+from .models import Bill, Category
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = (CSV, JSONL)
+
+COLUMNS = ('date', 'amount', 'inOutType', 'detail_type', 'remark')
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def detect_format(uploaded_file, fmt=None):
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise ImportFormatError(f"不支持的文件格式：{fmt}")
+        return fmt
+    name = (uploaded_file.name or '').lower()
+    if name.endswith('.csv'):
+        return CSV
+    if name.endswith(('.jsonl', '.ndjson')):
+        return JSONL
+    raise ImportFormatError("无法识别文件格式，请指定 format=csv 或 format=jsonl")
+
+
+def iter_rows(uploaded_file, fmt):
+    """
+    逐行解析上传文件，生成 (行号, 数据, 错误)。
+    按块读取上传文件（大文件由 Django 落到临时文件），内存占用与文件大小无关。
+    """
+    lines = codecs.iterdecode(uploaded_file.chunks(), 'utf-8-sig')
+    lines = _split_lines(lines)
+    if fmt == CSV:
+        reader = csv.DictReader(lines)
+        missing = [column for column in COLUMNS if column != 'remark' and column not in (reader.fieldnames or [])]
+        if missing:
+            raise ImportFormatError(f"CSV 缺少列：{','.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row, None
+    else:
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, {'line': [f"JSON 解析失败：{e.msg}"]}
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, {'line': ["每一行必须是一个 JSON 对象"]}
+                continue
+            yield line_no, row, None
+
+
+def _split_lines(chunks):
+    # chunks() 按字节块切分，这里重新按行切分（保留换行符，csv 模块需要）
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+_date_field = Bill._meta.get_field('date')
+_amount_field = Bill._meta.get_field('amount')
+_remark_field = Bill._meta.get_field('remark')
+
+
+def validate_row(row):
+    """校验一行数据，返回 (清洗后的字段, 错误)"""
+    errors = {}
+    cleaned = {}
+    for name, field in (('date', _date_field), ('amount', _amount_field)):
+        value = row.get(name)
+        try:
+            cleaned[name] = field.clean(None if value in (None, '') else str(value), None)
+        except ValidationError as e:
+            errors[name] = e.messages
+
+    remark = row.get('remark') or None
+    try:
+        cleaned['remark'] = _remark_field.clean(remark, None)
+    except ValidationError as e:
+        errors['remark'] = e.messages
+
+    in_out_type = str(row.get('inOutType') or '')
+    detail_type = str(row.get('detail_type') or '')
+    if in_out_type not in Category.DETAIL_TYPE_NAMES:
+        errors['inOutType'] = ["收支类型不合法"]
+    elif detail_type not in Category.DETAIL_TYPE_NAMES[in_out_type]:
+        errors['detail_type'] = ["该收支类型下的详细类型不合法"]
+    else:
+        cleaned['category_id'] = resolve_category_id(in_out_type, detail_type)
+    return cleaned, errors
+
+
+def import_bills(ledger_id, uploaded_file, fmt=None):
+    """
+    把上传文件中的账单导入到指定账本：合法的行按批 bulk_create，不合法的行记录到错误报告中。
+    整个导入在一个事务里，中途出现异常时不会留下一半数据。
+    """
+    fmt = detect_format(uploaded_file, fmt)
+    batch_size = getattr(settings, 'BILL_IMPORT_BATCH_SIZE', 1000)
+    max_errors = getattr(settings, 'BILL_IMPORT_MAX_ERRORS', 100)
+
+    created = 0
+    failed = 0
+    errors = []
+    batch = []
+    with transaction.atomic():
+        for line_no, row, row_errors in iter_rows(uploaded_file, fmt):
+            cleaned = None
+            if row_errors is None:
+                cleaned, row_errors = validate_row(row)
+            if row_errors:
+                failed += 1
+                if len(errors) < max_errors:
+                    errors.append({'line': line_no, 'errors': row_errors})
+                continue
+
+            batch.append(Bill(ledger_id=ledger_id, **cleaned))
+            if len(batch) >= batch_size:
+                created += len(bulk_create_bills(batch, batch_size=batch_size))
+                batch = []
+        if batch:
+            created += len(bulk_create_bills(batch, batch_size=batch_size))
+
+    return {
+        'created': created,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+    }
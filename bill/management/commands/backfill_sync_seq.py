@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bill.models import Bill, Budget, Ledger, SyncCounter
+
+
+class Command(BaseCommand):
+    help = (
+        "为增加变更序号之前就存在的账本、账单、预算（seq 为 0）分配序号，使增量同步的全量拉取能返回它们。"
+        "添加 seq 字段的迁移完成后执行一次，可以重复执行"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        # 先账本后账单、预算：同一用户的账本序号小于其中的账单和预算
+        for model, user_field in ((Ledger, 'user_id'), (Bill, 'ledger__user_id'), (Budget, 'ledger__user_id')):
+            user_ids = model.objects.filter(seq=0).values_list(user_field, flat=True).distinct()
+            for user_id in list(user_ids):
+                while True:
+                    with transaction.atomic():
+                        pks = list(
+                            model.objects.filter(seq=0, **{user_field: user_id})
+                            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+                        )
+                        if not pks:
+                            break
+                        last = SyncCounter.allocate(user_id, len(pks))
+                        objects = [model(pk=pk, seq=seq) for seq, pk in enumerate(pks, start=last - len(pks) + 1)]
+                        # bulk_update 不调用 save()，不会再分配序号
+                        model.objects.bulk_update(objects, ['seq'])
+                    total += len(pks)
+        self.stdout.write(self.style.SUCCESS(f"已为 {total} 条数据分配变更序号"))
@@ -0,0 +1,73 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bill.encoders import BillRowEncoder
+from bill.models import Bill, Ledger, Category
+from bill.serializers import BillSerializer
+from user.models import User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "对比 BillSerializer 与 BillRowEncoder 的列表序列化吞吐（行/秒），数据在事务中生成并回滚"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self.run(size, options['batch_size'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def run(self, size, batch_size):
+        user = User.objects.create_user(username=f'bench_{time.time_ns()}', password=None)
+        ledger = Ledger.objects.filter(user=user).first() or Ledger.objects.create(name='bench', user=user)
+
+        categories = [
+            Category.objects.get_or_create(inOutType=Category.EXPENSE, detail_type=code)[0]
+            for code, _ in Category.DETAIL_TYPE_EXPENSE
+        ]
+        start = date.today() - timedelta(days=3650)
+        rng = random.Random(size)
+        for offset in range(0, size, batch_size):
+            Bill.objects.bulk_create([
+                Bill(
+                    ledger=ledger,
+                    category=rng.choice(categories),
+                    amount=Decimal(rng.randint(100, 100000)) / 100,
+                    remark='bench',
+                    date=start + timedelta(days=rng.randint(0, 3650)),
+                )
+                for _ in range(min(batch_size, size - offset))
+            ])
+
+        bills = Bill.objects.filter(ledger=ledger)
+
+        begin = time.perf_counter()
+        encoder = BillRowEncoder()
+        fast = encoder.encode(encoder.values(bills))
+        fast_elapsed = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        slow = BillSerializer(bills, many=True).data
+        slow_elapsed = time.perf_counter() - begin
+
+        assert len(fast) == len(slow) == size
+        self.stdout.write(
+            f"{size} bills: BillSerializer {size / slow_elapsed:,.0f} rows/s ({slow_elapsed:.2f}s), "
+            f"BillRowEncoder {size / fast_elapsed:,.0f} rows/s ({fast_elapsed:.2f}s), "
+            f"x{slow_elapsed / fast_elapsed:.1f}"
+        )
@@ -0,0 +1,102 @@
+import gzip
+import random
+import statistics
+import time
+from datetime import date
+from decimal import Decimal
+
+import brotli
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from bill.bulk import bulk_create_bills
+from bill.categories import resolve_category_id, warm_categories
+from bill.models import Bill, Category, Ledger
+from user.models import User
+from utils.renderers import MessagePackRenderer, ORJSONRenderer
+
+RENDERERS = (
+    ('drf-json', JSONRenderer()),
+    ('orjson', ORJSONRenderer()),
+    ('msgpack', MessagePackRenderer()),
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "对比 DRF JSONRenderer、ORJSONRenderer、MessagePackRenderer 渲染 bill_list 和 daily_report 响应的耗时，"
+        "以及原始、gzip、brotli 压缩后的字节数。数据在事务中生成并回滚"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 20000], help="账单数")
+        parser.add_argument('--repeat', type=int, default=20, help="每种渲染器重复渲染的次数，取中位数")
+
+    def handle(self, *args, **options):
+        warm_categories()
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self.run(size, options['repeat'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def run(self, size, repeat):
+        user = User.objects.create_user(username=f'bench_{time.time_ns()}', password=None)
+        ledger = Ledger.objects.get(user=user, isDefault=True)
+        today = date.today()
+        rng = random.Random(size)
+        expense_types = [code for code, _ in Category.DETAIL_TYPE_EXPENSE]
+        # 账单都在本月，daily_report 的每一天都有数据
+        bulk_create_bills([
+            Bill(
+                ledger=ledger,
+                category_id=resolve_category_id(Category.EXPENSE, rng.choice(expense_types)),
+                amount=Decimal(rng.randint(100, 100000)) / 100,
+                remark=rng.choice(['午饭', '打车', '奶茶', None]),
+                date=today.replace(day=rng.randint(1, 28)),
+            )
+            for _ in range(size)
+        ])
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        payloads = {
+            'bill_list': client.get('/api/bills/', {'ledger_id': ledger.id}).data,
+            'daily_report': client.get('/api/daily-report/', {
+                'ledger_id': ledger.id, 'year': today.year, 'month': today.month,
+            }).data,
+        }
+
+        self.stdout.write(f"{size} 条账单（压缩阈值 {getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)} 字节）")
+        self.stdout.write(
+            f"  {'payload':<13}{'renderer':<10}{'render ms':>10}{'bytes':>11}"
+            f"{'gzip':>10}{'gzip ms':>9}{'br':>10}{'br ms':>8}"
+        )
+        for name, data in payloads.items():
+            for renderer_name, renderer in RENDERERS:
+                timings = []
+                for _ in range(repeat):
+                    began = time.perf_counter()
+                    body = renderer.render(data, renderer.media_type)
+                    timings.append(time.perf_counter() - began)
+
+                began = time.perf_counter()
+                gzipped = gzip.compress(body, compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+                gzip_ms = (time.perf_counter() - began) * 1000
+                began = time.perf_counter()
+                brotlied = brotli.compress(body, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4))
+                br_ms = (time.perf_counter() - began) * 1000
+
+                self.stdout.write(
+                    f"  {name:<13}{renderer_name:<10}{statistics.median(timings) * 1000:>10.2f}{len(body):>11,}"
+                    f"{len(gzipped):>10,}{gzip_ms:>9.2f}{len(brotlied):>10,}{br_ms:>8.2f}"
+                )
@@ -0,0 +1,88 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+
+from bill.encoders import BillRowEncoder
+from bill.models import Bill, Ledger
+from bill.pagination import KeysetPaginator
+from bill.reports import bill_report_rows, month_range
+from bill.views import BillFilter
+
+
+class _Request:
+    # KeysetPaginator 只用到 query_params
+    def __init__(self, query):
+        self.query_params = QueryDict(query)
+
+
+class Command(BaseCommand):
+    help = "输出账单热点查询的 EXPLAIN，发现对账单表的全表扫描时以非零状态退出（用于防止索引回退）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', type=int, help="用于生成查询的账本，默认取第一个账本")
+
+    def handle(self, *args, **options):
+        ledger_id = options['ledger'] or Ledger.objects.order_by('id').values_list('id', flat=True).first() or 0
+        failures = []
+        for name, queryset in self.queries(ledger_id):
+            plan, full_scan = self.explain(queryset)
+            self.stdout.write(f"== {name}\n{plan}\n")
+            if full_scan:
+                failures.append(name)
+
+        if failures:
+            raise CommandError(f"以下查询对 {Bill._meta.db_table} 做了全表扫描：{', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("账单查询均使用了索引"))
+
+    @staticmethod
+    def queries(ledger_id):
+        """与 bill_list 视图相同的方式构造查询：BillFilter 过滤、BillRowEncoder 选列、KeysetPaginator 分页"""
+        bills = Bill.objects.filter(ledger_id=ledger_id)
+        encoder = BillRowEncoder()
+
+        def listed(query):
+            return encoder.values(BillFilter(QueryDict(query), queryset=bills).qs)
+
+        def paged(query):
+            paginator = KeysetPaginator(_Request(query))
+            rows = encoder.values(BillFilter(QueryDict(query), queryset=bills).qs, paginator.field_name, 'id')
+            return paginator.page_queryset(rows)
+
+        start, end = month_range(2024, 1)
+        # 游标指向 2024-01-01 的某一行，与客户端翻页时传回的游标相同
+        cursor = KeysetPaginator(_Request('')).encode_cursor(start, 1000)
+        yield 'bill_list', listed('')
+        yield 'bill_list?page_size', paged('page_size=50')
+        yield 'bill_list?year&month', listed('year=2024&month=1')
+        yield 'bill_list?year&month&day', listed('year=2024&month=1&day=1')
+        yield 'bill_list?inOutType&detail_type', listed('inOutType=2&detail_type=1')
+        yield 'bill_list?cursor', paged(f'page_size=50&cursor={cursor}')
+        yield 'daily_report', bill_report_rows(ledger_id, start, end)
+
+    @staticmethod
+    def explain(queryset):
+        table = Bill._meta.db_table
+        if connection.vendor == 'mysql':
+            plan = queryset.explain(format='json')
+
+            def walk(node):
+                if isinstance(node, dict):
+                    if node.get('table_name') == table and node.get('access_type') == 'ALL':
+                        return True
+                    return any(walk(value) for value in node.values())
+                if isinstance(node, list):
+                    return any(walk(value) for value in node)
+                return False
+            return plan, walk(json.loads(plan))
+
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            full_scan = any(
+                re.search(rf'\bSCAN {table}\b', line) and 'INDEX' not in line
+                for line in plan.splitlines()
+            )
+            return plan, full_scan
+        return plan, False
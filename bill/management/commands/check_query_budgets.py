@@ -0,0 +1,380 @@
+import random
+import re
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ai.models import AnalysisJob
+from ai.openai_client import ai_client
+from bill.bulk import bulk_create_bills
+from bill.categories import resolve_category_id, warm_categories
+from bill.models import Bill, Budget, Category, Ledger
+from bill.sync import assign_seqs
+from bill.versions import bump_data_version
+from user.models import User
+
+# 每个场景稳定状态（缓存已预热）下允许的最多 SQL 条数，以及允许访问的表。
+# SQL 条数在不同数据量下必须相同；访问了允许之外的表（例如逐行查类别、账本）同样视为失败。
+USER = 'user'
+LEDGER = 'bill_ledger'
+BILL = 'bill_bill'
+BUDGET = 'bill_budget'
+MONTHLY = 'bill_monthlycategorytotal'
+DAILY = 'bill_dailybalance'
+BALANCE = 'bill_monthlybalance'
+JOB = 'ai_analysisjob'
+OUTSTANDING = 'token_blacklist_outstandingtoken'
+BLACKLISTED = 'token_blacklist_blacklistedtoken'
+CATEGORY = 'bill_category'
+COUNTER = 'bill_synccounter'
+TOMBSTONE = 'bill_tombstone'
+
+BUDGETS = {
+    'GET ledger_list': (2, {USER, LEDGER}),
+    'POST ledger_list': (4, {USER, LEDGER, COUNTER}),
+    'GET ledger_detail': (2, {USER, LEDGER}),
+    'PUT ledger_detail': (6, {USER, LEDGER, COUNTER}),
+    'DELETE ledger_detail': (13, {USER, LEDGER, BILL, BUDGET, MONTHLY, DAILY, BALANCE, JOB, COUNTER, TOMBSTONE}),
+    'GET bill_list': (3, {USER, LEDGER, BILL}),
+    'GET bill_list?page_size': (3, {USER, LEDGER, BILL}),
+    'GET bill_list?year&month': (3, {USER, LEDGER, BILL}),
+    'GET bill_list?inOutType&detail_type': (3, {USER, LEDGER, BILL}),
+    'POST bill_list': (11, {USER, LEDGER, BILL, MONTHLY, DAILY, BALANCE, COUNTER}),
+    'GET bill_detail': (3, {USER, LEDGER, BILL}),
+    'PUT bill_detail': (19, {USER, LEDGER, BILL, MONTHLY, DAILY, BALANCE, COUNTER}),
+    'DELETE bill_detail': (14, {USER, LEDGER, BILL, MONTHLY, DAILY, BALANCE, COUNTER, TOMBSTONE}),
+    # 导入的 20 行覆盖 20 个类别，汇总表按 (月份, 类别) 逐组更新；条数只随文件中的类别数变化
+    'POST bill_import': (30, {USER, LEDGER, BILL, MONTHLY, DAILY, BALANCE, COUNTER}),
+    'GET bill_export': (2, {USER, BILL}),
+    'GET budget_list': (3, {USER, LEDGER, BUDGET}),
+    'POST budget_list': (7, {USER, LEDGER, BUDGET, COUNTER}),
+    'GET budget_detail': (2, {USER, BUDGET}),
+    'PUT budget_detail': (8, {USER, LEDGER, BUDGET, COUNTER}),
+    'DELETE budget_detail': (9, {USER, LEDGER, BUDGET, COUNTER, TOMBSTONE}),
+    'GET monthly_report': (3, {USER, LEDGER, MONTHLY}),
+    'GET daily_report': (3, {USER, LEDGER, BILL}),
+    'GET total_expense_by_category': (2, {USER, MONTHLY}),
+    'GET total_budget': (3, {USER, LEDGER, BUDGET}),
+    # 带上 If-None-Match 且数据未变化：只查账本版本号
+    'GET bill_list 304': (2, {USER, LEDGER}),
+    'GET budget_list 304': (2, {USER, LEDGER}),
+    'GET monthly_report 304': (2, {USER, LEDGER}),
+    'GET daily_report 304': (2, {USER, LEDGER}),
+    'GET total_budget 304': (2, {USER, LEDGER}),
+    'GET balance_history': (6, {USER, DAILY, BALANCE}),
+    'GET sync': (6, {USER, LEDGER, BILL, BUDGET, COUNTER, TOMBSTONE}),
+    'POST register': (7, {USER, LEDGER, COUNTER}),
+    'POST login': (3, {USER, OUTSTANDING}),
+    'POST token_refresh': (1, {OUTSTANDING, BLACKLISTED}),
+    'GET token_check': (1, {USER}),
+    'GET user_info': (2, {USER, LEDGER, BILL}),
+    'PUT user_info': (3, {USER}),
+    'POST logout': (5, {USER, OUTSTANDING, BLACKLISTED}),
+    'POST normal_chat': (1, {USER}),
+    'POST bill_chat': (11, {USER, LEDGER, BILL, MONTHLY, DAILY, BALANCE, COUNTER}),
+    'GET analyze_ledger': (3, {USER, LEDGER, MONTHLY}),
+    'POST analyze_ledger_job': (3, {USER, LEDGER, JOB}),
+    'GET analyze_ledger_job_detail': (2, {USER, JOB}),
+    'GET ai_stats': (1, {USER}),
+}
+
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+[`"]?(\w+)[`"]?', re.I)
+SAVEPOINT_RE = re.compile(r'^\s*(?:SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+
+FAKE_BILLS = (
+    '{"bills": [{"inOutType": "2", "detail_type": "1", "amount": "12", "remark": "午饭"}],'
+    ' "response": "记好啦", "emoji": "1"}'
+)
+
+
+async def _fake_chat_response(message, deadline=None, purpose='chat'):
+    # 不调用真实模型：bill_chat 返回一笔账单，其余返回一句话
+    return FAKE_BILLS if purpose == 'bill_chat' else "本月餐饮支出偏高，注意控制。"
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "检查 bill、user、ai 各接口的 SQL 条数与访问的表：在事务中按 --sizes 生成不同数据量并逐个请求各接口"
+        "（先请求一次预热缓存，再统计第二次），超过 BUDGETS 中的上限、数据量变大时条数增加、"
+        "或访问了不允许的表时打印捕获的 SQL 并以非零状态退出。数据在事务结束时回滚，AI 调用使用固定回复"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 400], help="每次生成的账单数")
+        parser.add_argument('--only', nargs='*', help="只检查名称包含这些字符串的场景")
+        parser.add_argument('--verbose-sql', action='store_true', help="通过时也打印每个场景的 SQL")
+
+    def handle(self, *args, **options):
+        warm_categories()
+        counts = {}
+        captured = {}
+        jobs = {**getattr(settings, 'AI_JOBS', {}), 'WORKERS': 0}
+        # 不启动分析任务的工作线程；AI 调用返回固定内容
+        with override_settings(AI_JOBS=jobs), \
+                mock.patch.object(ai_client, 'aget_chat_response', _fake_chat_response):
+            for size in options['sizes']:
+                try:
+                    with transaction.atomic():
+                        for name, queries in self.run(size, options['only']):
+                            counts.setdefault(name, {})[size] = len(queries)
+                            captured.setdefault(name, {})[size] = queries
+                        raise _Rollback()
+                except _Rollback:
+                    pass
+
+        failures = []
+        for name, by_size in counts.items():
+            problems = self.evaluate_scenario(name, by_size, captured[name])
+            line = f"{name}: " + ', '.join(f"{size} 条账单 {count} 条 SQL" for size, count in by_size.items())
+            if problems:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"✗ {line}"))
+                for problem in problems:
+                    self.stdout.write(f"    {problem}")
+                self.write_sql(captured[name])
+            else:
+                self.stdout.write(f"✓ {line}")
+                if options['verbose_sql']:
+                    self.write_sql(captured[name])
+
+        if failures:
+            raise CommandError(f"以下接口超出 SQL 预算：{', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("所有接口的 SQL 条数与访问的表均在预算内"))
+
+    @staticmethod
+    def evaluate_scenario(name, by_size, captured):
+        if name not in BUDGETS:
+            return ["没有为该场景设置预算（在 BUDGETS 中添加）"]
+        limit, tables = BUDGETS[name]
+        problems = []
+        if len(set(by_size.values())) > 1:
+            problems.append("SQL 条数随数据量增加（可能存在 N+1 查询）")
+        if max(by_size.values()) > limit:
+            problems.append(f"SQL 条数超过上限 {limit}")
+        touched = {table for queries in captured.values() for sql in queries for table in TABLE_RE.findall(sql)}
+        if touched - tables:
+            problems.append(f"访问了不允许的表：{', '.join(sorted(touched - tables))}")
+        return problems
+
+    def write_sql(self, captured):
+        for size, queries in captured.items():
+            self.stdout.write(f"    -- {size} 条账单")
+            for sql in queries:
+                self.stdout.write(f"    {sql}")
+
+    def run(self, size, only):
+        """生成数据后逐个请求各场景，产出 (场景名称, 第二次请求执行的 SQL)"""
+        fixtures = self.fixtures(size)
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {fixtures['access']}")
+        for name, request, setup in self.scenarios(fixtures):
+            if only and not any(part in name for part in only):
+                continue
+            request(client, 0)
+            if setup:
+                setup()
+            with CaptureQueriesContext(connection) as context:
+                response = request(client, 1)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            if response.status_code >= 400:
+                raise CommandError(f"{name} 返回 {response.status_code}：{response.content[:500]!r}")
+            yield name, [query['sql'] for query in context.captured_queries if not SAVEPOINT_RE.match(query['sql'])]
+
+    @staticmethod
+    def fixtures(size):
+        user = User.objects.create_user(username=f'query_budget_{time.time_ns()}', password='query-budget')
+        ledger = Ledger.objects.get(user=user, isDefault=True)
+        today = date.today()
+        rng = random.Random(size)
+        expense_types = [code for code, _ in Category.DETAIL_TYPE_EXPENSE]
+
+        bills = bulk_create_bills([
+            Bill(
+                ledger=ledger,
+                category_id=resolve_category_id(Category.EXPENSE, rng.choice(expense_types)),
+                amount=Decimal(rng.randint(100, 10000)) / 100,
+                remark='午饭',
+                date=today - timedelta(days=rng.randint(0, 60)),
+            )
+            for _ in range(size)
+        ])
+        # 预算数量与账单数量同比增长，最近的月份在前
+        budgets = []
+        year, month = today.year, today.month
+        while len(budgets) < max(4, size // 10):
+            for code in expense_types[:max(4, size // 10) - len(budgets)]:
+                budgets.append(Budget(
+                    ledger=ledger, category_id=resolve_category_id(Category.EXPENSE, code),
+                    amount=Decimal('500'), year=year, month=month,
+                ))
+            year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        assign_seqs(budgets)
+        budgets = Budget.objects.bulk_create(budgets)
+
+        # 分析结果缓存按账本数据版本区分，回滚后账本 id 和版本号会重复，这里换一个不会重复的版本号
+        Ledger.objects.filter(pk=ledger.pk).update(data_version=time.time_ns() // 1000)
+
+        # 增量同步从数据生成之前的一个序号开始，返回的变更数不随数据量变化
+        sync_since = max(bills[-1].seq - 30, 1)
+
+        refresh = RefreshToken.for_user(user)
+        return {
+            'user': user,
+            'password': 'query-budget',
+            'ledger': ledger,
+            'bill': bills[0],
+            'budget': budgets[0],
+            'sync_since': sync_since,
+            'access': str(refresh.access_token),
+            'refresh': str(refresh),
+            # ai_stats 只对管理员开放
+            'admin_access': str(RefreshToken.for_user(
+                User.objects.create_user(username=f'{user.username}_admin', password=None, is_staff=True)
+            ).access_token),
+            'logout': [str(RefreshToken.for_user(user)) for _ in range(2)],
+            'bills_to_delete': bulk_create_bills([
+                Bill(ledger=ledger, category=bills[0].category, amount=Decimal('1'), remark='删除', date=today)
+                for _ in range(2)
+            ]),
+            'budgets_to_delete': Budget.objects.bulk_create([
+                Budget(ledger=ledger, category_id=resolve_category_id(Category.EXPENSE, '1'),
+                       amount=Decimal('1'), year=3000 + i, month=1)
+                for i in range(2)
+            ]),
+            'ledgers_to_delete': [Ledger.objects.create(name=f'删除{i}', user=user) for i in range(2)],
+            'job': AnalysisJob.objects.create(
+                ledger=ledger, year=today.year, month=today.month, data_version=10 ** 9,
+            ),
+        }
+
+    @staticmethod
+    def scenarios(fixtures):
+        """(名称, request(client, n), setup) 的列表；n 为 0 时是预热请求，为 1 时是统计的请求"""
+        ledger_id = fixtures['ledger'].id
+        today = date.today()
+        month = {'ledger_id': ledger_id, 'year': today.year, 'month': today.month}
+        bill_body = {
+            'ledger': ledger_id, 'amount': '23.50', 'remark': '午饭', 'date': today.isoformat(),
+            'category': {'inOutType': '2', 'detail_type': '1'},
+        }
+        json_type = 'application/json'
+
+        def get(path, params=None):
+            return lambda client, n: client.get(path, params or {})
+
+        def revalidate(path, params):
+            # 预热请求记下 ETag，统计的请求带上 If-None-Match，应当直接返回 304
+            etags = {}
+
+            def request(client, n):
+                if n == 0:
+                    response = client.get(path, params)
+                    etags['etag'] = response['ETag']
+                    return response
+                response = client.get(path, params, HTTP_IF_NONE_MATCH=etags['etag'])
+                if response.status_code != 304:
+                    raise CommandError(f"{path} 带上 If-None-Match 后返回了 {response.status_code}，预期 304")
+                return response
+            return request
+
+        def send(method, path, body):
+            def request(client, n):
+                data = body(n) if callable(body) else body
+                return getattr(client, method)(path, data, content_type=json_type)
+            return request
+
+        def import_file(client, n):
+            rows = ['date,amount,inOutType,detail_type,remark'] + [
+                f"{today.isoformat()},{10 + i},2,{i % 32 + 1},导入{i}" for i in range(20)
+            ]
+            upload = SimpleUploadedFile('bills.csv', '\n'.join(rows).encode(), content_type='text/csv')
+            return client.post('/api/bills/import/', {'ledger_id': ledger_id, 'file': upload})
+
+        def budget_body(n):
+            return {
+                'ledger': ledger_id, 'amount': '500', 'year': 2500 + n, 'month': 1,
+                'category': {'inOutType': '2', 'detail_type': '1'},
+            }
+
+        def login(client, n):
+            # 登录接口不需要认证，使用不带令牌的客户端
+            return Client().post('/api/login/', {
+                'username': fixtures['user'].username, 'password': fixtures['password'],
+            }, content_type=json_type)
+
+        def register(client, n):
+            return Client().post('/api/register/', {
+                'username': f"{fixtures['user'].username}_r{n}", 'password': 'query-budget',
+            }, content_type=json_type)
+
+        def invalidate_analysis():
+            # 让账本数据版本变化，统计不命中分析缓存时的查询
+            bump_data_version([ledger_id])
+
+        bill_id, budget_id = fixtures['bill'].id, fixtures['budget'].id
+        return [
+            ('GET ledger_list', get('/api/ledgers/'), None),
+            ('POST ledger_list', send('post', '/api/ledgers/', {'name': '新账本'}), None),
+            ('GET ledger_detail', get(f'/api/ledgers/{ledger_id}/'), None),
+            ('PUT ledger_detail', send('put', f'/api/ledgers/{ledger_id}/', lambda n: {'image': str(n)}), None),
+            ('DELETE ledger_detail', lambda client, n: client.delete(f"/api/ledgers/{fixtures['ledgers_to_delete'][n].id}/"), None),
+            ('GET bill_list', get('/api/bills/', {'ledger_id': ledger_id}), None),
+            ('GET bill_list?page_size', get('/api/bills/', {'ledger_id': ledger_id, 'page_size': 50}), None),
+            ('GET bill_list?year&month', get('/api/bills/', month), None),
+            ('GET bill_list?inOutType&detail_type', get('/api/bills/', {'ledger_id': ledger_id, 'inOutType': '2', 'detail_type': '1'}), None),
+            ('POST bill_list', send('post', '/api/bills/', bill_body), None),
+            ('GET bill_detail', get(f'/api/bills/{bill_id}/'), None),
+            ('PUT bill_detail', send('put', f'/api/bills/{bill_id}/', lambda n: {'amount': f'{30 + n}.00'}), None),
+            ('DELETE bill_detail', lambda client, n: client.delete(f"/api/bills/{fixtures['bills_to_delete'][n].id}/"), None),
+            ('POST bill_import', import_file, None),
+            ('GET bill_export', get('/api/bills/export/', {'ledger_id': ledger_id}), None),
+            ('GET budget_list', get('/api/budgets/', {'ledger': ledger_id}), None),
+            ('POST budget_list', send('post', '/api/budgets/', budget_body), None),
+            ('GET budget_detail', get(f'/api/budgets/{budget_id}/'), None),
+            ('PUT budget_detail', send('put', f'/api/budgets/{budget_id}/', lambda n: {'amount': f'{600 + n}'}),
+             None),
+            ('DELETE budget_detail', lambda client, n: client.delete(f"/api/budgets/{fixtures['budgets_to_delete'][n].id}/"), None),
+            ('GET monthly_report', get('/api/monthly-report/', month), None),
+            ('GET daily_report', get('/api/daily-report/', month), None),
+            ('GET total_expense_by_category', get('/api/total-expense-by-category/', {**month, 'inOutType': '2', 'detail_type': '1'}), None),
+            ('GET total_budget', get('/api/total-budget/', month), None),
+            ('GET bill_list 304', revalidate('/api/bills/', {'ledger_id': ledger_id}), None),
+            ('GET budget_list 304', revalidate('/api/budgets/', {'ledger': ledger_id}), None),
+            ('GET monthly_report 304', revalidate('/api/monthly-report/', month), None),
+            ('GET daily_report 304', revalidate('/api/daily-report/', month), None),
+            ('GET total_budget 304', revalidate('/api/total-budget/', month), None),
+            ('GET balance_history', get('/api/balance-history/', {
+                'ledger_id': ledger_id, 'start': (today - timedelta(days=90)).isoformat(), 'end': today.isoformat(),
+            }), None),
+            ('GET sync', get('/api/sync/', {'since': fixtures['sync_since'], 'limit': 50}), None),
+            ('POST register', register, None),
+            ('POST login', login, None),
+            ('POST token_refresh', send('post', '/api/token/refresh/', {'refresh': fixtures['refresh']}), None),
+            ('GET token_check', get('/api/token/check/'), None),
+            ('GET user_info', get('/api/user/'), None),
+            ('PUT user_info', send('put', '/api/user/', lambda n: {'gender': 'MF'[n]}), None),
+            ('POST logout', send('post', '/api/logout/', lambda n: {'refresh_token': fixtures['logout'][n]}),
+             None),
+            ('POST normal_chat', send('post', '/api/normal-chat/', {'message': '你好'}), None),
+            ('POST bill_chat', send('post', '/api/bill-chat/', {'message': '神秘开销 12', 'ledger_id': ledger_id}),
+             None),
+            ('GET analyze_ledger', get('/api/analyze_ledger/', {'ledger_id': ledger_id}), invalidate_analysis),
+            ('POST analyze_ledger_job', send('post', '/api/analyze_ledger/jobs/', {'ledger_id': ledger_id}),
+             None),
+            ('GET analyze_ledger_job_detail', get(f"/api/analyze_ledger/jobs/{fixtures['job'].id}/"), None),
+            ('GET ai_stats', lambda client, n: Client(
+                HTTP_AUTHORIZATION=f"Bearer {fixtures['admin_access']}").get('/api/ai-stats/'), None),
+        ]
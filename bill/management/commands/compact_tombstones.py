@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from bill.models import SyncCounter, Tombstone
+
+
+class Command(BaseCommand):
+    help = (
+        "清理早于保留期限的删除记录，并记下每个用户已清理到的序号；"
+        "游标早于该序号的客户端在下一次同步时会收到 reset 并全量同步。可以每天定时执行"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90),
+            help="保留最近几天的删除记录",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="只统计，不删除")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        horizons = (
+            Tombstone.objects.filter(delete_time__lt=cutoff)
+            .values('user_id').annotate(max_seq=Max('seq')).values_list('user_id', 'max_seq')
+        )
+        users = deleted = 0
+        for user_id, max_seq in horizons.iterator():
+            users += 1
+            if options['dry_run']:
+                deleted += Tombstone.objects.filter(user_id=user_id, seq__lte=max_seq).count()
+                continue
+            # 先推进 compacted 再删除，同步接口不会在两步之间把缺了删除记录的变更当作完整结果返回
+            with transaction.atomic():
+                SyncCounter.objects.filter(pk=user_id, compacted__lt=max_seq).update(compacted=max_seq)
+                deleted += Tombstone.objects.filter(user_id=user_id, seq__lte=max_seq).delete()[0]
+
+        action = "可清理" if options['dry_run'] else "已清理"
+        self.stdout.write(self.style.SUCCESS(f"{action} {users} 个用户的 {deleted} 条删除记录（早于 {cutoff:%Y-%m-%d}）"))
@@ -0,0 +1,146 @@
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ai.local_classifier import KEYWORDS
+from bill.bulk import bulk_create_bills
+from bill.categories import resolve_category_id, warm_categories
+from bill.models import Bill, Budget, Category, Ledger
+from bill.sync import assign_seqs
+from user.models import User
+
+# 各类别的金额范围（元），没有列出的类别使用 DEFAULT_AMOUNT
+AMOUNTS = {
+    (Category.INCOME, '1'): (5000, 20000),
+    (Category.INCOME, '2'): (1000, 3000),
+    (Category.INCOME, '3'): (1000, 30000),
+    (Category.INCOME, '4'): (10, 2000),
+    (Category.EXPENSE, '1'): (10, 120),
+    (Category.EXPENSE, '2'): (2, 80),
+    (Category.EXPENSE, '6'): (8, 40),
+    (Category.EXPENSE, '18'): (200, 1500),
+    (Category.EXPENSE, '19'): (1000, 6000),
+    (Category.EXPENSE, '20'): (50, 5000),
+    (Category.EXPENSE, '24'): (100, 3000),
+    (Category.EXPENSE, '25'): (100, 8000),
+}
+DEFAULT_AMOUNT = (5, 500)
+
+# 日常支出更频繁：餐饮、交通、饮品、零食、日用品的权重更高
+EXPENSE_WEIGHTS = {'1': 12, '2': 8, '3': 4, '4': 3, '5': 4, '6': 5, '7': 2, '8': 2}
+
+
+class Command(BaseCommand):
+    help = (
+        "生成基准测试用的模拟数据：N 个用户（注册时由 bill.signals 创建默认账本）、每人若干账本、"
+        "跨越若干年的账单（覆盖全部收支类别，通过 bulk_create_bills 写入并维护汇总数据）以及每月预算。"
+        "用户名为 <prefix><序号>，所有用户使用同一个密码；相同的 --seed 生成相同的数据"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--ledgers', type=int, default=2, help="每个用户的账本数（含默认账本）")
+        parser.add_argument('--years', type=int, default=2, help="账单覆盖截至今天的最近几年")
+        parser.add_argument('--bills-per-day', type=float, default=3, help="每个账本平均每天的支出笔数")
+        parser.add_argument('--budgets', type=int, default=5, help="每个账本每月设置预算的支出类别数")
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--reset', action='store_true', help="先删除用户名以 prefix 开头的用户及其数据")
+
+    def handle(self, *args, **options):
+        began = time.perf_counter()
+        prefix = options['prefix']
+        existing = User.objects.filter(username__startswith=prefix)
+        if options['reset']:
+            existing.delete()
+        elif existing.exists():
+            raise CommandError(f"已存在用户名以 {prefix} 开头的用户，使用 --reset 重新生成或换一个 --prefix")
+
+        warm_categories()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.end = date.today()
+        self.start = self.end - timedelta(days=365 * options['years'])
+        counts = {'users': 0, 'ledgers': 0, 'bills': 0, 'budgets': 0}
+
+        # 只计算一次密码哈希，所有用户共用
+        password = make_password(options['password'])
+        for index in range(options['users']):
+            user = User.objects.create(username=f'{prefix}{index}', password=password)
+            ledgers = list(Ledger.objects.filter(user=user))
+            for number in range(len(ledgers), options['ledgers']):
+                ledgers.append(Ledger.objects.create(name=f'账本{number + 1}', user=user))
+            counts['users'] += 1
+            counts['ledgers'] += len(ledgers)
+            for ledger in ledgers:
+                counts['bills'] += self.generate_bills(ledger, options['bills_per_day'])
+                counts['budgets'] += self.generate_budgets(ledger, options['budgets'])
+
+        self.stdout.write(json.dumps({
+            **counts,
+            'prefix': prefix,
+            'start': self.start.isoformat(),
+            'end': self.end.isoformat(),
+            'seconds': round(time.perf_counter() - began, 2),
+        }, ensure_ascii=False, indent=2))
+
+    def bill(self, ledger, day, in_out_type, detail_type):
+        low, high = AMOUNTS.get((in_out_type, detail_type), DEFAULT_AMOUNT)
+        keywords = KEYWORDS.get((in_out_type, detail_type))
+        remark = self.rng.choice(keywords) if keywords else Category.detail_type_name(in_out_type, detail_type)
+        return Bill(
+            ledger=ledger,
+            category_id=resolve_category_id(in_out_type, detail_type),
+            amount=Decimal(self.rng.randint(low * 100, high * 100)) / 100,
+            remark=remark if self.rng.random() < 0.9 else None,
+            date=day,
+        )
+
+    def generate_bills(self, ledger, bills_per_day):
+        expense_types = [code for code, _ in Category.DETAIL_TYPE_EXPENSE]
+        weights = [EXPENSE_WEIGHTS.get(code, 1) for code in expense_types]
+        income_types = [code for code, _ in Category.DETAIL_TYPE_INCOME]
+        batch, total = [], 0
+        day = self.start
+        while day <= self.end:
+            # 每月 10 号发工资，其余收入类别偶尔出现
+            if day.day == 10:
+                batch.append(self.bill(ledger, day, Category.INCOME, '1'))
+            if self.rng.random() < 0.05:
+                batch.append(self.bill(ledger, day, Category.INCOME, self.rng.choice(income_types[1:])))
+            for _ in range(self.rng.randint(0, round(bills_per_day * 2))):
+                batch.append(self.bill(ledger, day, Category.EXPENSE, self.rng.choices(expense_types, weights)[0]))
+            if len(batch) >= self.batch_size:
+                total += len(bulk_create_bills(batch, batch_size=self.batch_size))
+                batch = []
+            day += timedelta(days=1)
+        if batch:
+            total += len(bulk_create_bills(batch, batch_size=self.batch_size))
+        return total
+
+    def generate_budgets(self, ledger, per_month):
+        expense_types = [code for code, _ in Category.DETAIL_TYPE_EXPENSE]
+        budgets = []
+        year, month = self.start.year, self.start.month
+        while (year, month) <= (self.end.year, self.end.month):
+            for detail_type in self.rng.sample(expense_types, min(per_month, len(expense_types))):
+                low, high = AMOUNTS.get((Category.EXPENSE, detail_type), DEFAULT_AMOUNT)
+                budgets.append(Budget(
+                    ledger=ledger,
+                    category_id=resolve_category_id(Category.EXPENSE, detail_type),
+                    amount=Decimal(self.rng.randint(low, high) * 20),
+                    year=year,
+                    month=month,
+                ))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        with transaction.atomic():
+            assign_seqs(budgets)
+            return len(Budget.objects.bulk_create(budgets, batch_size=self.batch_size))
@@ -0,0 +1,164 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum, Count
+from django.db.models.functions import ExtractYear, ExtractMonth
+
+from bill.models import Bill, Category, DailyBalance, Ledger, MonthlyBalance, MonthlyCategoryTotal
+
+
+class Command(BaseCommand):
+    help = "根据原始账单重建（或校验）月度分类汇总表、每日余额表和月末累计余额表，按账本分批处理，内存占用与账本总数无关"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help="只校验并输出差异，不写入")
+        parser.add_argument('--ledger', type=int, nargs='*', help="只处理指定账本")
+        parser.add_argument('--chunk-size', type=int, default=200, help="每批处理的账本数")
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+        mismatched = 0
+        processed = 0
+        for ledger_ids in self.ledger_chunks(options['ledger'], options['chunk_size']):
+            expected = self.aggregate(ledger_ids)
+            expected_daily = self.aggregate_daily(ledger_ids)
+            expected_monthly = self.checkpoints(expected_daily)
+            if verify:
+                mismatched += self.verify(ledger_ids, expected)
+                mismatched += self.verify_daily(ledger_ids, expected_daily)
+                mismatched += self.verify_checkpoints(ledger_ids, expected_monthly)
+            else:
+                self.rebuild(ledger_ids, expected, expected_daily, expected_monthly)
+            processed += len(ledger_ids)
+
+        if verify:
+            self.stdout.write(f"已校验 {processed} 个账本，{mismatched} 处不一致")
+            if mismatched:
+                raise SystemExit(1)
+        else:
+            self.stdout.write(self.style.SUCCESS(f"已重建 {processed} 个账本的月度汇总、每日余额和月末累计余额"))
+
+    @staticmethod
+    def ledger_chunks(only, chunk_size):
+        queryset = Ledger.objects.order_by('id')
+        if only:
+            queryset = queryset.filter(id__in=only)
+        last_id = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    @staticmethod
+    def aggregate(ledger_ids):
+        rows = Bill.objects.filter(ledger_id__in=ledger_ids).annotate(
+            year=ExtractYear('date'), month=ExtractMonth('date')
+        ).values(
+            'ledger_id', 'year', 'month', 'category__inOutType', 'category__detail_type'
+        ).annotate(total=Sum('amount'), count=Count('id')).order_by()
+        return {
+            (row['ledger_id'], row['year'], row['month'], row['category__inOutType'], row['category__detail_type']):
+                (row['total'], row['count'])
+            for row in rows
+        }
+
+    @staticmethod
+    def aggregate_daily(ledger_ids):
+        rows = Bill.objects.filter(ledger_id__in=ledger_ids).values(
+            'ledger_id', 'date', 'category__inOutType'
+        ).annotate(total=Sum('amount')).order_by('ledger_id', 'date')
+
+        # (账本, 日期) -> [当日收入, 当日支出]
+        daily = {}
+        for row in rows:
+            day = daily.setdefault((row['ledger_id'], row['date']), [Decimal('0')] * 2)
+            if row['category__inOutType'] == Category.INCOME:
+                day[0] += row['total']
+            elif row['category__inOutType'] == Category.EXPENSE:
+                day[1] += row['total']
+        return {key: tuple(values) for key, values in daily.items()}
+
+    @staticmethod
+    def checkpoints(expected_daily):
+        """由每日收支算出每个有账单的月份月末的累计值：(账本, 当月 1 日) -> (累计收入, 累计支出)"""
+        monthly = {}
+        last_ledger, cum_income, cum_expense = None, Decimal('0'), Decimal('0')
+        for (ledger_id, day), (income, expense) in sorted(expected_daily.items()):
+            if ledger_id != last_ledger:
+                last_ledger, cum_income, cum_expense = ledger_id, Decimal('0'), Decimal('0')
+            cum_income += income
+            cum_expense += expense
+            monthly[(ledger_id, day.replace(day=1))] = (cum_income, cum_expense)
+        return monthly
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild(ledger_ids, expected, expected_daily, expected_monthly):
+        # 锁住这批账本，避免重建期间并发写入的增量被覆盖
+        list(Ledger.objects.select_for_update().filter(id__in=ledger_ids).values_list('id'))
+        MonthlyCategoryTotal.objects.filter(ledger_id__in=ledger_ids).delete()
+        MonthlyCategoryTotal.objects.bulk_create([
+            MonthlyCategoryTotal(
+                ledger_id=ledger_id, year=year, month=month, inOutType=in_out_type, detail_type=detail_type,
+                total=total, count=count,
+            )
+            for (ledger_id, year, month, in_out_type, detail_type), (total, count) in expected.items()
+        ], batch_size=1000)
+        DailyBalance.objects.filter(ledger_id__in=ledger_ids).delete()
+        DailyBalance.objects.bulk_create([
+            DailyBalance(ledger_id=ledger_id, date=day, income=income, expense=expense)
+            for (ledger_id, day), (income, expense) in expected_daily.items()
+        ], batch_size=1000)
+        MonthlyBalance.objects.filter(ledger_id__in=ledger_ids).delete()
+        MonthlyBalance.objects.bulk_create([
+            MonthlyBalance(ledger_id=ledger_id, month=month, cum_income=cum_income, cum_expense=cum_expense)
+            for (ledger_id, month), (cum_income, cum_expense) in expected_monthly.items()
+        ], batch_size=1000)
+
+    def verify(self, ledger_ids, expected):
+        actual = {
+            (row.ledger_id, row.year, row.month, row.inOutType, row.detail_type): (row.total, row.count)
+            for row in MonthlyCategoryTotal.objects.filter(ledger_id__in=ledger_ids, count__gt=0)
+        }
+        mismatched = 0
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                mismatched += 1
+                self.stdout.write(f"不一致 {key}: 账单 {expected.get(key)} / 汇总 {actual.get(key)}")
+        return mismatched
+
+    def verify_daily(self, ledger_ids, expected):
+        # 没有账单的日期行（收支都已删光）收支为 0，不算不一致
+        actual = {}
+        for row in DailyBalance.objects.filter(ledger_id__in=ledger_ids).order_by('ledger_id', 'date'):
+            actual[(row.ledger_id, row.date)] = (row.income, row.expense)
+        mismatched = 0
+        for key in sorted(expected.keys() | actual.keys()):
+            values = actual.get(key)
+            if key not in expected and values and not values[0] and not values[1]:
+                continue
+            if expected.get(key) != values:
+                mismatched += 1
+                self.stdout.write(f"不一致 {key}: 账单 {expected.get(key)} / 余额 {values}")
+        return mismatched
+
+    def verify_checkpoints(self, ledger_ids, expected):
+        # 账单都删光的月份仍保留检查点，其累计值应等于之前最近一个有账单的月份
+        actual = {
+            (row.ledger_id, row.month): (row.cum_income, row.cum_expense)
+            for row in MonthlyBalance.objects.filter(ledger_id__in=ledger_ids)
+        }
+        mismatched = 0
+        carried = {}
+        for key in sorted(expected.keys() | actual.keys()):
+            ledger_id = key[0]
+            if key in expected:
+                carried[ledger_id] = expected[key]
+            wanted = carried.get(ledger_id, (Decimal('0'), Decimal('0')))
+            if actual.get(key) != wanted:
+                mismatched += 1
+                self.stdout.write(f"不一致 {key}: 账单 {wanted} / 累计余额 {actual.get(key)}")
+        return mismatched
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import re
+import statistics
+import subprocess
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import resolve
+
+from ai.management.commands._fake_llm import serve_fake_llm
+
+METRIC_RE = re.compile(r'^http_request_db_queries_(sum|count)\{view="([^"]*)"\} (\S+)$', re.M)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return round(values[index] * 1000, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _change(old, new):
+    if old is None or new is None or old == 0:
+        return None
+    return round((new - old) / old, 4)
+
+
+class Command(BaseCommand):
+    help = (
+        "对 bill、user、ai 的所有接口做基准测试：每个场景以 --concurrency 并发发送 --requests 个请求，"
+        "输出 p50/p95/p99 延迟、吞吐和每个请求的 SQL 条数（JSON，可用 --output 保存、--compare 与上次结果比较）。"
+        "服务需以 ASGI 方式运行，并先用 generate_synthetic_data 生成数据；SQL 条数来自服务的 /metrics，"
+        "服务只有一个进程时才准确。AI 接口使用 --fake-llm-port 启动的模拟服务（配置中的 base_url 需指向它）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--username', default='bench0')
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--requests', type=int, default=100, help="每个场景的请求数")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=5, help="每个场景正式计时前的预热请求数")
+        parser.add_argument('--only', nargs='*', help="只运行名称包含这些字符串的场景，例如 bill-list daily_report")
+        parser.add_argument('--metrics-token', help="服务配置了 METRICS_TOKEN 时需要提供")
+        parser.add_argument('--fake-llm-port', type=int, help="在本机该端口启动模拟的 OpenAI 服务")
+        parser.add_argument('--fake-llm-delay', type=float, default=0.05, help="模拟服务每次回复的耗时（秒）")
+        parser.add_argument('--output', help="把结果写入该 JSON 文件")
+        parser.add_argument('--compare', help="与之前保存的结果比较")
+        parser.add_argument('--max-regression', type=float,
+                            help="与 --compare 的结果相比，任一场景 p95 变慢超过该比例（如 0.2）时命令失败")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        result = asyncio.run(self.run(options))
+        if baseline is not None:
+            result['comparison'] = self.compare(baseline, result)
+
+        output = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+        if baseline is not None and options['max_regression'] is not None:
+            regressions = [
+                name for name, change in result['comparison'].items()
+                if change['p95_ms'] is not None and change['p95_ms'] > options['max_regression']
+            ]
+            if regressions:
+                raise CommandError(f"p95 延迟变慢超过 {options['max_regression']:.0%}：{', '.join(regressions)}")
+
+    async def run(self, options):
+        fake_server = None
+        if options['fake_llm_port']:
+            fake_server = await serve_fake_llm('127.0.0.1', options['fake_llm_port'], options['fake_llm_delay'])
+
+        limits = httpx.Limits(max_connections=options['concurrency'] + 5)
+        try:
+            async with httpx.AsyncClient(base_url=options['base_url'], timeout=120, limits=limits) as client:
+                tokens = await self.login(client, options['username'], options['password'])
+                client.headers['Authorization'] = f"Bearer {tokens['access']}"
+                context = await self.context(client, options, tokens)
+
+                endpoints = {}
+                for name, method, build, prepare in self.scenarios(context):
+                    if options['only'] and not any(part in name for part in options['only']):
+                        continue
+                    self.stderr.write(f"{name} ...")
+                    endpoints[name] = await self.run_scenario(client, options, method, build, prepare)
+        finally:
+            if fake_server:
+                fake_server.close()
+                await fake_server.wait_closed()
+
+        return {
+            'meta': {
+                'commit': _git_commit(),
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'base_url': options['base_url'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'bills': context['bills'],
+            },
+            'endpoints': endpoints,
+        }
+
+    @staticmethod
+    async def login(client, username, password):
+        response = await client.post('/api/login/', json={'username': username, 'password': password})
+        if response.status_code != 200:
+            raise CommandError(f"登录失败（先运行 generate_synthetic_data）：{response.text}")
+        return response.json()['data']
+
+    async def context(self, client, options, tokens):
+        """准备各场景用到的账本、账单、预算和分析任务，数据量最大的账本作为测试对象"""
+        ledgers = (await client.get('/api/ledgers/')).json()['data']
+        counts = {ledger['id']: await self.count_bills(client, ledger['id']) for ledger in ledgers}
+        if not counts or not max(counts.values()):
+            raise CommandError("该用户没有账单，先运行 generate_synthetic_data")
+        ledger_id = max(counts, key=counts.get)
+
+        bills = (await client.get('/api/bills/', params={'ledger_id': ledger_id, 'page_size': 1})).json()['data']
+        budgets = (await client.get('/api/budgets/', params={'ledger': ledger_id})).json()['data']
+        job = (await client.post('/api/analyze_ledger/jobs/', json={'ledger_id': ledger_id})).json()['data']
+
+        return {
+            'username': options['username'],
+            'password': options['password'],
+            'refresh': tokens['refresh'],
+            'ledger_id': ledger_id,
+            'bill_id': bills['results'][0]['id'],
+            'budget_id': budgets[0]['id'] if budgets else None,
+            'job_id': job['job_id'],
+            'bills': counts[ledger_id],
+            'run': time.time_ns(),
+        }
+
+    @staticmethod
+    async def count_bills(client, ledger_id):
+        total, cursor = 0, None
+        while True:
+            params = {'ledger_id': ledger_id, 'page_size': 500, 'fields': 'id'}
+            if cursor:
+                params['cursor'] = cursor
+            data = (await client.get('/api/bills/', params=params)).json()['data']
+            total += len(data['results'])
+            cursor = data['next']
+            if not cursor:
+                return total
+
+    def scenarios(self, context):
+        """
+        (名称, 方法, build(i, prepared) -> (路径, 请求参数), prepare) 的列表。
+        prepare(client, n) 在计时前准备每个请求各自需要的数据（如待删除的账单），不计入结果。
+        只读场景在前，写入场景在后，删除场景最后。
+        """
+        ledger_id = context['ledger_id']
+        today = date.today()
+        month = {'ledger_id': ledger_id, 'year': today.year, 'month': today.month}
+        bill_body = {
+            'ledger': ledger_id, 'amount': '23.50', 'remark': '午饭', 'date': today.isoformat(),
+            'category': {'inOutType': '2', 'detail_type': '1'},
+        }
+
+        def get(path, params=None):
+            return lambda i, prepared: (path, {'params': params} if params else {})
+
+        def post(path, body):
+            return lambda i, prepared: (path, {'json': body(i) if callable(body) else body})
+
+        async def create_bills(client, n):
+            return [
+                (await client.post('/api/bills/', json=bill_body)).json()['data']['id'] for _ in range(n)
+            ]
+
+        async def create_ledgers(client, n):
+            return [
+                (await client.post('/api/ledgers/', json={'name': f'待删除{i}'})).json()['data']['id']
+                for i in range(n)
+            ]
+
+        async def create_budgets(client, n):
+            return [
+                (await client.post('/api/budgets/', json=budget_body(context['run'] % 100000 + i))).json()['data']['id']
+                for i in range(n)
+            ]
+
+        async def refresh_tokens(client, n):
+            return [
+                (await self.login(client, context['username'], context['password']))['refresh'] for _ in range(n)
+            ]
+
+        def budget_body(i):
+            # (账本, 类别, 年, 月) 唯一，每个请求使用不同的远期年份
+            return {
+                'ledger': ledger_id, 'amount': '500', 'year': 3000 + i, 'month': 1,
+                'category': {'inOutType': '2', 'detail_type': '1'},
+            }
+
+        def import_file(i, prepared):
+            rows = ['date,amount,inOutType,detail_type,remark'] + [
+                f"{(today - timedelta(days=day)).isoformat()},{10 + day % 50},2,{day % 32 + 1},导入{day}"
+                for day in range(100)
+            ]
+            return '/api/bills/import/', {
+                'data': {'ledger_id': ledger_id},
+                'files': {'file': ('bills.csv', '\n'.join(rows).encode(), 'text/csv')},
+            }
+
+        scenarios = [
+            # user
+            ('POST login', 'POST', post('/api/login/', {
+                'username': context['username'], 'password': context['password'],
+            }), None),
+            ('POST token_refresh', 'POST', post('/api/token/refresh/', {'refresh': context['refresh']}), None),
+            ('GET token_check', 'GET', get('/api/token/check/'), None),
+            ('GET get_user_info', 'GET', get('/api/user/'), None),
+            # bill：只读
+            ('GET ledger-list', 'GET', get('/api/ledgers/'), None),
+            ('GET ledger-detail', 'GET', get(f'/api/ledgers/{ledger_id}/'), None),
+            ('GET bill-list (page)', 'GET', get('/api/bills/', {'ledger_id': ledger_id, 'page_size': 50}), None),
+            ('GET bill-list (month)', 'GET', get('/api/bills/', month), None),
+            ('GET bill-list (all)', 'GET', get('/api/bills/', {'ledger_id': ledger_id}), None),
+            ('GET bill-detail', 'GET', get(f"/api/bills/{context['bill_id']}/"), None),
+            ('GET bill-export', 'GET', get('/api/bills/export/', month), None),
+            ('GET budget-list', 'GET', get('/api/budgets/', {'ledger': ledger_id}), None),
+            ('GET budget-detail', 'GET', get(f"/api/budgets/{context['budget_id']}/"), None),
+            ('GET monthly_report', 'GET', get('/api/monthly-report/', month), None),
+            ('GET daily_report', 'GET', get('/api/daily-report/', month), None),
+            ('GET category-list', 'GET', get('/api/total-expense-by-category/', {**month, 'inOutType': '2', 'detail_type': '1'}), None),
+            ('GET month-list', 'GET', get('/api/total-budget/', month), None),
+            ('GET balance-history', 'GET', get('/api/balance-history/', {
+                'ledger_id': ledger_id, 'start': (today - timedelta(days=90)).isoformat(), 'end': today.isoformat(),
+            }), None),
+            # ai：只读
+            ('GET analyze_ledger_job_detail', 'GET', get(f"/api/analyze_ledger/jobs/{context['job_id']}/"), None),
+            ('GET analyze_ledger', 'GET', get('/api/analyze_ledger/', {'ledger_id': ledger_id}), None),
+            ('POST normal_chat', 'POST', post('/api/normal-chat/', {'message': '今天花了多少钱'}), None),
+            ('POST normal_chat (stream)', 'POST', post('/api/normal-chat/', {'message': '今天花了多少钱', 'stream': True}),
+             None),
+            # 写入
+            ('POST analyze_ledger_job', 'POST', post('/api/analyze_ledger/jobs/', {'ledger_id': ledger_id}), None),
+            ('POST bill_chat', 'POST', post('/api/bill-chat/', lambda i: {
+                'message': f'午饭{20 + i % 30} 打车{10 + i % 20}', 'ledger_id': ledger_id,
+            }), None),
+            ('POST bill-list', 'POST', post('/api/bills/', bill_body), None),
+            ('PUT bill-detail', 'PUT', lambda i, prepared: (f"/api/bills/{context['bill_id']}/", {
+                'json': {'amount': f'{10 + i % 90}.00'},
+            }), None),
+            ('POST bill-import', 'POST', import_file, None),
+            ('POST budget-list', 'POST', post('/api/budgets/', lambda i: budget_body(context['run'] % 100000 + 50000 + i)),
+             None),
+            ('PUT budget-detail', 'PUT', lambda i, prepared: (f"/api/budgets/{context['budget_id']}/", {
+                'json': {'amount': f'{500 + i % 100}'},
+            }), None),
+            ('POST ledger-list', 'POST', post('/api/ledgers/', {'name': '基准测试'}), None),
+            ('PUT ledger-detail', 'PUT', lambda i, prepared: (f'/api/ledgers/{ledger_id}/', {
+                'json': {'image': str(i % 10)},
+            }), None),
+            ('PUT get_user_info', 'PUT', lambda i, prepared: ('/api/user/', {'json': {'gender': 'MF'[i % 2]}}), None),
+            ('POST register', 'POST', post('/api/register/', lambda i: {
+                'username': f"{context['username']}_r{context['run']}_{i}", 'password': 'bench-password',
+            }), None),
+            # 删除
+            ('DELETE bill-detail', 'DELETE', lambda i, prepared: (f'/api/bills/{prepared[i]}/', {}), create_bills),
+            ('DELETE budget-detail', 'DELETE', lambda i, prepared: (f'/api/budgets/{prepared[i]}/', {}),
+             create_budgets),
+            ('DELETE ledger-detail', 'DELETE', lambda i, prepared: (f'/api/ledgers/{prepared[i]}/', {}),
+             create_ledgers),
+            ('POST logout', 'POST', lambda i, prepared: ('/api/logout/', {'json': {'refresh_token': prepared[i]}}),
+             refresh_tokens),
+        ]
+        if context['budget_id'] is None:
+            # 没有预算数据（generate_synthetic_data --budgets 0）时跳过单个预算的读写
+            scenarios = [scenario for scenario in scenarios if scenario[0] not in ('GET budget-detail', 'PUT budget-detail')]
+        return scenarios
+
+    async def run_scenario(self, client, options, method, build, prepare):
+        warmup, total = options['warmup'], options['requests']
+        prepared = await prepare(client, warmup + total) if prepare else None
+        view = resolve(urlsplit(build(0, prepared)[0]).path).url_name
+
+        async def one(i):
+            path, kwargs = build(i, prepared)
+            began = time.perf_counter()
+            try:
+                # 流式响应需要读完整个响应体
+                async with client.stream(method, path, **kwargs) as response:
+                    await response.aread()
+                code = str(response.status_code)
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            return code, time.perf_counter() - began
+
+        for i in range(warmup):
+            await one(i)
+
+        queries_before = await self.query_counts(client, options, view)
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def limited(i):
+            async with semaphore:
+                return await one(i)
+
+        began = time.perf_counter()
+        results = await asyncio.gather(*(limited(warmup + i) for i in range(total)))
+        elapsed = time.perf_counter() - began
+        queries_after = await self.query_counts(client, options, view)
+
+        latencies = [seconds for _, seconds in results]
+        statuses = {}
+        for code, _ in results:
+            statuses[code] = statuses.get(code, 0) + 1
+        queries = None
+        if queries_before and queries_after and queries_after[1] > queries_before[1]:
+            queries = round((queries_after[0] - queries_before[0]) / (queries_after[1] - queries_before[1]), 2)
+
+        return {
+            'method': method,
+            'view': view,
+            'requests': total,
+            'statuses': statuses,
+            'throughput_rps': round(total / elapsed, 2),
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'p99_ms': _percentile(latencies, 99),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+            'queries_per_request': queries,
+        }
+
+    @staticmethod
+    async def query_counts(client, options, view):
+        """从服务的 /metrics 读取该 URL 名称累计的 (SQL 条数, 请求数)；无法读取时返回 None"""
+        headers = {'Authorization': f"Bearer {options['metrics_token']}"} if options['metrics_token'] else {}
+        try:
+            response = await client.get('/metrics', headers=headers)
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            return None
+        values = {kind: float(value) for kind, name, value in METRIC_RE.findall(response.text) if name == view}
+        return values.get('sum', 0.0), values.get('count', 0.0)
+
+    @staticmethod
+    def compare(baseline, result):
+        """每个场景相对上次结果的变化比例：延迟为正表示变慢，吞吐为正表示变快"""
+        comparison = {}
+        for name, current in result['endpoints'].items():
+            previous = baseline.get('endpoints', {}).get(name)
+            if previous is None:
+                continue
+            comparison[name] = {
+                key: _change(previous.get(key), current.get(key))
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request')
+            }
+        return comparison
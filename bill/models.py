@@ -1,19 +1,121 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 from user.models import User
+from .deleting import deleting
 
-class Ledger(models.Model):
+
+class SyncCounter(models.Model):
+    """
+    每个用户的变更序号。账本、账单、预算每次写入或删除都取下一个序号，同步接口按序号返回变更。
+    取号时锁住该用户的计数行直到事务提交，同一用户的变更按序号顺序提交，客户端的游标不会跳过未提交的变更。
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, verbose_name='用户')
+    value = models.PositiveBigIntegerField(default=0, verbose_name='当前序号')
+    # 序号不大于此值的删除记录已被 compact_tombstones 清理，更早的游标需要全量同步
+    compacted = models.PositiveBigIntegerField(default=0, verbose_name='已清理的删除记录序号')
+
+    @classmethod
+    def allocate(cls, user_id, count=1):
+        """取 count 个连续序号，返回最后一个；需要在事务中调用"""
+        # UPDATE 持有行锁直到事务结束；用户第一次写入时先建计数行
+        if not cls.objects.filter(pk=user_id).update(value=F('value') + count):
+            cls.objects.get_or_create(user_id=user_id)
+            cls.objects.filter(pk=user_id).update(value=F('value') + count)
+        return cls.objects.filter(pk=user_id).values_list('value', flat=True).get()
+
+    @classmethod
+    def lock(cls, user_id):
+        """锁住用户的计数行直到事务结束（不取号）；需要在事务中调用"""
+        list(cls.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+
+
+class SyncedModel(models.Model):
+    """带变更序号的模型，每次 save() 都在同一事务中取一个新序号"""
+    seq = models.PositiveBigIntegerField(default=0, verbose_name='变更序号')
+
+    class Meta:
+        abstract = True
+
+    def sync_user_id(self):
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None and 'seq' not in kwargs['update_fields']:
+            kwargs['update_fields'] = [*kwargs['update_fields'], 'seq']
+        with transaction.atomic():
+            self.seq = SyncCounter.allocate(self.sync_user_id())
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # 保存时先锁计数行、再在信号中锁账本行；删除时信号会先锁账本行、最后记录删除时才取号。
+        # 删除前先锁计数行，两条路径加锁顺序一致（计数行 → 账本），并发的保存和删除不会死锁。
+        # 级联删除（删除账本时的账单、预算）由账本的 delete() 统一加锁
+        with transaction.atomic():
+            SyncCounter.lock(self.sync_user_id())
+            return super().delete(*args, **kwargs)
+
+
+class LedgerOwnedModel(SyncedModel):
+    class Meta:
+        abstract = True
+
+    def sync_user_id(self):
+        if self._meta.get_field('ledger').is_cached(self) and self.ledger.pk == self.ledger_id:
+            return self.ledger.user_id
+        # 删除时 delete() 和删除信号都要用到，按账本记住查询结果
+        owner = getattr(self, '_sync_owner', None)
+        if owner is None or owner[0] != self.ledger_id:
+            owner = self._sync_owner = (
+                self.ledger_id, Ledger.objects.filter(pk=self.ledger_id).values_list('user_id', flat=True).get(),
+            )
+        return owner[1]
+
+
+class LedgerQuerySet(models.QuerySet):
+    def delete(self):
+        # 管理后台的批量删除走这里，同样要标记正在删除的账本
+        with deleting(ledger_ids=self.values_list('pk', flat=True)):
+            return super().delete()
+
+
+class Ledger(SyncedModel):
     name = models.CharField(max_length=255, verbose_name='账本名称')
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='用户')  # 假设你有用户系统
     image = models.CharField(max_length=2, verbose_name='账本封面', blank=True, default='0')
     isDefault = models.BooleanField(default=False, verbose_name='是否默认账本')
     create_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    # 账本数据版本号，账单每次写入都会加一，用于缓存失效
+    data_version = models.PositiveBigIntegerField(default=0, verbose_name='数据版本')
+
+    objects = LedgerQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='ledger_user_seq_idx'),
+        ]
+
+    def sync_user_id(self):
+        return self.user_id
+
+    def delete(self, *args, **kwargs):
+        with deleting(ledger_ids=[self.pk]):
+            return super().delete(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        # data_version 只通过 F() 原子地加一（bill.versions），更新账本时不写回内存中的旧值
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'data_version'
+            ]
+        super().save(*args, **kwargs)
+
 class Category(models.Model):
     INCOME = '1'
     EXPENSE = '2'
@@ -40,23 +142,28 @@ class Category(models.Model):
         ('29', '运动'), ('30', '捐赠'), ('31', '金融'), ('32', '其他'),
     ]
 
+    # 预先构建好的 inOutType -> {detail_type: 显示名称}
+    DETAIL_TYPE_NAMES = {
+        INCOME: dict(DETAIL_TYPE_INCOME),
+        EXPENSE: dict(DETAIL_TYPE_EXPENSE),
+    }
+
     detail_type = models.CharField(max_length=2, verbose_name='详细类型')
 
+    @classmethod
+    def detail_type_name(cls, inOutType, detail_type):
+        """不需要实例即可获取详细类型的显示名称"""
+        return cls.DETAIL_TYPE_NAMES.get(inOutType, {}).get(detail_type, "未知类型")
+
     def get_detail_type_display(self):
         """根据 inOutType 和 detail_type 返回详细类型的显示名称"""
-        if self.inOutType == self.INCOME:
-            detail_type_dict = dict(self.DETAIL_TYPE_INCOME)
-        elif self.inOutType == self.EXPENSE:
-            detail_type_dict = dict(self.DETAIL_TYPE_EXPENSE)
-        else:
-            return "未知类型"
-        return detail_type_dict.get(self.detail_type, "未知类型")
+        return self.detail_type_name(self.inOutType, self.detail_type)
 
     def clean(self):
         """根据 inOutType 验证 detail_type 的合法性"""
-        if self.inOutType == self.INCOME and self.detail_type not in dict(self.DETAIL_TYPE_INCOME):
+        if self.inOutType == self.INCOME and self.detail_type not in self.DETAIL_TYPE_NAMES[self.INCOME]:
             raise ValidationError('收入类型下的详细类型选择不合法。')
-        if self.inOutType == self.EXPENSE and self.detail_type not in dict(self.DETAIL_TYPE_EXPENSE):
+        if self.inOutType == self.EXPENSE and self.detail_type not in self.DETAIL_TYPE_NAMES[self.EXPENSE]:
             raise ValidationError('支出类型下的详细类型选择不合法。')
 
     class Meta:
@@ -65,7 +172,7 @@ class Category(models.Model):
     def __str__(self):
         return f"{self.get_inOutType_display()}"
 
-class Bill(models.Model):
+class Bill(LedgerOwnedModel):
     ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='类别')
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='金额')
@@ -76,7 +183,63 @@ class Bill(models.Model):
     def __str__(self):
         return f"{self.category} - {self.amount}"
 
-class Budget(models.Model):
+    class Meta:
+        indexes = [
+            # 账单列表（按日期/id 排序、游标分页）和按日期区间的报表
+            models.Index(fields=['ledger', 'date', 'id'], name='bill_ledger_date_id_idx'),
+            # 按类别过滤的账单列表和类别统计
+            models.Index(fields=['ledger', 'category', 'date'], name='bill_ledger_cat_date_idx'),
+            # 增量同步
+            models.Index(fields=['ledger', 'seq'], name='bill_ledger_seq_idx'),
+        ]
+
+class MonthlyCategoryTotal(models.Model):
+    """按 账本/年/月/收支类型/详细类型 汇总的账单金额和笔数，由 bill.signals 增量维护"""
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
+    year = models.PositiveIntegerField(verbose_name='年份')
+    month = models.PositiveIntegerField(verbose_name='月份')
+    inOutType = models.CharField(max_length=1, choices=Category.INOUT_TYPE_CHOICES, verbose_name='收支类型')
+    detail_type = models.CharField(max_length=2, verbose_name='详细类型')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='总金额')
+    count = models.IntegerField(default=0, verbose_name='账单笔数')
+
+    class Meta:
+        unique_together = ('ledger', 'year', 'month', 'inOutType', 'detail_type')
+
+    def __str__(self):
+        return f"{self.ledger} - {self.year}/{self.month} - {self.inOutType}/{self.detail_type}: {self.total}"
+
+class DailyBalance(models.Model):
+    """账本每日收支，由 bill.signals 增量维护；累计余额由 MonthlyBalance 加上当月的每日收支得到（bill.balance）"""
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
+    date = models.DateField(verbose_name='日期')
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='当日收入')
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='当日支出')
+
+    class Meta:
+        unique_together = ('ledger', 'date')
+
+    def __str__(self):
+        return f"{self.ledger} - {self.date}: {self.income - self.expense}"
+
+
+class MonthlyBalance(models.Model):
+    """
+    账本截至某月月末的累计收支（按月的前缀和检查点），由 bill.signals 增量维护。
+    写入某日的账单只需更新该月及之后各月的检查点，与之后有多少天的数据无关。
+    """
+    ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
+    month = models.DateField(verbose_name='月份')  # 当月 1 日
+    cum_income = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name='累计收入')
+    cum_expense = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name='累计支出')
+
+    class Meta:
+        unique_together = ('ledger', 'month')
+
+    def __str__(self):
+        return f"{self.ledger} - {self.month:%Y-%m}: {self.cum_income - self.cum_expense}"
+
+class Budget(LedgerOwnedModel):
     ledger = models.ForeignKey(Ledger, on_delete=models.CASCADE, verbose_name='账本')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='类别')
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='预算金额')
@@ -88,5 +251,34 @@ class Budget(models.Model):
 
     class Meta:
         unique_together = ('ledger', 'category', 'month', 'year')  # 同一账本、类别和月份下的预算应该是唯一的
+        indexes = [
+            models.Index(fields=['ledger', 'seq'], name='budget_ledger_seq_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """账本、账单、预算的删除记录，同步接口据此下发删除；由 compact_tombstones 定期清理"""
+    LEDGER = 'ledger'
+    BILL = 'bill'
+    BUDGET = 'budget'
+    MODEL_CHOICES = [
+        (LEDGER, '账本'),
+        (BILL, '账单'),
+        (BUDGET, '预算'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='用户')
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES, verbose_name='类型')
+    object_id = models.PositiveBigIntegerField(verbose_name='对象 id')
+    seq = models.PositiveBigIntegerField(verbose_name='变更序号')
+    delete_time = models.DateTimeField(auto_now_add=True, verbose_name='删除时间')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='tombstone_user_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_model_display()} {self.object_id} #{self.seq}"
 
 
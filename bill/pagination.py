@@ -0,0 +1,99 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPaginator:
+    """
+    基于 (排序字段, id) 的游标分页，避免 OFFSET 扫描，也不会把整个账单表读进内存。
+
+    游标是对上一页最后一行 (排序字段值, id) 的 base64 编码，对客户端不透明。
+    """
+
+    # 允许的排序字段，只保留 (ledger, date, id) 索引能直接提供顺序的字段
+    ORDERING_FIELDS = ('date', 'id')
+    DEFAULT_ORDERING = '-date'
+
+    def __init__(self, request, ordering=None):
+        self.request = request
+        self.ordering = ordering or self.DEFAULT_ORDERING
+        self.descending = self.ordering.startswith('-')
+        self.field_name = self.ordering.lstrip('-')
+        if self.field_name not in self.ORDERING_FIELDS:
+            raise InvalidCursor(f"不支持的排序字段：{self.ordering}")
+        self.page_size = self.get_page_size()
+
+    @staticmethod
+    def is_requested(request):
+        """客户端传了 cursor 或 page_size 时才分页，老版本客户端仍然拿到完整列表"""
+        return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+    def get_page_size(self):
+        default = getattr(settings, 'BILL_PAGE_SIZE', 50)
+        maximum = getattr(settings, 'BILL_MAX_PAGE_SIZE', 500)
+        try:
+            page_size = int(self.request.query_params.get('page_size', default))
+        except (TypeError, ValueError):
+            raise InvalidCursor("page_size 必须是整数")
+        if page_size <= 0:
+            raise InvalidCursor("page_size 必须大于0")
+        return min(page_size, maximum)
+
+    def encode_cursor(self, value, pk):
+        payload = json.dumps([self.ordering, str(value), pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, model):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            ordering, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if ordering != self.ordering:
+                raise InvalidCursor("游标与排序参数不匹配")
+            field = model._meta.get_field(self.field_name)
+            return field.to_python(value), int(pk)
+        except InvalidCursor:
+            raise
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor("无效的游标")
+
+    def page_queryset(self, queryset):
+        """本页的查询（排序、游标条件，多取一条用于判断是否还有下一页），尚未执行"""
+        direction = '-' if self.descending else ''
+        queryset = queryset.order_by(f'{direction}{self.field_name}', f'{direction}id')
+
+        cursor = self.request.query_params.get('cursor')
+        if cursor:
+            value, pk = self.decode_cursor(cursor, queryset.model)
+            lookup = 'lt' if self.descending else 'gt'
+            if self.field_name == 'id':
+                queryset = queryset.filter(**{f'id__{lookup}': pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{self.field_name}__{lookup}': value}) |
+                    Q(**{self.field_name: value, f'id__{lookup}': pk})
+                )
+
+        return queryset[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset):
+        """
+        返回本页数据（已取出到内存中，最多 page_size 条）和下一页游标。
+        queryset 可以是 values() 查询，此时需包含排序字段和 id 列。
+        """
+        rows = list(self.page_queryset(queryset))
+        next_cursor = None
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last = rows[-1]
+            if isinstance(last, dict):
+                next_cursor = self.encode_cursor(last[self.field_name], last['id'])
+            else:
+                next_cursor = self.encode_cursor(getattr(last, self.field_name), last.pk)
+        return rows, next_cursor
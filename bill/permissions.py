@@ -0,0 +1,72 @@
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+
+from utils.utils import fail_response
+from .models import Ledger
+
+
+def _cache_key(user_id):
+    return f'bill:ledger_ids:{user_id}'
+
+
+def owned_ledger_ids(user, refresh=False):
+    """
+    用户拥有的账本 id 集合，按用户缓存。
+    账本创建、删除时由 bill.signals 失效；账本不会转移给其他用户，
+    所以缓存里多出已删除的账本也不会越权，只需在未命中时回源确认。
+    """
+    key = _cache_key(user.pk)
+    ids = None if refresh else cache.get(key)
+    if ids is None:
+        ids = frozenset(Ledger.objects.filter(user_id=user.pk).values_list('id', flat=True))
+        cache.set(key, ids, getattr(settings, 'LEDGER_IDS_CACHE_TIMEOUT', 300))
+    return ids
+
+
+def invalidate_owned_ledgers(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def get_owned(queryset, user, **lookup):
+    """
+    取属于用户账本的单个对象（账单、预算、分析任务等带 ledger 外键的模型）。
+    缓存的账本集合里可能还没有其他进程刚创建的账本，找不到时刷新缓存再查一次，仍找不到时抛出 DoesNotExist。
+    """
+    try:
+        return queryset.get(ledger_id__in=owned_ledger_ids(user), **lookup)
+    except queryset.model.DoesNotExist:
+        return queryset.get(ledger_id__in=owned_ledger_ids(user, refresh=True), **lookup)
+
+
+def user_owns_ledger(user, ledger_id):
+    try:
+        ledger_id = int(ledger_id)
+    except (TypeError, ValueError):
+        return False
+    if ledger_id in owned_ledger_ids(user):
+        return True
+    # 其他进程刚创建的账本可能还不在本进程的缓存里
+    return ledger_id in owned_ledger_ids(user, refresh=True)
+
+
+def ledger_required(param='ledger_id', source='query', status_code=status.HTTP_400_BAD_REQUEST):
+    """
+    校验请求中的账本属于当前用户，并把账本 id 放到 request.ledger_id。
+    参数缺失时交给视图自己处理（各视图对缺参的提示不同），之后的查询只需按 ledger_id 过滤。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            params = request.query_params if source == 'query' else request.data
+            ledger_id = params.get(param)
+            request.ledger_id = None
+            if ledger_id:
+                if not user_owns_ledger(request.user, ledger_id):
+                    return fail_response(message="账本不存在或无权限访问", status_code=status_code)
+                request.ledger_id = int(ledger_id)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
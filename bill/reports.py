@@ -0,0 +1,81 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from .categories import category_key
+from .models import Bill, Category, MonthlyCategoryTotal
+
+ZERO = Decimal('0')
+
+
+def month_range(year, month):
+    """某月对应的半开日期区间 [start, end)，可以直接走 date 列上的索引"""
+    start = date(int(year), int(month), 1)
+    if start.month == 12:
+        end = date(start.year + 1, 1, 1)
+    else:
+        end = date(start.year, start.month + 1, 1)
+    return start, end
+
+
+class Report:
+    """一段时间内的收入、支出，以及按日、按类别的明细"""
+
+    def __init__(self):
+        self.income = ZERO
+        self.expense = ZERO
+        self.days = defaultdict(lambda: [ZERO, ZERO])  # 日期 -> [收入, 支出]
+        self.categories = defaultdict(lambda: ZERO)  # (inOutType, detail_type) -> 金额
+
+    def add(self, day, in_out_type, detail_type, amount):
+        if in_out_type == Category.INCOME:
+            self.income += amount
+            if day is not None:
+                self.days[day][0] += amount
+        elif in_out_type == Category.EXPENSE:
+            self.expense += amount
+            if day is not None:
+                self.days[day][1] += amount
+        self.categories[(in_out_type, detail_type)] += amount
+
+    def categories_of(self, in_out_type):
+        """某收支类型下各详细类型的金额，从大到小"""
+        items = [
+            (detail_type, total)
+            for (key_type, detail_type), total in self.categories.items()
+            if key_type == in_out_type and total
+        ]
+        return sorted(items, key=lambda item: item[1], reverse=True)
+
+
+def bill_report_rows(ledger_id, start, end):
+    """
+    对原始账单做一次聚合：半开区间 [start, end) 内按 日期 × 类别 id 分组。
+    只读账单表，收支类型和详细类型由进程内的类别快照换算，不连接类别表。
+    """
+    return Bill.objects.filter(
+        ledger_id=ledger_id, date__gte=start, date__lt=end
+    ).values('date', 'category_id').annotate(total=Sum('amount')).order_by()
+
+
+def bill_report(ledger_id, start, end):
+    """按日和按类别的明细都从 bill_report_rows 这一条查询得到"""
+    report = Report()
+    for row in bill_report_rows(ledger_id, start, end):
+        in_out_type, detail_type = category_key(row['category_id'])
+        report.add(row['date'], in_out_type, detail_type, row['total'])
+    return report
+
+
+def month_report(ledger_id, year, month):
+    """从月度汇总表一次读出某月的收支总额和各类别金额（不含按日明细）"""
+    rows = MonthlyCategoryTotal.objects.filter(
+        ledger_id=ledger_id, year=year, month=month, count__gt=0
+    ).values_list('inOutType', 'detail_type', 'total')
+
+    report = Report()
+    for in_out_type, detail_type, total in rows:
+        report.add(None, in_out_type, detail_type, total)
+    return report
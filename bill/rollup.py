@@ -0,0 +1,55 @@
+from collections import namedtuple, defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .categories import category_key
+from .models import Bill, MonthlyCategoryTotal
+
+# 一笔账单对汇总表的贡献
+BillFact = namedtuple('BillFact', ['ledger_id', 'date', 'inOutType', 'detail_type', 'amount'])
+
+
+def bill_fact(bill):
+    # date、amount 可能是刚从请求里拿到的字符串，按字段规则转换并与数据库中的精度保持一致
+    in_out_type, detail_type = category_key(bill.category_id)
+    return BillFact(
+        ledger_id=bill.ledger_id,
+        date=Bill._meta.get_field('date').to_python(bill.date),
+        inOutType=in_out_type,
+        detail_type=detail_type,
+        amount=Bill._meta.get_field('amount').to_python(bill.amount).quantize(Decimal('0.01')),
+    )
+
+
+def apply_facts(facts, sign=1):
+    """
+    把一组账单按 sign（+1 新增 / -1 删除）累加到月度汇总表。
+    同一个汇总键的多笔账单先在内存里合并，每个键只执行一次 UPDATE。
+    """
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for fact in facts:
+        key = (fact.ledger_id, fact.date.year, fact.date.month, fact.inOutType, fact.detail_type)
+        deltas[key][0] += fact.amount * sign
+        deltas[key][1] += sign
+
+    with transaction.atomic():
+        for (ledger_id, year, month, in_out_type, detail_type), (total, count) in deltas.items():
+            if not total and not count:
+                continue
+            key = dict(ledger_id=ledger_id, year=year, month=month, inOutType=in_out_type, detail_type=detail_type)
+            updated = MonthlyCategoryTotal.objects.filter(**key).update(
+                total=F('total') + total, count=F('count') + count
+            )
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    MonthlyCategoryTotal.objects.create(total=total, count=count, **key)
+            except IntegrityError:
+                # 并发请求刚好先创建了这一行，改为累加
+                MonthlyCategoryTotal.objects.filter(**key).update(
+                    total=F('total') + total, count=F('count') + count
+                )
+
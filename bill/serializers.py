@@ -1,5 +1,7 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Bill, Ledger, Budget, Category
+from .models import Bill, Ledger, Budget
+from .categories import resolve_category_id, category_key
 
 class LedgerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,26 +16,21 @@ class BillSerializer(serializers.ModelSerializer):
         fields = ['id', 'ledger', 'amount', 'remark', 'create_time', 'date']
         read_only_fields = ['id', 'create_time']
 
+    @transaction.atomic
     def create(self, validated_data):
         category_data = self.context['request'].data.get('category')
-        # 获取或创建 Category
-        category, created = Category.objects.get_or_create(
-            inOutType=category_data['inOutType'],
-            detail_type=category_data['detail_type']
-        )
+        # 从进程内的类别快照解析 Category
+        category_id = resolve_category_id(category_data['inOutType'], category_data['detail_type'])
 
-        bill = Bill.objects.create(category=category, **validated_data)
+        bill = Bill.objects.create(category_id=category_id, **validated_data)
         return bill
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # 处理 Category
         category_data = self.context['request'].data.get('category')
         if category_data:
-            category, created = Category.objects.get_or_create(
-                inOutType=category_data['inOutType'],
-                detail_type=category_data['detail_type']
-            )
-            instance.category = category
+            instance.category_id = resolve_category_id(category_data['inOutType'], category_data['detail_type'])
 
         # 更新其他字段
         for attr, value in validated_data.items():
@@ -44,9 +41,10 @@ class BillSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         # 返回时添加 category 的详细信息
         representation = super().to_representation(instance)
+        in_out_type, detail_type = category_key(instance.category_id)
         representation['category'] = {
-            'inOutType': instance.category.inOutType,
-            'detail_type': instance.category.detail_type
+            'inOutType': in_out_type,
+            'detail_type': detail_type
         }
 
         # 返回时添加 ledger 的详细信息
@@ -61,24 +59,17 @@ class BudgetSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         category_data = self.context['request'].data.get('category')
-        # 获取或创建 Category
-        category, created = Category.objects.get_or_create(
-            inOutType=category_data['inOutType'],
-            detail_type=category_data['detail_type']
-        )
+        # 从进程内的类别快照解析 Category
+        category_id = resolve_category_id(category_data['inOutType'], category_data['detail_type'])
 
-        budget = Budget.objects.create(category=category, **validated_data)
+        budget = Budget.objects.create(category_id=category_id, **validated_data)
         return budget
 
     def update(self, instance, validated_data):
         # 处理 Category
         category_data = self.context['request'].data.get('category')
         if category_data:
-            category, created = Category.objects.get_or_create(
-                inOutType=category_data['inOutType'],
-                detail_type=category_data['detail_type']
-            )
-            instance.category = category
+            instance.category_id = resolve_category_id(category_data['inOutType'], category_data['detail_type'])
 
         # 更新其他字段
         for attr, value in validated_data.items():
@@ -89,9 +80,10 @@ class BudgetSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         # 返回时添加 category 的详细信息
         representation = super().to_representation(instance)
+        in_out_type, detail_type = category_key(instance.category_id)
         representation['category'] = {
-            'inOutType': instance.category.inOutType,
-            'detail_type': instance.category.detail_type
+            'inOutType': in_out_type,
+            'detail_type': detail_type
         }
         return representation
 
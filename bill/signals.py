@@ -1,10 +1,129 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, post_delete
+from django.dispatch import receiver, Signal
 from user.models import User
-from .models import Ledger
+from .models import Ledger, Bill, Budget, SyncCounter, Tombstone
+from . import balance, rollup
+from .categories import category_key
+from .deleting import deleting_ledgers, deleting_users
+from .permissions import invalidate_owned_ledgers
+from .rollup import BillFact, bill_fact
+from .sync import record_tombstone
+from .versions import bump_data_version
+
+# bulk_create 不会触发 post_save，批量写入账单后需要手动发送这个信号，参数 bills 为已创建的账单列表
+bills_bulk_created = Signal()
 
 # 每次用户注册时自动创建一个默认账本
 @receiver(post_save, sender=User)
 def create_default_ledger(sender, instance, created, **kwargs):
     if created:
-        Ledger.objects.create(name="默认账本", user=instance, isDefault=True)
\ No newline at end of file
+        # 变更序号计数从注册时开始，之后取号不必再判断计数行是否存在
+        SyncCounter.objects.create(user=instance)
+        Ledger.objects.create(name="默认账本", user=instance, isDefault=True)
+
+
+# 账本创建、删除时让该用户的账本 id 缓存失效（包括注册时创建的默认账本）
+@receiver(post_save, sender=Ledger)
+def invalidate_ledger_ids_on_save(sender, instance, created, **kwargs):
+    if created:
+        invalidate_owned_ledgers(instance.user_id)
+    else:
+        # 账单列表中带有账本名称，账本改名后条件 GET 不能再返回 304
+        bump_data_version([instance.pk])
+
+
+@receiver(post_delete, sender=Ledger)
+def invalidate_ledger_ids_on_delete(sender, instance, **kwargs):
+    invalidate_owned_ledgers(instance.user_id)
+
+
+# 正在被删除的账本、用户由 Ledger / User 的 delete() 标记（bill.deleting）。
+# 级联删除账本的账单、预算时无需再逐笔维护汇总数据，也不再逐笔记录删除；
+# 注销用户时其删除记录随用户一起删除，级联删除账本时不再记录
+@receiver(post_delete, sender=Ledger)
+def record_ledger_tombstone(sender, instance, **kwargs):
+    if instance.user_id not in deleting_users():
+        record_tombstone(instance.user_id, Tombstone.LEDGER, instance.pk)
+
+
+def apply_bill_facts(facts, sign=1):
+    """把账单变动同步到月度汇总表和每日余额表"""
+    with transaction.atomic():
+        rollup.apply_facts(facts, sign)
+        balance.apply_facts(facts, sign)
+
+
+# 保存前记下账单原来的归属（账本、日期、类别、金额），保存后先扣掉旧值再加上新值
+@receiver(pre_save, sender=Bill)
+def remember_bill_state(sender, instance, **kwargs):
+    instance._old_fact = None
+    if instance.pk is None:
+        return
+    old = Bill.objects.filter(pk=instance.pk).values('ledger_id', 'date', 'category_id', 'amount').first()
+    if old:
+        in_out_type, detail_type = category_key(old['category_id'])
+        instance._old_fact = BillFact(
+            ledger_id=old['ledger_id'],
+            date=old['date'],
+            inOutType=in_out_type,
+            detail_type=detail_type,
+            amount=old['amount'],
+        )
+
+
+@receiver(post_save, sender=Bill)
+def update_summaries_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_old_fact', None)
+    new = bill_fact(instance)
+    with transaction.atomic():
+        # 只改了备注等字段时汇总数据不变，但账本的数据版本仍要更新
+        bump_data_version([new.ledger_id] + ([old.ledger_id] if old else []))
+        if old == new:
+            return
+        if old:
+            apply_bill_facts([old], -1)
+        apply_bill_facts([new], 1)
+
+
+@receiver(post_delete, sender=Bill)
+def update_summaries_on_delete(sender, instance, **kwargs):
+    if instance.ledger_id in deleting_ledgers():
+        return
+    with transaction.atomic():
+        bump_data_version([instance.ledger_id])
+        apply_bill_facts([bill_fact(instance)], -1)
+        record_tombstone(instance.sync_user_id(), Tombstone.BILL, instance.pk)
+
+
+@receiver(bills_bulk_created)
+def update_summaries_on_bulk_create(sender, bills, **kwargs):
+    with transaction.atomic():
+        bump_data_version([bill.ledger_id for bill in bills])
+        apply_bill_facts([bill_fact(bill) for bill in bills], 1)
+
+
+# 预算列表、总预算同样按账本数据版本做条件 GET，预算写入后也要更新版本号
+@receiver(pre_save, sender=Budget)
+def remember_budget_ledger(sender, instance, **kwargs):
+    # 预算可能被改到另一个账本，原账本的版本号也要更新
+    instance._old_ledger_id = None
+    if instance.pk is not None:
+        instance._old_ledger_id = Budget.objects.filter(pk=instance.pk).values_list('ledger_id', flat=True).first()
+
+
+@receiver(post_save, sender=Budget)
+def bump_version_on_budget_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_ledger_id = getattr(instance, '_old_ledger_id', None)
+    bump_data_version([instance.ledger_id] + ([old_ledger_id] if old_ledger_id else []))
+
+
+@receiver(post_delete, sender=Budget)
+def bump_version_on_budget_delete(sender, instance, **kwargs):
+    if instance.ledger_id not in deleting_ledgers():
+        bump_data_version([instance.ledger_id])
+        record_tombstone(instance.sync_user_id(), Tombstone.BUDGET, instance.pk)
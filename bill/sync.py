@@ -0,0 +1,80 @@
+"""
+增量同步：账本、账单、预算的每次写入或删除都按用户取一个递增的变更序号（SyncCounter），
+删除留下 Tombstone。客户端保存上次同步到的序号作为游标，只拉取之后的变更。
+"""
+from collections import defaultdict
+
+from .encoders import BillRowEncoder, BudgetRowEncoder, LedgerRowEncoder
+from .models import Bill, Budget, Ledger, SyncCounter, Tombstone
+
+# 同步结果里不带账本名称，客户端从账本的变更中获取
+_BILL_FIELDS = [name for name in BillRowEncoder.FIELDS if name != 'ledger_name']
+
+
+def assign_seqs(objects):
+    """
+    bulk_create 不会调用 save()，批量写入账单或预算前用这个函数为每个对象分配序号。
+    需要在与插入相同的事务中调用。
+    """
+    ledger_ids = {obj.ledger_id for obj in objects}
+    owners = dict(Ledger.objects.filter(pk__in=ledger_ids).values_list('id', 'user_id'))
+    by_user = defaultdict(list)
+    for obj in objects:
+        by_user[owners[obj.ledger_id]].append(obj)
+    for user_id, group in by_user.items():
+        last = SyncCounter.allocate(user_id, len(group))
+        for seq, obj in enumerate(group, start=last - len(group) + 1):
+            obj.seq = seq
+
+
+def record_tombstone(user_id, model, object_id):
+    Tombstone.objects.create(
+        user_id=user_id, model=model, object_id=object_id, seq=SyncCounter.allocate(user_id),
+    )
+
+
+def changes(user, since, limit):
+    """
+    返回序号大于 since 的至多 limit 条变更，以及下一次请求使用的游标。
+
+    游标早于已清理的删除记录（或大于当前序号，例如来自另一个环境）时返回 reset，
+    并从头返回全部现存数据，客户端应先清空本地数据。since 为 0 的全量同步不需要删除记录。
+    删除账本时不再为其中的账单、预算单独记录删除，客户端收到账本的删除后一并删除。
+    """
+    current, compacted = SyncCounter.objects.filter(pk=user.pk).values_list('value', 'compacted').first() or (0, 0)
+    reset = since > current or 0 < since < compacted
+    if reset:
+        since = 0
+
+    sources = [
+        ('ledgers', LedgerRowEncoder(), Ledger.objects.filter(user_id=user.pk)),
+        ('bills', BillRowEncoder(_BILL_FIELDS), Bill.objects.filter(ledger__user_id=user.pk)),
+        ('budgets', BudgetRowEncoder(), Budget.objects.filter(ledger__user_id=user.pk)),
+    ]
+    # 每个来源各取 limit + 1 条，合并后按序号取前 limit 条
+    rows = []
+    for name, encoder, queryset in sources:
+        queryset = encoder.values(queryset.filter(seq__gt=since), 'seq').order_by('seq')[:limit + 1]
+        rows.extend((row['seq'], name, encoder.encode_row(row)) for row in queryset)
+    if since:
+        tombstones = Tombstone.objects.filter(user_id=user.pk, seq__gt=since).order_by('seq')[:limit + 1]
+        rows.extend((seq, 'deleted', (model, object_id)) for seq, model, object_id in tombstones.values_list(
+            'seq', 'model', 'object_id'))
+    rows.sort(key=lambda item: item[0])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    result = {name: [] for name, _, _ in sources}
+    result['deleted'] = {'ledgers': [], 'bills': [], 'budgets': []}
+    for _, name, item in rows:
+        if name == 'deleted':
+            model, object_id = item
+            result['deleted'][model + 's'].append(object_id)
+        else:
+            result[name].append(item)
+    # 没有更多变更时直接跳到当前序号（读取序号时不大于它的变更都已提交）
+    last = rows[-1][0] if rows else since
+    result['cursor'] = last if has_more else max(last, current)
+    result['has_more'] = has_more
+    result['reset'] = reset
+    return result
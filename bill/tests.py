@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.test import TestCase
+
+from user.models import User
+from .categories import resolve_category_id, warm_categories
+from .deleting import deleting_ledgers, deleting_users
+from .models import Bill, Category, Ledger, MonthlyCategoryTotal
+
+
+class FailedDeleteTests(TestCase):
+    """删除账本或用户失败后，正在删除的标记要清除，之后的账单写入仍要维护汇总数据"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # 类别快照是进程级的，在类级别的事务中建好预置类别并重新加载
+        warm_categories()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password=None)
+        self.ledger = Ledger.objects.get(user=self.user, isDefault=True)
+        self.bill = Bill.objects.create(
+            ledger=self.ledger,
+            category_id=resolve_category_id(Category.EXPENSE, '1'),
+            amount=Decimal('10'),
+            date=date(2024, 1, 1),
+        )
+
+    @contextmanager
+    def failing_bill_delete(self):
+        # 级联删除账单时抛出异常，模拟删除过程中的完整性错误或锁等待超时
+        def fail(sender, instance, **kwargs):
+            raise IntegrityError('删除失败')
+
+        post_delete.connect(fail, sender=Bill, dispatch_uid='failing_bill_delete')
+        try:
+            yield
+        finally:
+            post_delete.disconnect(sender=Bill, dispatch_uid='failing_bill_delete')
+
+    def assert_total(self, expected):
+        total = MonthlyCategoryTotal.objects.get(
+            ledger=self.ledger, year=2024, month=1, inOutType=Category.EXPENSE, detail_type='1',
+        ).total
+        self.assertEqual(total, Decimal(expected))
+
+    def assert_bill_writes_maintained(self):
+        self.bill.amount = Decimal('25')
+        self.bill.save()
+        self.assert_total('25.00')
+        # 账单删除时会检查账本是否正在删除，标记残留会让汇总数据不再扣减
+        self.bill.delete()
+        self.assert_total('0.00')
+
+    def test_failed_ledger_delete(self):
+        with self.failing_bill_delete(), self.assertRaises(IntegrityError), transaction.atomic():
+            self.ledger.delete()
+
+        self.assertFalse(deleting_ledgers())
+        self.assert_bill_writes_maintained()
+
+    def test_failed_user_delete(self):
+        with self.failing_bill_delete(), self.assertRaises(IntegrityError), transaction.atomic():
+            self.user.delete()
+
+        self.assertFalse(deleting_ledgers())
+        self.assertFalse(deleting_users())
+        self.assert_bill_writes_maintained()
+
+    def test_ledger_delete_skips_per_bill_maintenance(self):
+        self.ledger.delete()
+
+        self.assertFalse(deleting_ledgers())
+        self.assertFalse(MonthlyCategoryTotal.objects.filter(ledger_id=self.ledger.pk).exists())
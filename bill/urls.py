@@ -11,11 +11,15 @@ urlpatterns = [
     path('ledgers/', views.ledger_list, name='ledger-list'),  # 获取所有账本/创建账本
     path('ledgers/<int:pk>/', views.ledger_detail, name='ledger-detail'),  # 获取/更新/删除单个账本
     path('bills/', views.bill_list, name='bill-list'),  # For GET and POST (list all, create new)
+    path('bills/import/', views.bill_import, name='bill-import'),  # 批量导入账单（CSV / JSON Lines）
+    path('bills/export/', views.bill_export, name='bill-export'),  # 流式导出账单（CSV / JSON Lines）
     path('bills/<int:pk>/', views.bill_detail, name='bill-detail'),  # For GET, PUT, DELETE (retrieve, update, delete)
     path('budgets/', views.budget_list, name='budget-list'),  # For GET and POST (list all, create new)
     path('budgets/<int:pk>/', views.budget_detail, name='budget-detail'),  # For GET, PUT, DELETE (retrieve, update, delete)
 
     path('total-expense-by-category/', views.total_expense_by_category, name='category-list'),
     path('total-budget/', views.total_budget, name='month-list'),
+    path('balance-history/', views.balance_history, name='balance-history'),
+    path('sync/', views.sync, name='sync'),  # 增量同步（按变更序号返回账本、账单、预算的变更和删除）
 ]
 
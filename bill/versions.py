@@ -0,0 +1,69 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import F
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import Ledger
+from .permissions import user_owns_ledger
+
+
+def bump_data_version(ledger_ids):
+    """账本数据变化后把版本号加一，以 (账本, 版本号) 为键的缓存随之失效"""
+    Ledger.objects.filter(pk__in=set(ledger_ids)).update(data_version=F('data_version') + 1)
+
+
+def data_version(ledger_id):
+    return Ledger.objects.filter(pk=ledger_id).values_list('data_version', flat=True).first()
+
+
+def ledger_etag(request, ledgers):
+    """
+    由账本（Ledger 的 QuerySet）的数据版本、请求路径、查询参数和 Accept 计算 ETag。
+    账单、预算写入以及账本改名都会让版本号加一，版本号不变时同样参数的结果也不变。
+    """
+    versions = sorted(ledgers.values_list('id', 'data_version'))
+    key = repr((
+        request.path,
+        sorted(request.query_params.lists()),
+        request.headers.get('Accept', ''),
+        versions,
+    ))
+    # 响应可能被压缩中间件改写，使用弱 ETag
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def conditional_on_ledger(param='ledger_id', all_ledgers=False):
+    """
+    账本级别的条件 GET：If-None-Match 与当前 ETag 相同时直接返回 304，不再执行视图里的查询。
+    all_ledgers 为 True 时，没有传账本参数的请求按当前用户的全部账本计算 ETag（例如不带 ledger_id 的账单列表）。
+    账本不属于当前用户时不做处理，交给视图返回原来的结果。放在 @api_view 和 @ledger_required 之后。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            ledger_id = request.query_params.get(param)
+            if ledger_id:
+                if not user_owns_ledger(request.user, ledger_id):
+                    return view(request, *args, **kwargs)
+                ledgers = Ledger.objects.filter(pk=int(ledger_id))
+            elif all_ledgers:
+                # 直接按 user_id 查询，不使用进程内的账本 id 缓存，账本的增删也会改变 ETag
+                ledgers = Ledger.objects.filter(user_id=request.user.pk)
+            else:
+                return view(request, *args, **kwargs)
+
+            etag = ledger_etag(request, ledgers)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            # 客户端可以保存结果，但每次使用前都要带上 If-None-Match 重新验证
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
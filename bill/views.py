@@ -1,12 +1,25 @@
 import django_filters
 
-from datetime import datetime
-from .models import Bill, Ledger, Budget, Category
+from datetime import datetime, date
+from .models import Bill, Ledger, Budget, Category, MonthlyCategoryTotal
 from .serializers import BillSerializer, LedgerSerializer, BudgetSerializer
+from .pagination import KeysetPaginator, InvalidCursor
+from .encoders import BillRowEncoder, BudgetRowEncoder, InvalidFields
+from .reports import month_range, month_report, bill_report
+from . import balance, sync as sync_changes
+from .categories import resolve_category_id, category_ids
+from .permissions import get_owned, ledger_required, user_owns_ledger
+from .versions import conditional_on_ledger
+from .importers import import_bills, ImportFormatError
+from . import exporters
 from django.db.models import Sum
 from rest_framework import status
 from decimal import Decimal
-from rest_framework.decorators import api_view
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import MultiPartParser, FormParser
 
 from utils.utils import success_response, fail_response
 
@@ -60,29 +73,81 @@ class BillFilter(django_filters.FilterSet):
     # 按日期范围过滤
     date = django_filters.DateFromToRangeFilter(field_name='date')
 
-    # 自定义过滤器：按年、月、日过滤
-    year = django_filters.NumberFilter(field_name='date__year')
-    month = django_filters.NumberFilter(field_name='date__month')
-    day = django_filters.NumberFilter(field_name='date__day')
+    # 自定义过滤器：按年、月、日过滤，在 filter_queryset 中合并成日期区间
+    year = django_filters.NumberFilter(method='filter_later')
+    month = django_filters.NumberFilter(method='filter_later')
+    day = django_filters.NumberFilter(method='filter_later')
 
-    # 按类别的inOutType和detail_type字段进行过滤
-    inOutType = django_filters.CharFilter(field_name='category__inOutType')
-    detail_type = django_filters.CharFilter(field_name='category__detail_type')
+    # 按类别的inOutType和detail_type字段进行过滤，在 filter_queryset 中转换为 category_id 条件
+    inOutType = django_filters.CharFilter(method='filter_later')
+    detail_type = django_filters.CharFilter(method='filter_later')
 
     class Meta:
         model = Bill
         fields = ['inOutType', 'detail_type', 'date', 'year', 'month', 'day']
 
+    def filter_later(self, queryset, name, value):
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        data = self.form.cleaned_data
+        queryset = self.filter_calendar(queryset, data.get('year'), data.get('month'), data.get('day'))
+        return self.filter_category(queryset, data.get('inOutType'), data.get('detail_type'))
+
+    @staticmethod
+    def filter_calendar(queryset, year, month, day):
+        """
+        年/月/日转换为 date 列上的区间条件，而不是 date__year 之类的函数条件，
+        这样可以使用 (ledger, date, id) 索引。只有缺少年份或月份时才退回按字段提取过滤。
+        """
+        try:
+            if year is not None and month is not None and day is not None:
+                return queryset.filter(date=date(int(year), int(month), int(day)))
+            if year is not None and month is not None:
+                start, end = month_range(year, month)
+                return queryset.filter(date__gte=start, date__lt=end)
+            if year is not None:
+                queryset = queryset.filter(date__gte=date(int(year), 1, 1), date__lt=date(int(year) + 1, 1, 1))
+        except (ValueError, OverflowError):
+            return queryset.none()
+        if month is not None:
+            queryset = queryset.filter(date__month=month)
+        if day is not None:
+            queryset = queryset.filter(date__day=day)
+        return queryset
+
+    @staticmethod
+    def filter_category(queryset, in_out_type, detail_type):
+        # 先用类别快照把类别条件解析成 category_id，避免与类别表 JOIN，并可以使用 (ledger, category, date) 索引
+        if not in_out_type and not detail_type:
+            return queryset
+        ids = category_ids(in_out_type, detail_type)
+        if ids:
+            return queryset.filter(category_id__in=ids)
+        # 快照里没有（例如其他进程刚创建的非预置类别），退回子查询
+        categories = Category.objects.all()
+        if in_out_type:
+            categories = categories.filter(inOutType=in_out_type)
+        if detail_type:
+            categories = categories.filter(detail_type=detail_type)
+        return queryset.filter(category_id__in=categories.values('id'))
+
 
 @api_view(['GET', 'POST'])
+@conditional_on_ledger(all_ledgers=True)
 def bill_list(request):
     if request.method == 'GET':
         ledger_id = request.query_params.get('ledger_id')
 
+        # 指定账本时归属在缓存的账本 id 集合上判断，账单查询只按 ledger_id 过滤；
+        # 不指定时按账本的 user_id 过滤，不依赖进程内缓存，其他进程刚创建的账本也能查到
         if not ledger_id:
-            bills = Bill.objects.filter(ledger__user=request.user)
+            bills = Bill.objects.filter(ledger__user_id=request.user.pk)
+        elif user_owns_ledger(request.user, ledger_id):
+            bills = Bill.objects.filter(ledger_id=ledger_id)
         else:
-            bills = Bill.objects.filter(ledger__user=request.user, ledger_id=ledger_id)
+            bills = Bill.objects.none()
 
         # 过滤
         filterset = BillFilter(request.GET, queryset=bills)
@@ -90,28 +155,91 @@ def bill_list(request):
 
         # 排序
         ordering = request.GET.get('ordering')
+
+        # 列表走快速序列化，支持 ?fields= 稀疏字段
+        try:
+            encoder = BillRowEncoder.from_request(request)
+        except InvalidFields as e:
+            return fail_response(message=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+
+        # 游标分页（传了 cursor 或 page_size 时启用）
+        if KeysetPaginator.is_requested(request):
+            try:
+                paginator = KeysetPaginator(request, ordering=ordering)
+                rows = encoder.values(bills, paginator.field_name, 'id')
+                page, next_cursor = paginator.paginate_queryset(rows)
+            except InvalidCursor as e:
+                return fail_response(message=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+            data = {"results": encoder.encode(page), "next": next_cursor}
+            return success_response(data=data, message="获取账单列表成功")
+
         if ordering:
-            bills = bills.order_by(ordering)
+            if ordering.lstrip('-') not in KeysetPaginator.ORDERING_FIELDS:
+                return fail_response(message=f"不支持的排序字段：{ordering}", status_code=status.HTTP_400_BAD_REQUEST)
+            direction = '-' if ordering.startswith('-') else ''
+            bills = bills.order_by(ordering, f'{direction}id')
 
-        return success_response(data=BillSerializer(bills, many=True).data, message="获取账单列表成功")
+        return success_response(data=encoder.encode(encoder.values(bills)), message="获取账单列表成功")
 
     elif request.method == 'POST':
         serializer = BillSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             ledger_id = serializer.validated_data.get('ledger').id
-            try:
-                ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-            except Ledger.DoesNotExist:
+            if not user_owns_ledger(request.user, ledger_id):
                 return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
             serializer.save()
             return success_response(data=serializer.data, message="创建账单成功", status_code=status.HTTP_201_CREATED)
         return fail_response(errors=serializer.errors, message="创建账单失败", status_code=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+@ledger_required(source='data')
+def bill_import(request):
+    uploaded_file = request.FILES.get('file')
+    if not request.ledger_id or not uploaded_file:
+        return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        report = import_bills(request.ledger_id, uploaded_file, fmt=request.data.get('format'))
+    except ImportFormatError as e:
+        return fail_response(message=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except UnicodeDecodeError:
+        return fail_response(message="文件编码必须是 UTF-8", status_code=status.HTTP_400_BAD_REQUEST)
+
+    message = f"成功导入 {report['created']} 条账单，失败 {report['failed']} 条"
+    if not report['created']:
+        return fail_response(errors=report, message=message, status_code=status.HTTP_400_BAD_REQUEST)
+    return success_response(data=report, message=message, status_code=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@ledger_required(status_code=status.HTTP_404_NOT_FOUND)
+def bill_export(request):
+    if not request.ledger_id:
+        return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
+
+    # 注意不能用 format 参数名，DRF 会把它当作渲染格式
+    fmt = request.query_params.get('file_format', exporters.CSV).lower()
+    if fmt not in exporters.FORMATS:
+        return fail_response(message=f"不支持的文件格式：{fmt}", status_code=status.HTTP_400_BAD_REQUEST)
+
+    # 与账单列表相同的过滤条件
+    bills = BillFilter(request.GET, queryset=Bill.objects.filter(ledger_id=request.ledger_id)).qs
+
+    content_type, extension = exporters.FORMATS[fmt]
+    chunk_size = getattr(settings, 'BILL_EXPORT_CHUNK_SIZE', 2000)
+    # ASGI 下需要异步迭代器，否则 Django 会先把整个导出内容读进内存再发送
+    stream = exporters.astream_bills if isinstance(request._request, ASGIRequest) else exporters.stream_bills
+    response = StreamingHttpResponse(stream(bills, fmt, chunk_size), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="ledger_{request.ledger_id}.{extension}"'
+    return response
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
 def bill_detail(request, pk):
     try:
-        bill = Bill.objects.get(pk=pk, ledger__user=request.user)
+        bill = get_owned(Bill.objects, request.user, pk=pk)
     except Bill.DoesNotExist:
         return fail_response(message="未找到该账单", status_code=status.HTTP_404_NOT_FOUND)
 
@@ -124,7 +252,7 @@ def bill_detail(request, pk):
         if serializer.is_valid():
             ledger = serializer.validated_data.get('ledger')
             if ledger:
-                if ledger.user != request.user:
+                if not user_owns_ledger(request.user, ledger.id):
                     return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
             serializer.save()
             return success_response(data=serializer.data, message="更新账单成功")
@@ -144,34 +272,37 @@ class BudgetFilter(django_filters.FilterSet):
         fields = ['year', 'month']
 
 @api_view(['GET', 'POST'])
+@conditional_on_ledger(param='ledger')
 def budget_list(request):
     if request.method == 'GET':
         ledger_id = request.query_params.get('ledger')
 
-
-        budgets = Budget.objects.filter(ledger__user=request.user, ledger_id=ledger_id)
+        if user_owns_ledger(request.user, ledger_id):
+            budgets = Budget.objects.filter(ledger_id=ledger_id)
+        else:
+            budgets = Budget.objects.none()
 
         # 过滤
         filterset = BudgetFilter(request.GET, queryset=budgets)
         budgets = filterset.qs
 
-        serializer = BudgetSerializer(budgets, many=True)
-        return success_response(data=serializer.data, message="获取预算列表成功")
+        try:
+            encoder = BudgetRowEncoder.from_request(request)
+        except InvalidFields as e:
+            return fail_response(message=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+        return success_response(data=encoder.encode(encoder.values(budgets)), message="获取预算列表成功")
 
     elif request.method == 'POST':
         ledger_id = request.data.get('ledger')
         category_data = request.data.get('category')
-        category, _ = Category.objects.get_or_create(
-            inOutType=category_data['inOutType'],
-            detail_type=category_data['detail_type']
-        )
+        category_id = resolve_category_id(category_data['inOutType'], category_data['detail_type'])
         month = request.data.get('month')
         year = request.data.get('year')
 
-        if category is not None:
+        if category_id is not None:
             existing_budgets = Budget.objects.filter(
                 ledger_id=ledger_id,
-                category=category,
+                category_id=category_id,
                 month=month,
                 year=year
             )
@@ -181,9 +312,7 @@ def budget_list(request):
         serializer = BudgetSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             ledger_id = serializer.validated_data.get('ledger').id
-            try:
-                ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-            except Ledger.DoesNotExist:
+            if not user_owns_ledger(request.user, ledger_id):
                 return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
             serializer.save()
             return success_response(data=serializer.data, message="创建预算成功", status_code=status.HTTP_201_CREATED)
@@ -192,7 +321,7 @@ def budget_list(request):
 @api_view(['GET', 'PUT', 'DELETE'])
 def budget_detail(request, pk):
     try:
-        budget = Budget.objects.get(pk=pk, ledger__user=request.user)
+        budget = get_owned(Budget.objects, request.user, pk=pk)
     except Budget.DoesNotExist:
         return fail_response(message="未找到该预算", status_code=status.HTTP_404_NOT_FOUND)
 
@@ -203,10 +332,8 @@ def budget_detail(request, pk):
     elif request.method == 'PUT':
         serializer = BudgetSerializer(budget, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
-            ledger_id = serializer.validated_data.get('ledger').id
-            try:
-                ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-            except Ledger.DoesNotExist:
+            ledger = serializer.validated_data.get('ledger')
+            if ledger and not user_owns_ledger(request.user, ledger.id):
                 return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
             serializer.save()
             return success_response(data=serializer.data, message="更新预算成功")
@@ -221,6 +348,8 @@ def budget_detail(request, pk):
 
 
 @api_view(['GET'])
+@ledger_required()
+@conditional_on_ledger()
 def monthly_report(request):
     month = request.query_params.get('month')
     year = request.query_params.get('year')
@@ -230,26 +359,14 @@ def monthly_report(request):
         return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
 
     try:
-        ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-    except Ledger.DoesNotExist:
-        return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
-
-    # 计算月度收入和支出
-    income = Bill.objects.filter(
-        category__inOutType='1',  # 收入类型
-        date__month=month,
-        date__year=year,
-        ledger_id=ledger_id,
-        ledger__user=request.user
-    ).aggregate(total_income=Sum('amount'))['total_income'] or Decimal('0.00')
-
-    expense = Bill.objects.filter(
-        category__inOutType='2',  # 支出类型
-        date__month=month,
-        date__year=year,
-        ledger_id=ledger_id,
-        ledger__user=request.user
-    ).aggregate(total_expense=Sum('amount'))['total_expense'] or Decimal('0.00')
+        month_range(year, month)
+    except ValueError:
+        return fail_response(message="无效的日期格式", status_code=status.HTTP_400_BAD_REQUEST)
+
+    # 从月度汇总表读取收入和支出
+    report = month_report(request.ledger_id, int(year), int(month))
+    income = report.income
+    expense = report.expense
 
     # 保留两位小数，确保即使是整数形式也显示为两位小数
     income = Decimal(income).quantize(Decimal('0.00'))
@@ -260,6 +377,8 @@ def monthly_report(request):
     return success_response(data=result, message="获取月度报表成功。")
 
 @api_view(['GET'])
+@ledger_required()
+@conditional_on_ledger()
 def daily_report(request):
     month = request.query_params.get('month')
     year = request.query_params.get('year')
@@ -268,44 +387,23 @@ def daily_report(request):
     if not all([month, year, ledger_id]):
         return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
 
+    # 获取指定月份的日期区间
     try:
-        ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-    except Ledger.DoesNotExist:
-        return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_400_BAD_REQUEST)
-
-    # 获取指定月份的天数
-    try:
-        start_date = datetime(int(year), int(month), 1)
-        if int(month) == 12:
-            end_date = datetime(int(year) + 1, 1, 1)
-        else:
-            end_date = datetime(int(year), int(month) + 1, 1)
+        start_date, end_date = month_range(year, month)
     except ValueError:
         return fail_response(message="无效的日期格式", status_code=status.HTTP_400_BAD_REQUEST)
 
-    # 查询指定月份的收入和支出
-    bills = Bill.objects.filter(
-        date__gte=start_date,
-        date__lt=end_date,
-        ledger_id=ledger_id,
-        ledger__user=request.user
-    )
+    # 一次条件聚合查询得到每天的收入和支出
+    report = bill_report(request.ledger_id, start_date, end_date)
 
     # 按日期计算收入和支出
     daily_summary = {}
     for day in range(1, (end_date - start_date).days + 1):
         daily_summary[day] = {"income": Decimal('0.0'), "expense": Decimal('0.0')}
 
-    income_data = bills.filter(category__inOutType='1').values('date').annotate(total_income=Sum('amount'))
-    expense_data = bills.filter(category__inOutType='2').values('date').annotate(total_expense=Sum('amount'))
-
-    for income in income_data:
-        day = income['date'].day
-        daily_summary[day]['income'] = Decimal(income['total_income']).quantize(Decimal('0.0'))
-
-    for expense in expense_data:
-        day = expense['date'].day
-        daily_summary[day]['expense'] = Decimal(expense['total_expense']).quantize(Decimal('0.0'))
+    for bill_date, (income, expense) in report.days.items():
+        daily_summary[bill_date.day]['income'] = Decimal(income).quantize(Decimal('0.0'))
+        daily_summary[bill_date.day]['expense'] = Decimal(expense).quantize(Decimal('0.0'))
 
     # 将结果转换为列表格式
     result = [{"day": day, "income": str(data['income']), "expense": str(data['expense'])} for day, data in daily_summary.items()]
@@ -313,6 +411,7 @@ def daily_report(request):
     return success_response(data=result, message="获取月度报表成功。")
 
 @api_view(['GET'])
+@ledger_required(status_code=status.HTTP_404_NOT_FOUND)
 def total_expense_by_category(request):
     ledger_id = request.query_params.get('ledger_id')
     inOutType = request.query_params.get('inOutType')
@@ -323,25 +422,25 @@ def total_expense_by_category(request):
     if not all([ledger_id, inOutType, detail_type, month, year]):
         return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
 
-    # 验证账本存在并属于当前用户
     try:
-        ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-    except Ledger.DoesNotExist:
-        return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_404_NOT_FOUND)
+        month, year = int(month), int(year)
+    except ValueError:
+        return fail_response(message="无效的日期格式", status_code=status.HTTP_400_BAD_REQUEST)
 
-    # 计算
-    total_expense = Bill.objects.filter(
-        ledger_id=ledger_id,
-        ledger__user=request.user,
-        category__inOutType=inOutType,
-        category__detail_type=detail_type,
-        date__month=month,
-        date__year=year
-    ).aggregate(total_expense=Sum('amount'))['total_expense'] or Decimal('0.00')
+    # 从月度汇总表读取
+    total_expense = MonthlyCategoryTotal.objects.filter(
+        ledger_id=request.ledger_id,
+        year=year,
+        month=month,
+        inOutType=inOutType,
+        detail_type=detail_type
+    ).values_list('total', flat=True).first() or Decimal('0.00')
 
     return success_response(data={"total_expense": str(total_expense)}, message="获取类别总支出成功")
 
 @api_view(['GET'])
+@ledger_required(status_code=status.HTTP_404_NOT_FOUND)
+@conditional_on_ledger()
 def total_budget(request):
     ledger_id = request.query_params.get('ledger_id')
     month = request.query_params.get('month')
@@ -350,18 +449,67 @@ def total_budget(request):
     if not all([ledger_id, month, year]):
         return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
 
-    # 验证账本存在并属于当前用户
-    try:
-        ledger = Ledger.objects.get(id=ledger_id, user=request.user)
-    except Ledger.DoesNotExist:
-        return fail_response(message="账本不存在或无权限访问", status_code=status.HTTP_404_NOT_FOUND)
-
     # 计算
     total_budget = Budget.objects.filter(
-        ledger_id=ledger_id,
-        ledger__user=request.user,
+        ledger_id=request.ledger_id,
         month=month,
         year=year
     ).aggregate(total_budget=Sum('amount'))['total_budget'] or Decimal('0.00')
 
-    return success_response(data={"total_budget": str(total_budget)}, message="获取总预算成功")
\ No newline at end of file
+    return success_response(data={"total_budget": str(total_budget)}, message="获取总预算成功")
+
+
+@api_view(['GET'])
+@ledger_required(status_code=status.HTTP_404_NOT_FOUND)
+def balance_history(request):
+    ledger_id = request.query_params.get('ledger_id')
+    start = request.query_params.get('start')
+    end = request.query_params.get('end')
+
+    if not ledger_id:
+        return fail_response(message="参数不完整", status_code=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except ValueError:
+        return fail_response(message="无效的日期格式", status_code=status.HTTP_400_BAD_REQUEST)
+
+    # 区间汇总与每日累计余额都来自月末累计余额和每日余额表，不扫描账单
+    opening = balance.opening_balance(request.ledger_id, start)
+    totals = balance.range_totals(request.ledger_id, start, end, opening)
+    points = [
+        {
+            "date": day.isoformat(),
+            "income": str(income),
+            "expense": str(expense),
+            "balance": str(cum_income - cum_expense),
+        }
+        for day, income, expense, cum_income, cum_expense in balance.history(request.ledger_id, start, end, opening)
+    ]
+
+    result = {
+        "income": str(totals['income']),
+        "expense": str(totals['expense']),
+        "net": str(totals['net']),
+        "points": points,
+    }
+    return success_response(data=result, message="获取余额走势成功")
+
+
+@api_view(['GET'])
+def sync(request):
+    """
+    增量同步：返回序号大于 since 的账本、账单、预算变更及删除，每页至多 limit 条。
+    客户端保存返回的 cursor 作为下一次的 since，has_more 为真时继续请求；reset 为真时先清空本地数据。
+    """
+    try:
+        since = int(request.query_params.get('since', 0))
+        limit = int(request.query_params.get('limit', getattr(settings, 'SYNC_PAGE_SIZE', 200)))
+    except ValueError:
+        return fail_response(message="since 和 limit 必须是整数", status_code=status.HTTP_400_BAD_REQUEST)
+    if since < 0 or limit <= 0:
+        return fail_response(message="since 不能为负数，limit 必须大于 0", status_code=status.HTTP_400_BAD_REQUEST)
+
+    data = sync_changes.changes(request.user, since, min(limit, getattr(settings, 'SYNC_MAX_PAGE_SIZE', 1000)))
+    return success_response(data=data, message="获取变更成功")
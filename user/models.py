@@ -1,7 +1,21 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 import os
 from django.conf import settings
+from bill.deleting import deleting_owners
+
+
+class UserQuerySet(models.QuerySet):
+    def delete(self):
+        # 管理后台的批量删除走这里，级联删除账本、账单时不再逐笔维护汇总和记录删除
+        with deleting_owners(self.values_list('pk', flat=True)):
+            return super().delete()
+
+
+class UserQuerySetManager(UserManager.from_queryset(UserQuerySet)):
+    # 迁移中需要按名称引用管理器，不能直接使用 from_queryset() 动态生成的类
+    pass
+
 
 class User(AbstractUser):
 
@@ -20,9 +34,15 @@ class User(AbstractUser):
         default_permissions = ()
         db_table = 'user'
 
+    objects = UserQuerySetManager()
+
     def __str__(self):
         return self.username
 
+    def delete(self, *args, **kwargs):
+        with deleting_owners([self.pk]):
+            return super().delete(*args, **kwargs)
+
     def save(self, *args, **kwargs):
         try:
             this = User.objects.get(id=self.id)
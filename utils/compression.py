@@ -0,0 +1,70 @@
+"""
+按 Accept-Encoding 压缩响应：优先 brotli，其次 gzip。
+
+只压缩超过 COMPRESSION_MIN_SIZE 字节的非流式响应；流式响应（SSE、导出）逐块返回，不在这里处理。
+动态内容每次都要重新压缩，brotli 使用较低的质量等级，以压缩速度为主。
+"""
+import gzip
+
+import brotli
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+# 可以压缩的内容类型；图片等已压缩的格式不再处理
+_COMPRESSIBLE = ('application/json', 'application/msgpack', 'text/')
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回 q 值大于 0 的编码集合"""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """放在 MIDDLEWARE 的靠前位置（MetricsMiddleware 之后），对最终的响应内容压缩"""
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding') or response.status_code != 200:
+            return response
+        if not response.get('Content-Type', '').startswith(_COMPRESSIBLE):
+            return response
+        # 不管是否压缩，同一个 URL 的响应都随 Accept-Encoding 变化
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        if 'br' in accepted:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4))
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            compressed = gzip.compress(
+                response.content, compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), mtime=0,
+            )
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = encoding
+        # 压缩后字节不同，强 ETag 改为弱 ETag（与 Django 的 GZipMiddleware 相同）
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,231 @@
+"""
+进程内的 Prometheus 指标：各接口的请求耗时、每个请求的 SQL 次数与耗时、AI 调用的耗时与 token 用量。
+
+记录一次指标只是一次加锁的字典更新，可以在生产环境常开；GET /metrics 以 Prometheus 文本格式输出。
+多进程部署时各进程分别统计，由 Prometheus 按实例抓取后再汇总。
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+REGISTRY = []
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _items(self):
+        with self._lock:
+            return [(key, self._copy(value)) for key, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._items():
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # 第一个上界不小于 value 的桶；超过所有上界时落在最后的 +Inf 桶
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @staticmethod
+    def _copy(value):
+        return list(value[0]), value[1]
+
+    def samples(self):
+        for key, (counts, total) in self._items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + [('le', _format(bound))], cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    """按 Prometheus 文本格式（0.0.4）输出所有指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{label}="{_escape(text)}"' for label, text in labels)
+            lines.append(f'{name}{{{label_text}}} {_format(value)}' if label_text else f'{name} {_format(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', '请求耗时（流式响应为开始返回响应的时间）',
+    ('view', 'method', 'status'),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', '每个请求执行的 SQL 条数', ('view',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+REQUEST_DB_SECONDS = Counter('http_request_db_seconds_total', '请求中执行 SQL 的累计耗时', ('view',))
+
+LLM_CALL_SECONDS = Histogram(
+    'ai_llm_call_duration_seconds', 'AI 调用（含重试）的耗时', ('purpose', 'outcome'),
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+LLM_RETRIES = Counter('ai_llm_retries_total', 'AI 调用的重试次数', ('purpose',))
+LLM_TOKENS = Counter('ai_llm_tokens_total', 'AI 调用的 token 用量，cached 为命中上游前缀缓存的输入 token', ('purpose', 'type'))
+
+
+# 当前请求的 SQL 统计；异步视图中 sync_to_async 会把上下文带到执行 ORM 的线程里
+_request_queries = ContextVar('metrics_request_queries', default=None)
+
+
+class _QueryStats:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    stats = _request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    began = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - began
+
+
+def _install_db_wrapper(sender, connection, **kwargs):
+    # 数据库连接按线程创建，在每个新连接上挂上统计 SQL 的 execute wrapper
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+connection_created.connect(_install_db_wrapper, dispatch_uid='utils.metrics')
+# 导入本模块之前当前线程已经建立的连接
+for _connection in connections.all(initialized_only=True):
+    _install_db_wrapper(None, _connection)
+
+_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'}
+
+
+class MetricsMiddleware:
+    """
+    按 URL 名称记录请求耗时、SQL 条数与耗时，同时支持同步和异步请求；放在 MIDDLEWARE 的最前面。
+    未匹配到路由的请求统一记为 unmatched，避免标签数量无限增长。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, began = _QueryStats(), time.perf_counter()
+        token = _request_queries.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self._record(request, response, stats, began)
+        return response
+
+    async def __acall__(self, request):
+        stats, began = _QueryStats(), time.perf_counter()
+        token = _request_queries.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self._record(request, response, stats, began)
+        return response
+
+    @staticmethod
+    def _record(request, response, stats, began):
+        match = request.resolver_match
+        view = (match.url_name or match.route) if match else 'unmatched'
+        method = request.method if request.method in _METHODS else 'other'
+        REQUEST_SECONDS.observe(time.perf_counter() - began, view=view, method=method, status=response.status_code)
+        REQUEST_QUERIES.observe(stats.count, view=view)
+        REQUEST_DB_SECONDS.inc(stats.seconds, view=view)
+
+
+def metrics_view(request):
+    """
+    GET /metrics：需要携带 Authorization: Bearer <METRICS_TOKEN>。
+    没有配置 METRICS_TOKEN 时只在 DEBUG 下开放，否则返回 404，避免指标（接口、SQL 条数、LLM 用量）被公开访问。
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.encode(), token.encode()):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        raise Http404()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,53 @@
+"""
+替换 DRF 默认 JSONRenderer 的渲染器：orjson 输出 JSON，另外提供 MessagePack 供移动端通过 Accept 协商使用。
+
+输出与 DRF 的 JSONRenderer 保持一致：日期时间交给 DRF 的编码规则（UTC 输出为 Z 结尾），
+唯一的区别是 Decimal 输出为字符串而不是浮点数，与序列化器对金额的处理一致，不会丢失精度。
+"""
+from decimal import Decimal
+
+import msgpack
+import orjson
+from django.utils.http import parse_header_parameters
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_drf_encoder = JSONEncoder()
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    # 日期时间、惰性翻译字符串、QuerySet 等沿用 DRF 的编码方式
+    return _drf_encoder.default(obj)
+
+
+_ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = _ORJSON_OPTIONS
+        # 与 JSONRenderer 一样支持 Accept: application/json; indent=N，orjson 只支持两个空格的缩进
+        if accepted_media_type and 'indent' in parse_header_parameters(accepted_media_type)[1]:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Accept: application/msgpack 时使用，结构与 JSON 响应相同"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True, datetime=False)
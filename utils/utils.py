@@ -1,6 +1,17 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import status
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 def success_response(data=None, message="操作成功", status_code=status.HTTP_200_OK):
     return Response({
@@ -58,3 +69,64 @@ def custom_exception_handler(exc, context):
         }
 
     return response
+
+
+def _render(request, response):
+    # 在 DRF 视图之外使用 success_response / fail_response 时，需要手动按 Accept 选择渲染器（不含可浏览 API）
+    if isinstance(response, Response) and not response.is_rendered:
+        renderers = [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES if renderer.format != 'api']
+        try:
+            renderer, media_type = DefaultContentNegotiation().select_renderer(request, renderers)
+        except NotAcceptable:
+            renderer, media_type = renderers[0], renderers[0].media_type
+        response.accepted_renderer = renderer
+        response.accepted_media_type = media_type
+        response.renderer_context = {}
+        response.render()
+        patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def _parse_body(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def async_api_view(http_method_names):
+    """
+    异步视图使用的 api_view：DRF 的 api_view 不支持 async def 视图。
+    负责请求方法检查、JWT 认证、解析请求体（request.data / request.query_params），
+    并把视图返回的 success_response / fail_response 按 Accept 渲染（JSON 或 MessagePack），返回格式与同步接口一致。
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # 选择渲染器时也会用到 query_params（?format=）
+            request.query_params = request.GET
+            if request.method not in http_method_names:
+                return _render(request, fail_response(message="请求方法不允许", status_code=status.HTTP_405_METHOD_NOT_ALLOWED))
+
+            try:
+                user_auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+            except AuthenticationFailed as e:
+                user_auth, errors = None, e.detail
+            else:
+                errors = {"detail": "身份认证信息未提供。"}
+            if user_auth is None:
+                return _render(request, fail_response(
+                    message="身份认证失败，请提供有效的认证信息。",
+                    errors=errors,
+                    status_code=status.HTTP_401_UNAUTHORIZED
+                ))
+            request.user, request.auth = user_auth
+
+            try:
+                request.data = _parse_body(request)
+            except ValueError:
+                return _render(request, fail_response(message="请求参数无效。", status_code=status.HTTP_400_BAD_REQUEST))
+
+            return _render(request, await view(request, *args, **kwargs))
+        return wrapper
+    return decorator